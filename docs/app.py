@@ -2,6 +2,15 @@
 # -*- coding: utf-8 -*-
 """Real-time prediction tool for DeepVentilation.
 
+The app is created by create_app(), which loads the model once, warms it up and
+imports heavy modules (TensorFlow) only if needed. It can be used as entry
+point by a WSGI server, e.g. 'gunicorn "app:create_app()"'.
+
+Models are versioned by the registry in registry.py. A new version can be
+loaded in the background and swapped in through the /models endpoints, and
+requests can pin a version with the query parameter 'version'. With several
+worker processes (serve.py), the changes are applied by all workers.
+
 Author:   
     Erik Johannes Husom
 
@@ -9,49 +18,529 @@ Created:
     2020-12-02
 
 """
+import argparse
+import json
+import sys
 import time
 
-from flask import Flask, abort, jsonify
+startup_start = time.perf_counter()
+
+from flask import Flask, Response, abort, g, jsonify
 from flask import request
-import joblib
-import matplotlib.pyplot as plt
+from flask_sock import Sock
 import numpy as np
-import pandas as pd
-from tensorflow.keras import models
+
+from metrics import Metrics, SampledLogger
+import model_loader
+from model_loader import PATH, feature_params, hist_size, load_model
+from preprocess.features import complete_rows, compute_features, engine_params
+from registry import DEFAULT_VERSION, ModelRegistry
+from sessions import Session, SessionStore
+from wire import BINARY_MIMETYPE, accepts_binary, decode_samples
+from wire import encode_estimates
 
 app = Flask(__name__)
+sock = Sock(app)
+
+# The model folder (PATH), the inference backend and the precision of the
+# weights are set in model_loader.py.
+
+# Model version loaded at startup. Versions are folders in PATH, except for
+# the version "default", which is the model files directly in PATH.
+model_version = DEFAULT_VERSION
+
+# Requests arriving within 'batch_timeout' seconds of each other, up to
+# 'max_batch_size' windows, are estimated in a single forward pass.
+max_batch_size = 32
+batch_timeout = 0.005
+
+# Streaming sessions idle for longer than this many seconds are closed.
+session_timeout = 60
+
+# Only one of this many estimations is logged, to keep the hot path fast.
+log_every = 100
+
+sessions = SessionStore(timeout=session_timeout)
+
+# Set by create_app()
+registry = None
+
+# Set by serve.py in each worker process: function sending a change of the
+# model versions to all workers, which apply it with apply_registry_change().
+# If None, changes are applied in this process only.
+share_registry_change = None
 
-PATH = "model/"
-hist_size = 50
+startup_times = {}
+"""Seconds spent on each step of the startup, to catch cold-start
+regressions."""
+
+metrics = Metrics(max_batch_size)
+metrics.gauge("queue_depth",
+        lambda: 0 if registry is None else registry.queue_depth)
+metrics.gauge("open_sessions", lambda: len(sessions))
+
+estimation_log = SampledLogger("deepventilation", every=log_every)
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    # Each message of a streaming connection is observed by stream(), so the
+    # lifetime of the connection is not counted as a request
+    if "start" in g and request.endpoint != "stream":
+        metrics.observe_request(
+            request.endpoint, time.perf_counter() - g.start
+        )
+
+    return response
 
 @app.route("/")
 def index():
     return "Hello, World!"
 
 """
-Input : array of breathing value of the size of historic_size
-Output: airflow estimation + time of execution
+Output: latency histograms (with p50/p95/p99) per processing stage and
+        endpoint, batch sizes, queue depth and requests per second, in the
+        Prometheus text format
+"""
+@app.route("/metrics")
+def get_metrics():
+    return Response(metrics.exposition(),
+            mimetype="text/plain; version=0.0.4")
+
+"""
+Output: whether the model is loaded and warmed up, and the startup times
+"""
+@app.route("/ready")
+def ready():
+    if "total" not in startup_times:
+        return jsonify({"ready" : False}), 503
+
+    return jsonify({
+        "ready" : True,
+        "backend" : model_loader.backend,
+        "version" : registry.active,
+        "startup_times" : startup_times,
+    })
+
+"""
+Output: the active model version, the versions being loaded, and the loaded
+        versions with their feature configuration
+"""
+@app.route("/models")
+def listModels():
+    return jsonify(registry.info())
+
+"""
+Load a model version in the background. It is made the active version when
+it is ready, unless the query parameter 'activate' is false. Requests are
+served by the current version meanwhile.
+"""
+@app.route("/models/<version>", methods=["POST"])
+def loadModel(version):
+    activate = request.args.get("activate", "true").lower() != "false"
+
+    try:
+        registry.version_path(version)
+        change_registry({
+            "action" : "load", "version" : version, "activate" : activate
+        })
+    except ValueError:
+        abort(400)
+
+    return jsonify({"version" : version, "loading" : True}), 202
+
+@app.route("/models/<version>/activate", methods=["POST"])
+def activateModel(version):
+    try:
+        registry.get(version)
+        change_registry({"action" : "activate", "version" : version})
+    except KeyError:
+        abort(404)
+
+    return jsonify({"active" : version})
+
+@app.route("/models/<version>", methods=["DELETE"])
+def unloadModel(version):
+    try:
+        registry.get(version)
+
+        # Checked before the change is sent to the other workers
+        if version == registry.active:
+            raise ValueError("The active version cannot be unloaded.")
+
+        change_registry({"action" : "unload", "version" : version})
+    except KeyError:
+        abort(404)
+    except ValueError:
+        abort(409)
+
+    return jsonify({"version" : version})
+
+"""
+Input : array of breathing value of the size of historic_size, as JSON or as
+        little-endian int16 (application/octet-stream)
+Output: airflow estimation + time of execution, as JSON or as float32
 """
 @app.route("/getEstimation", methods=["POST"])
 def getEstimation():
     t = time.time()
-    # print(request.json)
-    if not request.json or not "value" in request.json or len(request.json["value"]) < hist_size:
+
+    version = requested_version()
+
+    with metrics.timer("parse"):
+        values = read_values()
+
+    if len(values) < version.hist_size:
         abort(400)
 
-    print(request.json["value"])
-    X = np.array(request.json["value"]).reshape(-1, 1)
-    X = preprocess(X)
-    # X = scale(X)
-    X = np.array([X])
+    with metrics.timer("preprocess"):
+        X = window(values, version)
+        # X = scale(X)
+
+    with metrics.timer("inference"):
+        y = version.batcher.predict(X)
+        y = y[0]
 
-    y = model.predict(X)
-    y = y[0][0]
-    print(y)
+    estimation_log.log("Values: %s, airflow: %s", values, y)
 
     t = time.time() - t 
 
-    return jsonify({"airflow" : str(y),"time" : str(t)})
+    with metrics.timer("serialize"):
+        return respond(y, t, version.name)
+
+"""
+Input : list of arrays of breathing values, each of the size of historic_size,
+        as JSON or as little-endian int16 windows of equal size given by the
+        query parameter 'window_size'
+Output: one airflow estimation per array + time of execution, as JSON or as
+        float32
+"""
+@app.route("/getEstimationBatch", methods=["POST"])
+def getEstimationBatch():
+    t = time.time()
+    version = requested_version()
+
+    with metrics.timer("parse"):
+        if request.mimetype == BINARY_MIMETYPE:
+            window_size = request.args.get("window_size", type=int)
+
+            if not window_size:
+                abort(400)
+
+            values = read_values()
+
+            if len(values) == 0 or len(values) % window_size != 0:
+                abort(400)
+
+            values = values.reshape(-1, window_size)
+        else:
+            if (not request.json or not "values" in request.json
+                    or len(request.json["values"]) == 0):
+                abort(400)
+
+            values = request.json["values"]
+
+    windows = []
+
+    with metrics.timer("preprocess"):
+        for value in values:
+            if len(value) < version.hist_size:
+                abort(400)
+
+            windows.append(window(value, version))
+
+    with metrics.timer("inference"):
+        y = version.batcher.predict_many(np.array(windows))
+        y = y[:, 0]
+
+    t = time.time() - t
+
+    with metrics.timer("serialize"):
+        return respond(y, t, version.name)
+
+"""
+Open a streaming session, to which only new breathing values are pushed. The
+session is pinned to the requested or active model version, which keeps
+serving it until it is closed, even if the version is replaced or unloaded.
+Output: session id + model version
+"""
+@app.route("/session", methods=["POST"])
+def openSession():
+    version = requested_version()
+
+    return jsonify({
+        "session" : sessions.create(**session_params(version)),
+        "version" : version.name,
+    })
+
+"""
+Input : array of new breathing values since the last push, as JSON or as
+        little-endian int16
+Output: airflow estimation (null, or NaN as float32, until enough values are
+        pushed) + time of execution
+"""
+@app.route("/session/<session_id>", methods=["POST"])
+def pushSession(session_id):
+    t = time.time()
+
+    session = sessions.get(session_id)
+
+    if session is None:
+        abort(404)
+
+    with metrics.timer("parse"):
+        values = read_values()
+
+    try:
+        y, version = estimate_session(session, values)
+    except KeyError:
+        # The session has been closed meanwhile
+        abort(404)
+    except (ValueError, TypeError):
+        abort(400)
+
+    t = time.time() - t
+
+    with metrics.timer("serialize"):
+        return respond(y, t, version.name)
+
+@app.route("/session/<session_id>", methods=["DELETE"])
+def closeSession(session_id):
+    if not sessions.close(session_id):
+        abort(404)
+
+    return jsonify({"session" : session_id})
+
+"""
+Streaming connection (WebSocket). Each message from the client contains new
+breathing values, either as a JSON object ({"value": [...]}) or as a binary
+message of little-endian int16. It is answered on the same connection with
+the airflow estimation (null until enough values are received) + time of
+execution as JSON, or with the estimation as float32 (NaN until enough values
+are received) for binary messages. Invalid messages are answered with an
+error as JSON ({"error": "..."}), also for binary messages. The connection is
+pinned to the requested or active model version.
+"""
+@sock.route("/stream")
+def stream(ws):
+    try:
+        with registry.hold(request.args.get("version")) as version:
+            session = Session(**session_params(version))
+    except KeyError:
+        return
+
+    try:
+        while True:
+            message = ws.receive()
+            t = time.time()
+            binary = isinstance(message, bytes)
+
+            try:
+                with metrics.timer("parse"):
+                    if binary:
+                        values = decode_samples(message)
+                    else:
+                        values = json.loads(message)["value"]
+
+                y, _ = estimate_session(session, values)
+            except (ValueError, KeyError, TypeError) as e:
+                # Invalid messages are answered with an error, as the HTTP
+                # endpoints answer them with 400, and the connection is kept
+                ws.send(json.dumps({
+                    "error" : "Invalid message: {}".format(e)
+                }))
+                continue
+
+            t = time.time() - t
+
+            with metrics.timer("serialize"):
+                if binary:
+                    response = encode_estimates(y)
+                else:
+                    response = json.dumps({
+                        "airflow" : None if y is None else str(y),
+                        "time" : str(t)
+                    })
+
+            ws.send(response)
+            metrics.observe_request("stream", t)
+    finally:
+        session.close()
+
+def requested_version():
+    """Look up the model version pinned by the query parameter 'version'.
+
+    The version is held until the request is done, so it is not stopped if
+    it is replaced or unloaded meanwhile.
+
+    Returns:
+        version (ModelVersion): The requested version, or the active version
+            if none is requested.
+
+    """
+
+    try:
+        version = registry.acquire(request.args.get("version"))
+    except KeyError:
+        abort(404)
+
+    g.setdefault("versions", []).append(version)
+
+    return version
+
+@app.teardown_request
+def release_versions(exception):
+    for version in g.pop("versions", []):
+        version.release()
+
+def change_registry(change):
+    """Change the model versions, in all worker processes if there are
+    several.
+
+    Args:
+        change (dict): Change, see apply_registry_change().
+
+    """
+
+    if share_registry_change is None:
+        apply_registry_change(change)
+    else:
+        share_registry_change(change)
+
+def apply_registry_change(change):
+    """Apply a change of the model versions to the registry of this process.
+
+    Args:
+        change (dict): The 'action' ("load", "activate" or "unload") and the
+            'version' it applies to. For "load", 'activate' tells whether to
+            make the version the active one when it is loaded.
+
+    Raises:
+        KeyError: If the version to activate or unload is not loaded.
+        ValueError: If the version is invalid, or is active and cannot be
+            unloaded.
+
+    """
+
+    action = change["action"]
+    version = change["version"]
+
+    if action == "load":
+        registry.load_async(version, change.get("activate", True))
+    elif action == "activate":
+        registry.activate(version)
+    elif action == "unload":
+        registry.unload(version)
+    else:
+        raise ValueError(f"Unknown registry change: {action}")
+
+def session_params(version):
+    """Arguments of a streaming session pinned to a model version."""
+
+    return {
+        "hist_size" : version.hist_size,
+        "version" : version,
+        **engine_params(version.feature_params),
+    }
+
+def read_values():
+    """Read breathing values from the request body.
+
+    Returns:
+        values (array): Values from a binary body, or from the field 'value'
+            of a JSON body.
+
+    """
+
+    if request.mimetype == BINARY_MIMETYPE:
+        try:
+            return decode_samples(request.get_data())
+        except ValueError:
+            abort(400)
+
+    if not request.json or not "value" in request.json:
+        abort(400)
+
+    return np.asarray(request.json["value"])
+
+def respond(y, t, version):
+    """Return airflow estimation(s) in the format accepted by the client.
+
+    Args:
+        y (float, array or None): Airflow estimation(s). None means that no
+            estimation is available yet.
+        t (float): Time of execution.
+        version (str): Model version that made the estimation.
+
+    Returns:
+        response: Packed float32 if the client accepts binary responses, with
+            the time of execution in the header 'X-Estimation-Time' and the
+            model version in 'X-Model-Version', otherwise JSON.
+
+    """
+
+    if accepts_binary(request.accept_mimetypes):
+        response = Response(encode_estimates(y), mimetype=BINARY_MIMETYPE)
+        response.headers["X-Estimation-Time"] = str(t)
+        response.headers["X-Model-Version"] = version
+
+        return response
+
+    if y is None:
+        airflow = None
+    elif np.ndim(y) > 0:
+        airflow = [str(v) for v in y]
+    else:
+        airflow = str(y)
+
+    return jsonify({"airflow" : airflow, "time" : str(t), "version" : version})
+
+def estimate_session(session, values):
+    """Push new values to a streaming session and estimate airflow.
+
+    Args:
+        session (Session): Streaming session.
+        values (list): New breathing values.
+
+    Returns:
+        y (float): Airflow estimation, or None if the session does not yet
+            hold a full history window.
+        version (ModelVersion): Model version the session is pinned to.
+
+    Raises:
+        KeyError: If the session is closed.
+
+    """
+
+    with metrics.timer("preprocess"):
+        with session.lock:
+            version = session.version
+
+            if version is None:
+                raise KeyError("The session is closed.")
+
+            session.push(values)
+            X = session.window()
+
+            # Held until the estimation is done, in case the session is
+            # closed meanwhile
+            version.acquire()
+
+    try:
+        if X is None:
+            return None, version
+
+        with metrics.timer("inference"):
+            y = version.batcher.predict(X)[0]
+    finally:
+        version.release()
+
+    estimation_log.log("Values: %s, airflow: %s", values, y)
+
+    return y, version
 
 def test(X):
 
@@ -63,97 +552,141 @@ def test(X):
 
     X = np.array([X])
     np.save("X_app", X)
-    y = model.predict(X)
+    y = registry.get().model.predict(X)
     print(y[0][0])
 
-def preprocess(X):
+def preprocess(X, feature_params=feature_params, hist_size=hist_size):
     """Preprocess input data.
 
+    The features are computed by the same code as in the featurize stage. If
+    more values than needed are given, the newest value is only used as
+    lookahead for the gradient, which then matches the offline features.
+
     Args:
         X (numpy array): Input.
+        feature_params (dict): The 'featurize' parameters of the model.
+        hist_size (int): Number of feature rows in each estimation window.
 
     Returns:
         numpy array: Preprocessed inputs.
 
     """
 
-    df = pd.DataFrame(X, columns=["ribcage"])
-    df.dropna(inplace=True)
-    breathing_min = 0
-    breathing_max = 4096
-    breathing_range = breathing_max - breathing_min
-    df["ribcage"] = (df["ribcage"] - breathing_min)/breathing_range
-
-    df["ribcage_gradient"] = np.gradient(df["ribcage"])
+    X = np.asarray(X, dtype=np.float64).reshape(-1)
+    X = X[~np.isnan(X)]
 
-    df["ribcage_slope_sin"] = np.sin(
-            calculate_slope(df["ribcage"], shift=1,
-                rolling_mean_window=1, absvalue=False)
-    )
-    df["ribcage_slope_cos"] = np.cos(
-            calculate_slope(df["ribcage"], shift=1,
-                rolling_mean_window=1, absvalue=False)
-    )
+    X, _ = compute_features(X, **engine_params(feature_params))
+    X = complete_rows(X)
 
-    del df["ribcage"]
+    if len(X) > hist_size and "ribcage_gradient" in feature_params["features"]:
+        X = X[:-1]
 
-    # df.fillna(method="bfill", inplace=True)
-    df.dropna(inplace=True)
-    df = df.iloc[-50:,:]
+    return X[-hist_size:]
 
-    return np.array(df)
+def window(values, version):
+    """Preprocess breathing values into one estimation window.
 
-def scale(X):
-    """Scale inputs.
+    The values must give hist_size complete feature rows. Fewer rows are
+    complete if rolling features are undefined at the start of the values,
+    and such windows could not be batched with full ones.
 
     Args:
-        X (numpy array): Inputs to scale.
+        values (list): Breathing values.
+        version (ModelVersion): Model version to estimate with.
+
+    Returns:
+        X (numpy array): Window of shape (hist_size, n_features).
 
     """
 
-    return scaler.transform(X)
+    X = preprocess(values, version.feature_params, version.hist_size)
 
-def calculate_slope(data, shift=1, rolling_mean_window=1, absvalue=False):
-    """Calculate slope.
+    if X.ndim != 2 or len(X) != version.hist_size:
+        abort(400)
 
-    Args:
-        data (array): Data for slope calculation.
-        shift (int): How many steps backwards to go when calculating the slope.
-            For example: If shift=2, the slope is calculated from the data
-            point two time steps ago to the data point at the current time
-            step.
-        rolling_mean_window (int): Window for calculating rolling mean.
+    return X
 
-    Returns:
-        slope (array): Array of slope angle.
+def warm_up(version):
+    """Run estimations on a synthetic breathing signal.
+
+    The first estimations pay one-time costs, such as graph tracing in
+    TensorFlow, which should not be paid by the first request.
+
+    Args:
+        version (ModelVersion): Model version to warm up.
 
     """
 
-    v_dist = data - data.shift(shift)
-    h_dist = 0.1 * shift
+    # Breathing with a period of 4 seconds, sampled at 10 Hz
+    t = np.arange(1000)
+    values = 2048 + 200 * np.sin(2 * np.pi * t / 40)
 
-    slope = np.arctan(v_dist / h_dist)
+    X = preprocess(values, version.feature_params, version.hist_size)
 
-    if absvalue:
-        slope = np.abs(slope)
+    version.batcher.predict(X)
+    version.batcher.predict_many(
+        np.repeat(X[np.newaxis], max_batch_size, axis=0)
+    )
 
-    slope = slope.rolling(rolling_mean_window).mean()
+def create_app():
+    """Load and warm up the model, and return the app.
 
-    return slope
+    The model is only loaded the first time the function is called.
 
+    Returns:
+        app (Flask): The app, ready to serve requests.
+
+    """
+
+    global registry
+
+    if registry is not None:
+        return app
 
-"""
-This function load all the models form the file one time before the lauch of the app 
-"""
-if __name__ == "__main__":
     # Load scaler
+    # import joblib
     # scaler = joblib.load(PATH + "scaler.sav")
     # print("Scaler load successfully")
 
-    # Load model
-    model = models.load_model(PATH + "model.h5")
+    registry = ModelRegistry(PATH, load_model, feature_params, hist_size,
+            warm_up=warm_up, max_batch_size=max_batch_size,
+            max_latency=batch_timeout, on_batch=metrics.batch_size.observe)
+
+    version = registry.load(model_version)
     print("Model loaded successfully")
-    print(model.summary())
+
+    startup_times.update(version.load_times)
+
+    startup_times["total"] = time.perf_counter() - startup_start
+    print("Startup times (s): {}".format(startup_times))
+
+    return app
+
+def scale(X):
+    """Scale inputs.
+
+    Args:
+        X (numpy array): Inputs to scale.
+
+    """
+
+    return scaler.transform(X)
+
+startup_times["import"] = time.perf_counter() - startup_start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Airflow estimation server")
+    parser.add_argument("--measure-startup", action="store_true",
+            help="print the startup times and exit")
+    args = parser.parse_args()
+
+    create_app()
+
+    if args.measure_startup:
+        sys.exit(0)
+
+    print(registry.get().model.summary())
 
     # Start the app
     app.run(debug=True, port=5000)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Dynamic micro-batching of airflow estimations.
+
+Requests that arrive within a short time budget are stacked into one input
+tensor of shape (N, hist_size, n_features), which goes through a single
+forward pass. Each caller receives only its own part of the result.
+
+Example:
+
+    >>> batcher = MicroBatcher(model.predict_on_batch, max_batch_size=32,
+    ...     max_latency=0.005)
+    >>> y = batcher.predict(X)
+
+"""
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Collect estimation requests and run them as batched forward passes.
+
+    A single background thread owns the model. It waits for the first
+    request, then keeps collecting requests until either `max_batch_size`
+    windows are gathered or `max_latency` seconds have passed since the first
+    request arrived.
+
+    Args:
+        predict (callable): Function taking an array of shape
+            (N, hist_size, n_features) and returning an array with N rows.
+        max_batch_size (int): Maximum number of windows in one forward pass.
+            An explicit batch larger than this is still run as one pass.
+        max_latency (float): Time budget in seconds for collecting a batch.
+        on_batch (callable): Optional function called with the number of
+            windows in each forward pass, e.g. for metrics.
+
+    """
+
+    def __init__(self, predict, max_batch_size=32, max_latency=0.005,
+            on_batch=None):
+
+        self.predict_fn = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.on_batch = on_batch
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, X):
+        """Queue one window for estimation.
+
+        Args:
+            X (array): Window of shape (hist_size, n_features).
+
+        Returns:
+            future (Future): Resolves to the output row for the window, or
+                fails with RuntimeError if the batcher is stopped.
+
+        """
+
+        return self._put(np.asarray(X)[np.newaxis], True)
+
+    def submit_many(self, X):
+        """Queue several windows, which are kept together in one batch.
+
+        Args:
+            X (array): Windows of shape (N, hist_size, n_features).
+
+        Returns:
+            future (Future): Resolves to the N output rows, or fails with
+                RuntimeError if the batcher is stopped.
+
+        """
+
+        return self._put(np.asarray(X), False)
+
+    def _put(self, X, single):
+        """Queue windows, unless the batcher is stopped."""
+
+        future = Future()
+
+        with self._lock:
+            if self._stopped:
+                future.set_exception(RuntimeError("The batcher is stopped."))
+            else:
+                self._queue.put((X, future, single))
+
+        return future
+
+    def predict(self, X, timeout=None):
+        """Estimate one window, blocking until the result is ready."""
+
+        return self.submit(X).result(timeout)
+
+    def predict_many(self, X, timeout=None):
+        """Estimate several windows, blocking until the result is ready."""
+
+        return self.submit_many(X).result(timeout)
+
+    @property
+    def queue_depth(self):
+        """Number of requests waiting to be batched."""
+
+        return self._queue.qsize()
+
+    def stop(self):
+        """Stop the batching thread after the queued requests are done.
+
+        Requests submitted after this fail.
+
+        """
+
+        with self._lock:
+            if self._stopped:
+                return
+
+            self._stopped = True
+            self._queue.put(None)
+
+        self._thread.join()
+
+    def _run(self):
+
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                break
+
+            batch = [item]
+            n_windows = len(item[0])
+            deadline = time.monotonic() + self.max_latency
+            stop = False
+
+            while n_windows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+                if item is None:
+                    stop = True
+                    break
+
+                batch.append(item)
+                n_windows += len(item[0])
+
+            self._process(batch)
+
+            if stop:
+                break
+
+    def _process(self, batch):
+        """Run the forward passes of a batch and hand each caller its rows.
+
+        Windows of different shapes cannot be stacked, so each shape is run
+        as a separate forward pass.
+
+        """
+
+        batch = [item for item in batch
+                if item[1].set_running_or_notify_cancel()]
+        groups = {}
+
+        for item in batch:
+            groups.setdefault(item[0].shape[1:], []).append(item)
+
+        for group in groups.values():
+            self._forward(group)
+
+    def _forward(self, batch):
+        """Run one forward pass over windows of the same shape.
+
+        Errors are set on the futures of the batch, so the batching thread
+        keeps running.
+
+        """
+
+        try:
+            X = np.concatenate([X for X, _, _ in batch])
+
+            if self.on_batch is not None:
+                self.on_batch(len(X))
+
+            y = np.asarray(self.predict_fn(X))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        start = 0
+
+        for X, future, single in batch:
+            end = start + len(X)
+            future.set_result(y[start] if single else y[start:end])
+            start = end
@@ -1,37 +1,94 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""One-liner describing module.
+"""Check that app.py computes the same inputs as the offline pipeline.
 
-Longer description.
+The features of a recording are computed over the whole series, as in the
+featurize stage, and split into windows of 'hist_size' rows. Every window is
+then computed again as the server does it, both from the raw values of a
+getEstimation request and through a streaming session, and compared
+bit-for-bit with the offline window.
 
 Example:
 
-    >>>
+    $ python compare.py 5.csv
 
-Attributes:
+"""
+import sys
 
+import numpy as np
 
-TODO:
+import app
+from preprocess.features import compute_features, engine_params
+from sessions import Session
 
 
-Author:   
-    Erik Johannes Husom
+def compare(filepath, packet_size=7):
+    """Compare offline and server features for a recording.
 
-Created:  
-    2020-09-18
+    Args:
+        filepath (str): Path to recording, with the columns time, airflow,
+            ribcage and heartrate.
+        packet_size (int): Number of samples pushed to the streaming session
+            at a time.
 
-"""
+    Returns:
+        equal (bool): Whether all windows are bit-for-bit equal.
 
+    """
+
+    hist_size = app.hist_size
+    params = engine_params(app.feature_params)
+
+    ribcage = np.loadtxt(filepath, delimiter=",", usecols=2)
+
+    X, _ = compute_features(ribcage, **params)
+    complete = ~np.isnan(X).any(axis=1)
+    warmup = np.argmax(complete)
+
+    # Sample index of the last row of each window. The last sample of the
+    # recording is excluded, since it has no successor for the gradient.
+    ends = np.arange(warmup + hist_size - 1, len(ribcage) - 1)
+
+    n_mismatch = 0
+
+    for end in ends:
+        request = ribcage[end - hist_size + 1 - warmup:end + 2]
+
+        if not np.array_equal(app.preprocess(request),
+                X[end - hist_size + 1:end + 1]):
+            n_mismatch += 1
+
+    print("{}: getEstimation, {} windows, {} mismatches".format(
+        filepath, len(ends), n_mismatch
+    ))
+
+    session = Session(hist_size, **params)
+    n_windows = 0
+    n_session_mismatch = 0
+
+    for start in range(0, len(ribcage), packet_size):
+        session.push(ribcage[start:start + packet_size])
+        window = session.window()
+        end = min(start + packet_size, len(ribcage)) - 2
+
+        if window is None:
+            continue
+
+        n_windows += 1
+
+        if not np.array_equal(window, X[end - hist_size + 1:end + 1]):
+            n_session_mismatch += 1
+
+    print("{}: session, {} windows, {} mismatches".format(
+        filepath, n_windows, n_session_mismatch
+    ))
+
+    return n_mismatch == 0 and n_session_mismatch == 0
 
-import numpy as np
-import matplotlib.pyplot as plt
 
-X_app = np.load("X_app.npy")
-X_model = np.load("X_model.npy")
+if __name__ == "__main__":
 
-print(X_app.shape)
-print(X_model.shape)
+    filepaths = sys.argv[1:] if len(sys.argv) > 1 else ["5.csv"]
 
-plt.plot(X_app[0])
-plt.plot(X_model[0], "r--")
-plt.show()
+    if not all([compare(filepath) for filepath in filepaths]):
+        sys.exit(1)
@@ -19,6 +19,8 @@ limitations under the License.
 */
 
 var flowRibcageCharacteristic;
+var estimationSocketUrl = 'ws://127.0.0.1:5000/stream';
+var estimationSocket = null;
 var ribcageValues = [];
 var airflowValues = [];
 var recentAirflow = [];
@@ -51,6 +53,11 @@ async function onFlowRibcageButtonClick() {
         console.log('Getting Characteristic...');
         flowRibcageCharacteristic = await service.getCharacteristic(characteristicUuid);
 
+        console.log('Connecting to estimation server...');
+        estimationSocket = new WebSocket(estimationSocketUrl);
+        estimationSocket.binaryType = 'arraybuffer';
+        estimationSocket.addEventListener('message', handleAirflowEstimate);
+
         await flowRibcageCharacteristic.startNotifications();
 
         console.log('> Notifications started');
@@ -71,6 +78,10 @@ async function onStopFlowRibcageClick() {
       console.log('> Notifications stopped');
       flowRibcageCharacteristic.removeEventListener('characteristicvaluechanged',
           handleFlowRibcageNotifications);
+      if (estimationSocket !== null) {
+        estimationSocket.close();
+        estimationSocket = null;
+      }
     } catch(error) {
       console.log('Argh! ' + error);
     }
@@ -111,70 +122,63 @@ function handleFlowRibcageNotifications(event) {
     }
     drawWaves(ribcagePlotValues, ribcageCanvas, 1, 6.0);
 
-    // Predicting airflow
-    if (ribcageValues.length > 50 ){
+    // Predicting airflow. Only the new values are sent to the server, which
+    // keeps the history needed for the estimation window. The estimate comes
+    // back on the same connection. The samples are sent as raw int16, and
+    // the estimate is received as float32.
+    if (estimationSocket !== null
+            && estimationSocket.readyState === WebSocket.OPEN) {
+        estimationSocket.send(int16View.slice(0, 7));
+    }
 
-        // let inputValues = ribcageValues.slice(-51, -1).map(function(element) {
-            // return (
+    // if (airflowValues.length > 64) {
+    if (airflowValues.length > 20) {
+        airflowValues.shift();
+    }
+    if (recentAirflow.length > 5) {
+        recentAirflow.shift();
+    }
+}
 
-        fetch('http://127.0.0.1:5000/getEstimation', {
-          method: 'post',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({'value': ribcageValues.slice(-52, -1)})
-        })
-        .then((response) => response.json()) .then((data) => {
-          console.log('Success:', data);
-            
-            let airflow = Number(data.airflow);
+function handleAirflowEstimate(event) {
+    let airflow = new Float32Array(event.data)[0];
+    console.log('Success:', airflow);
 
-            if (airflow < 0) {
-                airflow = 0;
-            }
+    // No estimate (NaN) until the session holds a full history window
+    if (Number.isNaN(airflow)) {
+        return;
+    }
 
-            recentAirflow.push(airflow);
+    if (airflow < 0) {
+        airflow = 0;
+    }
 
-            let recentMax = Math.max.apply(null, recentAirflow);
-            console.log(recentMax);
+    recentAirflow.push(airflow);
 
-            airflowValues.push(recentMax);
+    let recentMax = Math.max.apply(null, recentAirflow);
+    console.log(recentMax);
 
+    airflowValues.push(recentMax);
 
-            if (airflow > maxAirVal) {
-                maxAirVal = airflow;
-            }
-            if (airflow < minAirVal) {
-                minAirVal = airflow;
-            }
-            let airflowRange = maxAirVal - minAirVal;
 
-            var airflowPlotValues = airflowValues.map(function(element) {
-                return (element - minAirVal)/airflowRange;
-            });
+    if (airflow > maxAirVal) {
+        maxAirVal = airflow;
+    }
+    if (airflow < minAirVal) {
+        minAirVal = airflow;
+    }
+    let airflowRange = maxAirVal - minAirVal;
 
-            // let a = airflowPlotValues.slice(-1);
-            // a = a*200 - 100;
+    var airflowPlotValues = airflowValues.map(function(element) {
+        return (element - minAirVal)/airflowRange;
+    });
 
-            airflowText.innerHTML = "Estimated airflow: " + airflowValues.slice(-1) + " l/min";
-            // airflowText.innerHTML = "Predicted airflow: " + Math.round(a);
+    // let a = airflowPlotValues.slice(-1);
+    // a = a*200 - 100;
 
-            // drawWaves(airflowPlotValues, airflowCanvas, 1, 42, 70);
-            drawWaves(airflowPlotValues, airflowCanvas, 1, 60, 70);
-                
-        })
-        .catch((error) => {
-          console.error('Error:', error);
-        });
-        
-    } 
+    airflowText.innerHTML = "Estimated airflow: " + airflowValues.slice(-1) + " l/min";
+    // airflowText.innerHTML = "Predicted airflow: " + Math.round(a);
 
-    // if (airflowValues.length > 64) {
-    if (airflowValues.length > 20) {
-        airflowValues.shift();
-    }
-    if (recentAirflow.length > 5) {
-        recentAirflow.shift();
-    }
+    // drawWaves(airflowPlotValues, airflowCanvas, 1, 42, 70);
+    drawWaves(airflowPlotValues, airflowCanvas, 1, 60, 70);
 }
-
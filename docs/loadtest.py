@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Load test of the estimation server with virtual FLOW sensors.
+
+Each virtual sensor replays the ribcage column of a recorded workout, sending
+packets of 7 samples at the sampling rate of the real sensor (10 Hz), which is
+the request pattern of flow-ribcage.js. The sensors run concurrently against a
+running app.py, and the throughput, the latency percentiles and the number of
+late and dropped estimates are reported.
+
+The latency of an estimate is measured from the time its packet was due, not
+from when it was sent. A sensor waiting for a slow server sends its next
+packets late, and this delay is counted, as it is for a real sensor whose
+notifications queue up. The response time of the server alone, from sending
+to receiving, is reported separately.
+
+Example, with 10, 100 and 300 sensors for 30 seconds each:
+
+    $ python app.py
+    $ python loadtest.py 5.csv --sensors 10 100 300 --duration 30
+
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+
+import numpy as np
+from simple_websocket import Client
+
+from wire import BINARY_MIMETYPE, decode_estimates, encode_samples
+
+
+PACKET_SIZE = 7
+"""Number of samples in each notification from the FLOW sensor."""
+
+SAMPLE_RATE = 10
+"""Samples per second of the FLOW sensor."""
+
+MODES = ["stream", "session", "window"]
+
+
+def read_recording(filepath):
+    """Read the ribcage values of a recorded workout.
+
+    Args:
+        filepath (str): Path to csv file with the columns time, airflow,
+            ribcage and heartrate.
+
+    Returns:
+        ribcage (array): Ribcage values, without missing values.
+
+    """
+
+    ribcage = np.loadtxt(filepath, delimiter=",", usecols=2)
+
+    # Missing values are dropped, as by app.preprocess(), since they cannot
+    # be sent as int16
+    return ribcage[~np.isnan(ribcage)].astype(np.int16)
+
+
+class VirtualSensor(threading.Thread):
+    """Replay a recording as one sensor, and record the estimation latencies.
+
+    Args:
+        ribcage (array): Ribcage values to replay, which are repeated from the
+            start when the end is reached.
+        host (str): Host of the server.
+        port (int): Port of the server.
+        mode (str): How estimations are requested:
+            - "stream": Binary messages on the WebSocket endpoint /stream,
+              as flow-ribcage.js does.
+            - "session": Binary pushes to a streaming session over HTTP.
+            - "window": The full history window is posted to /getEstimation
+              for every packet.
+        hist_size (int): Number of values in a window, used by mode "window".
+        stop_time (float): Time (time.monotonic) at which to stop sending.
+        timeout (float): Seconds to wait for an estimation before it is
+            counted as dropped.
+
+    """
+
+    def __init__(self, ribcage, host, port, mode, hist_size, stop_time,
+            timeout=5.0):
+
+        super().__init__(daemon=True)
+
+        self.ribcage = ribcage
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.hist_size = hist_size
+        self.stop_time = stop_time
+        self.timeout = timeout
+        self.period = PACKET_SIZE / SAMPLE_RATE
+
+        self.latencies = []
+        self.response_times = []
+        self.sent = 0
+        self.estimates = 0
+        self.pending = 0
+        self.late = 0
+        self.dropped = 0
+
+    def run(self):
+
+        # Start at a random point of the recording and of the packet period,
+        # so that the sensors do not send in lockstep.
+        position = random.randrange(len(self.ribcage))
+        next_send = time.monotonic() + random.uniform(0, self.period)
+
+        try:
+            request = self._connect()
+        except (OSError, http.client.HTTPException):
+            self.dropped += 1
+            return
+
+        history = np.zeros(0, dtype=np.int16)
+
+        while next_send < self.stop_time:
+            delay = next_send - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            values = np.take(
+                self.ribcage, range(position, position + PACKET_SIZE),
+                mode="wrap"
+            )
+            position = (position + PACKET_SIZE) % len(self.ribcage)
+
+            if self.mode == "window":
+                history = np.concatenate([history, values])
+                history = history[-(self.hist_size + 1):]
+                values = history
+
+            t = time.perf_counter()
+            self.sent += 1
+
+            try:
+                y = request(encode_samples(values))
+            except (OSError, http.client.HTTPException):
+                self.dropped += 1
+                request = self._reconnect()
+                next_send += self.period
+                continue
+
+            response_time = time.perf_counter() - t
+            latency = time.monotonic() - next_send
+
+            if np.isnan(y).all():
+                self.pending += 1
+            else:
+                self.estimates += 1
+                self.latencies.append(latency)
+                self.response_times.append(response_time)
+
+            # An estimation that arrives after the next packet is due is late,
+            # and delays the next packet.
+            if latency > self.period:
+                self.late += 1
+
+            next_send += self.period
+
+    def _reconnect(self):
+
+        try:
+            return self._connect()
+        except (OSError, http.client.HTTPException):
+            return self._fail
+
+    def _fail(self, body):
+
+        raise OSError("Not connected.")
+
+    def _connect(self):
+        """Connect to the server.
+
+        Returns:
+            request (callable): Function sending a packet and returning the
+                estimation(s).
+
+        """
+
+        if self.mode == "stream":
+            ws = Client.connect(f"ws://{self.host}:{self.port}/stream")
+
+            def request(body):
+                ws.send(body)
+                message = ws.receive(timeout=self.timeout)
+
+                if message is None:
+                    raise TimeoutError("No estimation received.")
+
+                return decode_estimates(message)
+
+            return request
+
+        conn = http.client.HTTPConnection(self.host, self.port,
+                timeout=self.timeout)
+        headers = {
+            "Content-Type": BINARY_MIMETYPE,
+            "Accept": BINARY_MIMETYPE,
+        }
+
+        if self.mode == "session":
+            conn.request("POST", "/session")
+            response = conn.getresponse()
+            session_id = json.loads(response.read())["session"]
+            url = f"/session/{session_id}"
+        elif self.mode == "window":
+            url = "/getEstimation"
+        else:
+            raise NotImplementedError(f"{self.mode} not implemented.")
+
+        def request(body):
+            if self.mode == "window" and len(body) < 2 * (self.hist_size + 1):
+                return np.array([np.nan])
+
+            conn.request("POST", url, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+
+            if response.status != 200:
+                raise http.client.HTTPException(response.status)
+
+            return decode_estimates(data)
+
+        return request
+
+
+def run(ribcage, n_sensors, duration, host="127.0.0.1", port=5000,
+        mode="stream", hist_size=50, timeout=5.0):
+    """Run a number of virtual sensors against the server.
+
+    Args:
+        ribcage (list of arrays): Recordings, which are assigned to the
+            sensors in turn.
+        n_sensors (int): Number of concurrent sensors.
+        duration (float): Seconds to send packets.
+        host (str): Host of the server.
+        port (int): Port of the server.
+        mode (str): Request mode, see VirtualSensor.
+        hist_size (int): Number of values in a window.
+        timeout (float): Seconds before an estimation is counted as dropped.
+
+    Returns:
+        report (dict): Throughput, latency percentiles and counts.
+
+    """
+
+    stop_time = time.monotonic() + duration
+
+    sensors = [
+        VirtualSensor(ribcage[i % len(ribcage)], host, port, mode, hist_size,
+            stop_time, timeout)
+        for i in range(n_sensors)
+    ]
+
+    t = time.monotonic()
+
+    for sensor in sensors:
+        sensor.start()
+
+    for sensor in sensors:
+        sensor.join()
+
+    elapsed = time.monotonic() - t
+
+    latencies = np.concatenate([
+        np.asarray(sensor.latencies) for sensor in sensors
+    ])
+    response_times = np.concatenate([
+        np.asarray(sensor.response_times) for sensor in sensors
+    ])
+
+    if len(latencies) > 0:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        latency_max = latencies.max() * 1000
+        response_p99 = np.percentile(response_times, 99) * 1000
+    else:
+        p50 = p95 = p99 = latency_max = response_p99 = float("nan")
+
+    sent = sum([sensor.sent for sensor in sensors])
+    estimates = sum([sensor.estimates for sensor in sensors])
+    pending = sum([sensor.pending for sensor in sensors])
+
+    return {
+        "sensors": n_sensors,
+        "sent": sent,
+        "estimates": estimates,
+        "pending": pending,
+        "late": sum([sensor.late for sensor in sensors]),
+        "dropped": sum([sensor.dropped for sensor in sensors]),
+        "throughput": (estimates + pending) / elapsed,
+        "expected": n_sensors / (PACKET_SIZE / SAMPLE_RATE),
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "max": latency_max,
+        "response_p99": response_p99,
+    }
+
+
+def print_report(report, header=False):
+    """Print the report of one load test run as a table row."""
+
+    columns = ("{:>8}{:>9}{:>10}{:>9}{:>8}{:>9}{:>9}{:>10}{:>9}{:>9}{:>9}"
+            "{:>14}")
+    line = ("{sensors:>8}{sent:>9}{estimates:>10}{late:>9}{dropped:>8}"
+            "{expected:>9.1f}{throughput:>9.1f}{p50:>10.2f}{p95:>9.2f}"
+            "{p99:>9.2f}{max:>9.2f}{response_p99:>14.2f}")
+
+    if header:
+        print(columns.format("sensors", "sent", "estimates", "late",
+            "dropped", "exp./s", "resp./s", "p50 ms", "p95 ms", "p99 ms",
+            "max ms", "server p99 ms"))
+
+    print(line.format(**report))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Load test with virtual FLOW sensors"
+    )
+    parser.add_argument("recordings", nargs="+",
+            help="csv files with recorded workouts, e.g. 5.csv")
+    parser.add_argument("--sensors", nargs="+", type=int, default=[10],
+            help="numbers of concurrent sensors, one run per number")
+    parser.add_argument("--duration", type=float, default=30,
+            help="seconds each run sends packets")
+    parser.add_argument("--mode", choices=MODES, default="stream",
+            help="request mode")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--hist-size", type=int, default=50,
+            help="number of values in a window, for mode 'window'")
+    parser.add_argument("--timeout", type=float, default=5.0,
+            help="seconds before an estimation is counted as dropped")
+    args = parser.parse_args()
+
+    ribcage = [read_recording(filepath) for filepath in args.recordings]
+
+    for i, n_sensors in enumerate(args.sensors):
+        report = run(ribcage, n_sensors, args.duration, args.host, args.port,
+                args.mode, args.hist_size, args.timeout)
+        print_report(report, header=i == 0)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Low-overhead latency metrics for the estimation server.
+
+Latencies and batch sizes are counted in fixed histogram buckets, which costs
+one bisection per observation, and quantiles (p50/p95/p99) are estimated from
+the bucket counts when the metrics are read. All metrics are exposed in the
+Prometheus text format.
+
+Example:
+
+    >>> metrics = Metrics()
+    >>> with metrics.timer("preprocess"):
+    ...     X = preprocess(values)
+    >>> text = metrics.exposition()
+
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import itertools
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+LATENCY_BUCKETS = [
+    1e-5 * 2 ** (i / 2) for i in range(34)
+]
+"""Upper bounds (seconds) of latency buckets, from 10 us to about 1.3 s."""
+
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+class Histogram:
+    """Count observations in fixed buckets.
+
+    Args:
+        buckets (list of float): Sorted upper bounds of the buckets. Values
+            above the last bound are counted in an overflow bucket.
+
+    """
+
+    def __init__(self, buckets):
+
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Count one observation."""
+
+        i = bisect_left(self.buckets, value)
+
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket.
+
+        Args:
+            q (float): Quantile, between 0 and 1.
+
+        Returns:
+            value (float): Estimated quantile, or NaN if nothing is observed.
+
+        """
+
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+
+        if count == 0:
+            return float("nan")
+
+        rank = q * count
+        cumulative = 0
+
+        for i, n in enumerate(counts):
+            if cumulative + n >= rank and n > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i]
+
+                return lower + (upper - lower) * (rank - cumulative) / n
+
+            cumulative += n
+
+        return self.buckets[-1]
+
+    def exposition(self, name, labels=""):
+        """Format the histogram in the Prometheus text format.
+
+        Args:
+            name (str): Metric name.
+            labels (str): Labels of the metric, e.g. 'stage="parse"'.
+
+        Returns:
+            lines (list of str): Lines of the exposition.
+
+        """
+
+        sep = "," if labels else ""
+
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+            count = self.count
+
+        lines = []
+        cumulative = 0
+
+        for bound, n in zip(self.buckets + ["+Inf"], counts):
+            cumulative += n
+            lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(
+                name, labels, sep, bound, cumulative
+            ))
+
+        braced = "{" + labels + "}" if labels else ""
+
+        lines.append("{}_sum{} {}".format(name, braced, total))
+        lines.append("{}_count{} {}".format(name, braced, count))
+
+        for q in QUANTILES:
+            lines.append('{}_quantile{{{}{}quantile="{}"}} {}'.format(
+                name, labels, sep, q, self.quantile(q)
+            ))
+
+        return lines
+
+
+class RateMeter:
+    """Events per second over a sliding window of whole seconds.
+
+    Args:
+        window (int): Length of window in seconds.
+
+    """
+
+    def __init__(self, window=10):
+
+        self.window = window
+        self.counts = [0] * window
+        self.seconds = [0] * window
+        self._lock = threading.Lock()
+
+    def mark(self):
+        """Count one event."""
+
+        second = int(time.monotonic())
+        i = second % self.window
+
+        with self._lock:
+            if self.seconds[i] != second:
+                self.seconds[i] = second
+                self.counts[i] = 0
+
+            self.counts[i] += 1
+
+    def rate(self):
+        """Events per second in the window, excluding the current second."""
+
+        second = int(time.monotonic())
+
+        with self._lock:
+            n = sum([
+                c for c, s in zip(self.counts, self.seconds)
+                if second - self.window < s < second
+            ])
+
+        return n / (self.window - 1)
+
+
+class Metrics:
+    """Collection of the server metrics.
+
+    Args:
+        max_batch_size (int): Largest batch size expected, used for the batch
+            size buckets.
+
+    """
+
+    stages = ["parse", "preprocess", "inference", "serialize"]
+
+    def __init__(self, max_batch_size=32):
+
+        self.stage_latency = {
+            stage: Histogram(LATENCY_BUCKETS) for stage in self.stages
+        }
+        self.request_latency = {}
+        self.batch_size = Histogram(range(1, max_batch_size + 1))
+        self.requests = RateMeter()
+        self.requests_total = 0
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        """Measure the latency of a processing stage."""
+
+        t = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.stage_latency[stage].observe(time.perf_counter() - t)
+
+    def observe_request(self, endpoint, latency):
+        """Count a request and its total latency."""
+
+        if endpoint not in self.request_latency:
+            with self._lock:
+                self.request_latency.setdefault(
+                    endpoint, Histogram(LATENCY_BUCKETS)
+                )
+
+        self.request_latency[endpoint].observe(latency)
+        self.requests.mark()
+
+        with self._lock:
+            self.requests_total += 1
+
+    def gauge(self, name, function):
+        """Register a gauge, whose value is read from a function."""
+
+        self.gauges[name] = function
+
+    def exposition(self):
+        """All metrics in the Prometheus text format."""
+
+        lines = ["# TYPE stage_latency_seconds histogram"]
+
+        for stage, histogram in self.stage_latency.items():
+            lines += histogram.exposition(
+                "stage_latency_seconds", f'stage="{stage}"'
+            )
+
+        lines.append("# TYPE request_latency_seconds histogram")
+
+        for endpoint, histogram in list(self.request_latency.items()):
+            lines += histogram.exposition(
+                "request_latency_seconds", f'endpoint="{endpoint}"'
+            )
+
+        lines.append("# TYPE batch_size histogram")
+        lines += self.batch_size.exposition("batch_size")
+
+        lines.append("# TYPE requests_total counter")
+        lines.append(f"requests_total {self.requests_total}")
+        lines.append("# TYPE requests_per_second gauge")
+        lines.append(f"requests_per_second {self.requests.rate()}")
+
+        for name, function in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {function()}")
+
+        return "\n".join(lines) + "\n"
+
+
+class SampledLogger:
+    """Log only every n-th message, through a background thread.
+
+    Records are put on a queue and written by a QueueListener, so the hot
+    path never waits for the output stream.
+
+    Args:
+        name (str): Name of logger.
+        every (int): Log one of this many messages.
+        level (int): Logging level.
+
+    """
+
+    def __init__(self, name, every=100, level=logging.INFO):
+
+        self.every = every
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+        self._counter = itertools.count()
+
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self.listener = logging.handlers.QueueListener(
+            log_queue, logging.StreamHandler()
+        )
+        self.listener.start()
+
+    def log(self, msg, *args):
+        """Log a message, if it is sampled."""
+
+        if next(self._counter) % self.every == 0:
+            self.logger.info(msg, *args)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Model folder, inference backend and model loading.
+
+The settings of the model are shared by the estimation server (app.py) and
+offline scoring (score.py), which can then load the model without importing
+the server and its web framework.
+
+Example:
+
+    >>> import model_loader
+    >>> model_loader.backend = "numpy"
+    >>> model = model_loader.load_model(model_loader.PATH)
+
+"""
+import os
+
+import yaml
+
+from preprocess.numpy_model import NumpyModel, packed_filepath
+
+
+PATH = "model/"
+hist_size = 50
+
+# Inference backend: "keras" evaluates model.h5 with TensorFlow, "numpy"
+# evaluates the weights exported by preprocess/export_weights.py with NumPy.
+# The packed weights (model.npy) are preferred over model.npz, since they are
+# memory-mapped and shared by all worker processes.
+backend = "keras"
+
+# Precision of the weights with the numpy backend: "float32", "float16" or
+# "int8". See preprocess/precision_report.py for the accuracy of each. The
+# packed weights of the precision (e.g. model-int8.npy) are shared by the
+# workers like model.npy. Without them, each worker quantizes its own copy.
+# The kernels are evaluated in float32, and each worker keeps float32 copies
+# of them, so with several workers the float32 weights use the least memory.
+precision = "float32"
+
+# Features used by models without a params.yaml. The 'featurize' section of the
+# parameters the model was trained with is read from the model folder, if
+# present.
+feature_params = {
+    "features": ["ribcage_gradient", "ribcage_slope_cyclic"],
+    "scale": True,
+    "breathing_min": 0,
+    "breathing_max": 4096,
+    "slope_shift": 1,
+}
+
+if os.path.exists(PATH + "params.yaml"):
+    feature_params = yaml.safe_load(open(PATH + "params.yaml"))["featurize"]
+
+
+def load_model(path=PATH):
+    """Load the model with the configured backend.
+
+    Args:
+        path (str): Folder of the model version.
+
+    Returns:
+        model: Object with the methods predict_on_batch and summary.
+
+    """
+
+    if backend == "numpy":
+        float32_filepath = os.path.join(path, "model.npy")
+        filepath = packed_filepath(float32_filepath, precision)
+
+        if os.path.exists(filepath):
+            return NumpyModel.load_packed(filepath)
+
+        if os.path.exists(float32_filepath):
+            model = NumpyModel.load_packed(float32_filepath)
+        else:
+            model = NumpyModel.load(os.path.join(path, "model.npz"))
+
+        if precision != "float32":
+            model = model.quantize(precision)
+
+        return model
+    elif backend == "keras":
+        from tensorflow.keras import models
+
+        return models.load_model(os.path.join(path, "model.h5"))
+    else:
+        raise NotImplementedError(f"{backend} not implemented.")
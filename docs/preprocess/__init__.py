@@ -0,0 +1,11 @@
+"""Preprocessing stages and feature engines.
+
+The modules import each other by their flat names, as when they are run as
+scripts. The folder is therefore added to the module search path, such that
+the modules can also be imported from the package, as the server does.
+
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
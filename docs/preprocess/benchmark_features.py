@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of the feature kernels against the pandas implementation.
+
+The ribcage features were originally computed with pandas: two rolling
+passes for the minimum and maximum of the range, a third for the smoothing,
+and one arctan per sine and cosine of the slope. This script times that code
+against the kernels in features.py on the ribcage column of a recording,
+repeated to the requested length, and reports the largest difference
+between the results.
+
+Example:
+
+    $ python preprocess/benchmark_features.py 5.csv --length 1000000
+
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from features import add_features, rolling_mean, rolling_min_max
+from features import scale_range, slope_cyclic
+
+
+def pandas_range(ribcage, range_window, range_smoothing):
+    """Range feature as computed by pandas rolling windows."""
+
+    ribcage = pd.Series(ribcage)
+    ribcage_min = ribcage.rolling(range_window).min()
+    ribcage_max = ribcage.rolling(range_window).max()
+    ribcage_range = ribcage_max - ribcage_min
+
+    return ribcage_range.rolling(range_smoothing).mean().to_numpy()
+
+
+def pandas_slope(ribcage, shift):
+    """Slope angle as computed by pandas."""
+
+    ribcage = pd.Series(ribcage)
+    v_dist = ribcage - ribcage.shift(shift)
+    h_dist = 0.1 * shift
+
+    return np.arctan(v_dist / h_dist).rolling(1).mean()
+
+
+def pandas_slope_cyclic(ribcage, shift):
+    """Sine and cosine of slope angle, with one slope per function."""
+
+    return (
+        np.sin(pandas_slope(ribcage, shift)).to_numpy(),
+        np.cos(pandas_slope(ribcage, shift)).to_numpy(),
+    )
+
+
+def pandas_features(ribcage, features, range_window, range_smoothing,
+        slope_shift):
+    """All features as computed by pandas."""
+
+    columns = {}
+
+    if "ribcage_range" in features:
+        columns["ribcage_range"] = pandas_range(ribcage, range_window,
+                range_smoothing)
+
+    if "ribcage_gradient" in features:
+        columns["ribcage_gradient"] = np.gradient(ribcage)
+
+    if "ribcage_slope_cyclic" in features:
+        sin, cos = pandas_slope_cyclic(ribcage, slope_shift)
+        columns["ribcage_slope_sin"] = sin
+        columns["ribcage_slope_cos"] = cos
+
+    return columns
+
+
+def kernel_range(ribcage, range_window, range_smoothing):
+    """Range feature as computed by features.py."""
+
+    ribcage_min, ribcage_max = rolling_min_max(ribcage, range_window)
+
+    return rolling_mean(ribcage_max - ribcage_min, range_smoothing)
+
+
+def median_time(function, *args, repeat=10):
+    """Median time in seconds of a function call, and its last result."""
+
+    times = []
+
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - t)
+
+    return float(np.median(times)), result
+
+
+def max_difference(a, b):
+    """Largest absolute difference between results, which may be tuples of
+    arrays or dicts of arrays."""
+
+    if isinstance(a, dict):
+        a, b = list(a.values()), [b[key] for key in a]
+
+    if isinstance(a, (list, tuple)):
+        return max([max_difference(x, y) for x, y in zip(a, b)])
+
+    if not np.array_equal(np.isnan(a), np.isnan(b)):
+        return np.inf
+
+    return float(np.nanmax(np.abs(a - b), initial=0.0))
+
+
+def benchmark(filepath, length=None, repeat=10):
+    """Time the pandas implementation and the kernels of each feature.
+
+    Args:
+        filepath (str): Path to recording, with the columns time, airflow,
+            ribcage and heartrate.
+        length (int): Number of samples to benchmark on. The recording is
+            repeated to this length. If None, the recording is used as is.
+        repeat (int): Number of timed runs of each implementation.
+
+    Returns:
+        results (list of tuple): Name, pandas time, kernel time and largest
+            difference of each benchmark.
+
+    """
+
+    params = yaml.safe_load(open("params.yaml"))["featurize"]
+    range_window = params["range_window"]
+    range_smoothing = params["range_smoothing"]
+    slope_shift = params["slope_shift"]
+    features = ["ribcage_range", "ribcage_gradient", "ribcage_slope_cyclic"]
+
+    ribcage = np.loadtxt(filepath, delimiter=",", usecols=2)
+
+    if length is not None:
+        ribcage = np.resize(ribcage, length)
+
+    ribcage = scale_range(ribcage, params["breathing_min"],
+            params["breathing_max"])
+
+    cases = [
+        ("ribcage_range",
+            (pandas_range, kernel_range),
+            (ribcage, range_window, range_smoothing)),
+        ("ribcage_slope_cyclic",
+            (pandas_slope_cyclic, slope_cyclic),
+            (ribcage, slope_shift)),
+        ("add_features",
+            (pandas_features, add_features),
+            (ribcage, features, range_window, range_smoothing, slope_shift)),
+    ]
+
+    results = []
+
+    for name, (reference, kernel), args in cases:
+        pandas_time, expected = median_time(reference, *args, repeat=repeat)
+        kernel_time, actual = median_time(kernel, *args, repeat=repeat)
+
+        results.append((name, pandas_time, kernel_time,
+            max_difference(expected, actual)))
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the feature kernels against pandas"
+    )
+    parser.add_argument("recording", help="recorded workout (csv)")
+    parser.add_argument("--length", type=int,
+            help="number of samples, repeating the recording")
+    parser.add_argument("--repeat", type=int, default=10,
+            help="number of timed runs")
+    args = parser.parse_args()
+
+    results = benchmark(args.recording, args.length, args.repeat)
+
+    print("{:<22}{:>12}{:>12}{:>10}{:>14}".format(
+        "feature", "pandas [ms]", "kernel [ms]", "speedup", "max diff"
+    ))
+
+    for name, pandas_time, kernel_time, difference in results:
+        print("{:<22}{:>12.2f}{:>12.2f}{:>10.1f}{:>14.2e}".format(
+            name, 1000 * pandas_time, 1000 * kernel_time,
+            pandas_time / kernel_time, difference
+        ))
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Content-addressed cache of the outputs of the preprocessing stages.
+
+Each output file of a stage is stored with a key, which is a hash of:
+
+- the content of the input files it is made from,
+- the path of the output file,
+- the parameters of the stage in params.yaml,
+- the source code of the modules the stage uses.
+
+When a stage is run again, the outputs with an unchanged key are kept, and
+only the other workouts are processed. Since the keys depend on the content
+of the inputs, a change only propagates downstream as far as it changes the
+outputs: adding one workout rebuilds that workout in each stage, and a new
+featurize parameter rebuilds the workouts whose features change.
+
+The keys are stored in one manifest per stage in assets/data/cache, and the
+number of hits and misses of each stage is saved to
+assets/metrics/cache.json. The cache is disabled by setting 'enabled' to
+False in the 'cache' section of params.yaml.
+
+Example:
+
+    >>> cache = StageCache("split", params, ["split.py", "preprocess_utils.py"])
+    >>> cache.map(split_workout, filepaths, output_filepaths)
+    >>> cache.save()
+
+"""
+import hashlib
+import json
+import os
+
+import yaml
+
+from config import DATA_CACHE_PATH, METRICS_PATH, CACHE_METRICS_FILE_PATH
+from parallel import map_workouts
+
+
+HASH_CHUNK_SIZE = 1 << 20
+"""Number of bytes read at a time when hashing files."""
+
+SOURCE_PATH = os.path.dirname(os.path.abspath(__file__))
+"""Folder of the source code of the stages."""
+
+
+def read_enabled():
+    """Read from params.yaml whether the cache is enabled."""
+
+    params = yaml.safe_load(open("params.yaml")).get("cache") or {}
+
+    return params.get("enabled", True)
+
+
+def hash_file(path, digest=None):
+    """Hash the content of a file, or of all files in a folder.
+
+    Args:
+        path (str): Path to a file, or a folder such as a columnar table.
+        digest: Hash object to update. A new one is created if None.
+
+    Returns:
+        digest: The updated hash object.
+
+    """
+
+    if digest is None:
+        digest = hashlib.sha256()
+
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            digest.update(name.encode())
+            hash_file(os.path.join(path, name), digest)
+
+        return digest
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest
+
+
+def file_stat(path):
+    """Size and modification time of a file, or of all files in a folder."""
+
+    stat = os.stat(path)
+
+    if not os.path.isdir(path):
+        return stat.st_size, stat.st_mtime_ns
+
+    stats = [os.stat(os.path.join(path, n)) for n in os.listdir(path)]
+
+    return (
+        sum([s.st_size for s in stats]),
+        max([s.st_mtime_ns for s in stats] + [stat.st_mtime_ns]),
+    )
+
+
+def code_version(source_files):
+    """Hash the source code of modules.
+
+    Args:
+        source_files (list of str): Names of the source files a stage uses,
+            in the preprocess folder.
+
+    Returns:
+        version (str): Hex digest of the source files.
+
+    """
+
+    digest = hashlib.sha256()
+
+    for name in source_files:
+        hash_file(os.path.join(SOURCE_PATH, name), digest)
+
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Cache of the outputs of one stage.
+
+    Args:
+        stage (str): Name of the stage.
+        params (dict): Parameters the outputs of the stage depend on.
+        source_files (list of str): Names of the source files of the stage.
+        enabled (bool): Whether to use the cache. If None, it is read from
+            params.yaml. When disabled, all outputs are rebuilt, and the
+            manifest is not changed.
+
+    """
+
+    def __init__(self, stage, params, source_files, enabled=None):
+
+        self.stage = stage
+        self.params = json.dumps(params, sort_keys=True, default=str)
+        self.code = code_version(source_files)
+        self.enabled = read_enabled() if enabled is None else enabled
+        self.manifest_path = DATA_CACHE_PATH / f"{stage}.json"
+        self.hits = 0
+        self.misses = 0
+
+        self.outputs = {}
+        self.inputs = {}
+
+        if self.enabled and self.manifest_path.exists():
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+
+            self.outputs = manifest["outputs"]
+            self.inputs = manifest["inputs"]
+
+    def input_hash(self, path):
+        """Hash of an input file.
+
+        The hash is reused from the manifest if the size and modification
+        time of the file are unchanged.
+
+        """
+
+        path = str(path)
+        size, mtime = file_stat(path)
+        entry = self.inputs.get(path)
+
+        if entry is None or entry["size"] != size or entry["mtime"] != mtime:
+            entry = {
+                "size": size,
+                "mtime": mtime,
+                "hash": hash_file(path).hexdigest(),
+            }
+            self.inputs[path] = entry
+
+        return entry["hash"]
+
+    def key(self, input_paths, output_path):
+        """Key of an output file.
+
+        Args:
+            input_paths (list of str): Paths to the inputs of the output.
+            output_path (str): Path to the output.
+
+        Returns:
+            key (str): Hex digest of the inputs, parameters and code, or None
+                if the cache is disabled.
+
+        """
+
+        if not self.enabled:
+            return None
+
+        digest = hashlib.sha256()
+
+        for path in input_paths:
+            digest.update(self.input_hash(path).encode())
+
+        digest.update(str(output_path).encode())
+        digest.update(self.params.encode())
+        digest.update(self.code.encode())
+
+        return digest.hexdigest()
+
+    def lookup(self, key, output_path):
+        """Look up an output in the cache.
+
+        Args:
+            key (str): Key of the output.
+            output_path (str): Path to the output.
+
+        Returns:
+            hit (bool): Whether the output exists with the same key, and is
+                unchanged since it was built.
+            result: Result stored with the output, if any.
+
+        """
+
+        entry = self.outputs.get(str(output_path))
+
+        if (self.enabled and entry is not None and entry["key"] == key
+                and os.path.exists(output_path)
+                and list(file_stat(output_path)) == entry["stat"]):
+            self.hits += 1
+            return True, entry.get("result")
+
+        self.misses += 1
+
+        return False, None
+
+    def store(self, key, output_path, result=None):
+        """Store the key of an output that has been built.
+
+        Args:
+            key (str): Key of the output.
+            output_path (str): Path to the output.
+            result: JSON serializable result to return on later hits.
+
+        """
+
+        self.outputs[str(output_path)] = {
+            "key": key,
+            "stat": list(file_stat(output_path)),
+            "result": result,
+        }
+
+    def map(self, function, filepaths, output_filepaths, *iterables):
+        """Apply a function to the workouts whose outputs are not cached.
+
+        The workouts are processed in parallel by map_workouts().
+
+        Args:
+            function (callable): Function processing one workout, taking the
+                input path, the output path and the elements of iterables.
+                Its result must be JSON serializable.
+            filepaths (list of str): Paths to input files.
+            output_filepaths (list of str): Paths to output files.
+            iterables (list): More arguments of the function, one list per
+                argument.
+
+        Returns:
+            results (list): Result of each workout, in the order of the
+                input, either computed or from the cache.
+
+        """
+
+        keys = [
+            self.key([f], o) for f, o in zip(filepaths, output_filepaths)
+        ]
+        results = [None] * len(filepaths)
+        missing = []
+
+        for i, (key, output_filepath) in enumerate(zip(keys,
+                output_filepaths)):
+            hit, results[i] = self.lookup(key, output_filepath)
+
+            if not hit:
+                missing.append(i)
+
+        arguments = [filepaths, output_filepaths] + list(iterables)
+        computed = map_workouts(function,
+                *[[argument[i] for i in missing] for argument in arguments])
+
+        for i, result in zip(missing, computed):
+            results[i] = result
+            self.store(keys[i], output_filepaths[i], result)
+
+        return results
+
+    def save(self):
+        """Save the manifest, and print and save the hits and misses."""
+
+        print("{}: {} cached, {} rebuilt".format(
+            self.stage, self.hits, self.misses
+        ))
+
+        METRICS_PATH.mkdir(parents=True, exist_ok=True)
+
+        report = {}
+
+        if CACHE_METRICS_FILE_PATH.exists():
+            with open(CACHE_METRICS_FILE_PATH) as f:
+                report = json.load(f)
+
+        report[self.stage] = {"hits": self.hits, "misses": self.misses}
+
+        with open(CACHE_METRICS_FILE_PATH, "w") as f:
+            json.dump(report, f, indent=4)
+
+        if not self.enabled:
+            return
+
+        DATA_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+
+        with open(self.manifest_path, "w") as f:
+            json.dump({"outputs": self.outputs, "inputs": self.inputs}, f,
+                    indent=1)
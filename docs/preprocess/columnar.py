@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Binary columnar format for the intermediate data of the pipeline.
+
+A table is a folder with one .npy file per column and a columns.json file
+with the names and dtypes of the columns in order:
+
+    1-featurized.cols/
+        columns.json
+        airflow.npy
+        ribcage_gradient.npy
+        ...
+
+Columns are memory-mapped when read, and only the requested columns are
+opened, so no text is parsed and unused columns are never read.
+
+Running the module compares the I/O time with csv on a large dataset:
+
+    $ python preprocess/columnar.py
+
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+COLUMNAR_SUFFIX = ".cols"
+"""Suffix of the folder of a columnar table."""
+
+COLUMNS_FILE = "columns.json"
+
+
+def is_columnar(path):
+    """Whether a path is a columnar table."""
+
+    return str(path).endswith(COLUMNAR_SUFFIX)
+
+
+def write_table(df, path):
+    """Write a data frame as a columnar table.
+
+    The index of the data frame is not saved.
+
+    Args:
+        df (DataFrame): Data to write.
+        path (str): Path to the folder of the table, ending with '.cols'.
+
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    columns = []
+
+    for name in df.columns:
+        values = df[name].to_numpy()
+        np.save(os.path.join(path, f"{name}.npy"), values)
+        columns.append({"name": str(name), "dtype": values.dtype.str})
+
+    with open(os.path.join(path, COLUMNS_FILE), "w") as f:
+        json.dump(columns, f)
+
+
+class TableWriter:
+    """Write a columnar table block by block, with constant memory.
+
+    The rows of each block are appended to the column files, and the number
+    of rows in the .npy headers is updated when the table is closed. The
+    dtypes of the columns are taken from the first block.
+
+    Args:
+        path (str): Path to the folder of the table, ending with '.cols'.
+
+    """
+
+    def __init__(self, path):
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.n_rows = 0
+        self._columns = None
+        self._files = None
+
+    def _header(self, dtype):
+        """Header of a column file with the current number of rows."""
+
+        return {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (self.n_rows,),
+        }
+
+    def append(self, df):
+        """Append the rows of a data frame. The index is not saved."""
+
+        if self._files is None:
+            self._columns = [
+                {"name": str(name), "dtype": df[name].to_numpy().dtype.str}
+                for name in df.columns
+            ]
+            self._files = []
+
+            for column in self._columns:
+                f = open(os.path.join(self.path, column["name"] + ".npy"),
+                        "wb")
+                np.lib.format.write_array_header_1_0(
+                    f, self._header(np.dtype(column["dtype"]))
+                )
+                self._files.append(f)
+
+        for column, f in zip(self._columns, self._files):
+            values = df[column["name"]].to_numpy()
+            f.write(np.ascontiguousarray(
+                values, dtype=np.dtype(column["dtype"])
+            ).tobytes())
+
+        self.n_rows += len(df)
+
+    def close(self):
+        """Write the final headers and the columns.json file."""
+
+        if self._files is None:
+            return
+
+        for column, f in zip(self._columns, self._files):
+            # The header has room for the number of rows to grow, so it
+            # keeps its length
+            end = f.tell()
+            f.seek(0)
+            np.lib.format.write_array_header_1_0(
+                f, self._header(np.dtype(column["dtype"]))
+            )
+            f.seek(end)
+            f.close()
+
+        with open(os.path.join(self.path, COLUMNS_FILE), "w") as f:
+            json.dump(self._columns, f)
+
+        self._files = None
+
+
+def table_columns(path):
+    """Names and dtypes of the columns of a table, in order."""
+
+    with open(os.path.join(path, COLUMNS_FILE)) as f:
+        return {c["name"]: np.dtype(c["dtype"]) for c in json.load(f)}
+
+
+def read_table(path, columns=None, dtypes=None, mmap_mode="r"):
+    """Read columns of a columnar table.
+
+    Args:
+        path (str): Path to the folder of the table.
+        columns (list of str): Columns to read, in this order. All columns are
+            read by default.
+        dtypes (dict): Dtype of some of the columns. The column is converted
+            if it is stored with another dtype.
+        mmap_mode (str): Memory-map mode of np.load. None reads the columns
+            into memory.
+
+    Returns:
+        df (DataFrame): The columns.
+
+    """
+
+    stored = table_columns(path)
+
+    if columns is None:
+        columns = list(stored)
+
+    dtypes = dtypes or {}
+    data = {}
+
+    for name in columns:
+        if name not in stored:
+            raise KeyError(f"{name} not in {path}.")
+
+        values = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        dtype = np.dtype(dtypes.get(name, stored[name]))
+
+        if values.dtype != dtype:
+            values = values.astype(dtype)
+
+        data[name] = np.asarray(values)
+
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def benchmark(n_rows=1_000_000, n_columns=6, directory=None):
+    """Compare the I/O time of the stages with csv and columnar tables.
+
+    The I/O of the stages is repeated on one large workout: featurize writes
+    it, split reads and writes it, and scale reads it.
+
+    Args:
+        n_rows (int): Number of rows of the workout.
+        n_columns (int): Number of float columns of the workout.
+        directory (str): Folder for the temporary files.
+
+    """
+
+    rng = np.random.default_rng(2020)
+    df = pd.DataFrame(
+        rng.random((n_rows, n_columns)),
+        columns=["airflow"] + [f"feature{i}" for i in range(n_columns - 1)]
+    )
+
+    tmp = tempfile.mkdtemp(dir=directory)
+
+    formats = {
+        "csv": (
+            lambda df, path: df.to_csv(path),
+            lambda path: pd.read_csv(path, index_col=0),
+            ".csv",
+        ),
+        "columnar": (
+            write_table,
+            lambda path: read_table(path, mmap_mode=None),
+            COLUMNAR_SUFFIX,
+        ),
+    }
+
+    print(f"{n_rows} rows, {n_columns} columns:")
+
+    try:
+        for name, (write, read, suffix) in formats.items():
+            featurized = os.path.join(tmp, "1-featurized" + suffix)
+            split = os.path.join(tmp, "1-train" + suffix)
+
+            stages = {
+                "featurize": lambda: write(df, featurized),
+                "split": lambda: write(read(featurized), split),
+                "scale": lambda: read(split),
+            }
+
+            total = 0
+
+            for stage, function in stages.items():
+                t = time.perf_counter()
+                function()
+                t = time.perf_counter() - t
+                total += t
+                print("    {:<10}{:<12}{:10.3f} s".format(name, stage, t))
+
+            print("    {:<10}{:<12}{:10.3f} s".format(name, "total", total))
+
+        t = time.perf_counter()
+        pd.read_csv(os.path.join(tmp, "1-train.csv"), usecols=["feature0"])
+        t_csv = time.perf_counter() - t
+
+        t = time.perf_counter()
+        read_table(os.path.join(tmp, "1-train" + COLUMNAR_SUFFIX),
+                ["feature0"])["feature0"].sum()
+        t_columnar = time.perf_counter() - t
+
+        print("    {:<22}{:10.3f} s".format("csv one column", t_csv))
+        print("    {:<22}{:10.3f} s".format("columnar one column", t_columnar))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        benchmark(int(sys.argv[1]))
+    else:
+        benchmark()
@@ -2,6 +2,10 @@
 # -*- coding: utf-8 -*-
 """Combines workout files into one.
 
+If the parameter 'memmap' is True, the train and test sets are saved as
+folders of memory-mapped arrays (see memmap.py), which are filled one workout
+at a time, instead of as .npz files.
+
 Author:   
     Erik Johannes Husom
 
@@ -12,8 +16,11 @@ Created:
 import sys
 
 import numpy as np
+import yaml
 
 from config import DATA_COMBINED_PATH
+from memmap import combine_arrays
+from windows import WindowDataset, is_window_dataset
 
 def combine(filepaths):
     """Combine data from multiple workouts into one dataset.
@@ -30,6 +37,16 @@ def combine(filepaths):
     if isinstance(filepaths, str):
         filepaths = [filepaths]
 
+    params = yaml.safe_load(open("params.yaml")).get("combine") or {}
+
+    if params.get("memmap", False):
+        combine_memmap(filepaths)
+        return
+
+    if is_window_dataset(filepaths[0]):
+        combine_windows(filepaths)
+        return
+
     train_inputs = []
     train_outputs = []
     test_inputs = []
@@ -53,6 +70,58 @@ def combine(filepaths):
     np.savez(DATA_COMBINED_PATH / "train.npz", X=X_train, y=y_train)
     np.savez(DATA_COMBINED_PATH / "test.npz", X=X_test, y=y_test)
 
+def combine_windows(filepaths):
+    """Combine workouts saved as WindowDatasets into one dataset.
+
+    Only the flat feature matrices are concatenated, and the windows are
+    still generated when needed.
+
+    Args:
+        filepaths (list of str): A list of paths to files containing
+            WindowDatasets.
+
+    """
+
+    train = []
+    test = []
+
+    for filepath in filepaths:
+        if "train" in filepath:
+            train.append(WindowDataset.load(filepath))
+        elif "test" in filepath:
+            test.append(WindowDataset.load(filepath))
+
+    WindowDataset.concatenate(train).save(DATA_COMBINED_PATH / "train.npz")
+    WindowDataset.concatenate(test).save(DATA_COMBINED_PATH / "test.npz")
+
+def combine_memmap(filepaths):
+    """Combine workouts into memory-mapped arrays on disk.
+
+    The arrays are preallocated from the shapes in the workout files, and
+    each workout is copied into place, so only one workout is held in memory
+    at a time. Works for both windows and WindowDatasets.
+
+    Args:
+        filepaths (list of str): A list of paths to files containing
+            sequentialized data.
+
+    """
+
+    train = []
+    test = []
+
+    for filepath in filepaths:
+        if "train" in filepath:
+            train.append(filepath)
+        elif "test" in filepath:
+            test.append(filepath)
+
+    # The windows of a WindowDataset start at rows of X
+    offsets = {"starts": "X"}
+
+    combine_arrays(train, DATA_COMBINED_PATH / "train", offsets)
+    combine_arrays(test, DATA_COMBINED_PATH / "test", offsets)
+
 if __name__ == "__main__":
 
     np.random.seed(2020)
@@ -38,18 +38,33 @@ DATA_SCALED_PATH = DATA_PATH / "scaled"
 DATA_COMBINED_PATH = DATA_PATH / "combined"
 """Path to combined data, ready for training."""
 
+DATA_CACHE_PATH = DATA_PATH / "cache"
+"""Path to the manifests of the cached outputs of each stage."""
+
 MODELS_PATH = ASSETS_PATH / "models"
 """Path to models."""
 
 MODELS_FILE_PATH = MODELS_PATH / "model.h5"
 """Path to model file."""
 
+MODELS_WEIGHTS_FILE_PATH = MODELS_PATH / "model.npz"
+"""Path to model weights exported for the NumPy inference engine."""
+
+MODELS_PACKED_WEIGHTS_FILE_PATH = MODELS_PATH / "model.npy"
+"""Path to packed model weights, which are loaded memory-mapped."""
+
 METRICS_PATH = ASSETS_PATH / "metrics"
 """Path to folder containing metrics file."""
 
 METRICS_FILE_PATH = METRICS_PATH / "metrics.json"
 """Path to file containing metrics."""
 
+PRECISION_METRICS_FILE_PATH = METRICS_PATH / "precision.json"
+"""Path to file containing accuracy and latency of each inference precision."""
+
+CACHE_METRICS_FILE_PATH = METRICS_PATH / "cache.json"
+"""Path to file containing cache hits and misses of each stage."""
+
 PLOTS_PATH = ASSETS_PATH / "plots"
 """Path to folder plots."""
 
@@ -22,6 +22,8 @@ from tensorflow.keras import models
 import yaml
 
 from config import METRICS_FILE_PATH, PLOTS_PATH, PREDICTION_PLOT_PATH, DATA_PATH
+from memmap import is_memmap_dataset
+from windows import is_window_dataset, load_dataset
 
 
 def evaluate(model_filepath, test_filepath):
@@ -38,15 +40,31 @@ def evaluate(model_filepath, test_filepath):
     # Load parameters
     params = yaml.safe_load(open("params.yaml"))["evaluate"]
     smooth_targets = params["smooth_targets"]
+    net = yaml.safe_load(open("params.yaml"))["train"]["net"]
 
-    test = np.load(test_filepath)
+    model = models.load_model(model_filepath)
 
-    X_test = test["X"]
-    y_test = test["y"]
+    # The windows of a WindowDataset or a memory-mapped dataset are generated
+    # or read in batches, and only the last time step of each window is kept
+    # for plotting.
+    if is_window_dataset(test_filepath) or is_memmap_dataset(test_filepath):
+        dataset = load_dataset(test_filepath)
+
+        y_test = dataset.y
+        y_pred = np.concatenate([
+            model.predict_on_batch(X) for X, _ in dataset.batches(
+                4096, flatten=net == "dnn"
+            )
+        ])
+        X_test = dataset.last_rows()
+    else:
+        dataset = None
+        test = np.load(test_filepath)
 
-    model = models.load_model(model_filepath)
+        X_test = test["X"]
+        y_test = test["y"]
 
-    y_pred = model.predict(X_test)
+        y_pred = model.predict(X_test)
 
     if smooth_targets > 1:
         y_pred = pd.Series(y_pred.reshape(-1)).rolling(smooth_targets).mean()
@@ -59,7 +77,13 @@ def evaluate(model_filepath, test_filepath):
     print("MSE: {}".format(mse))
     print("R2: {}".format(r2))
 
-    results = model.evaluate(X_test, y_test)
+    if dataset is None:
+        results = model.evaluate(X_test, y_test)
+    else:
+        results = model.evaluate(
+            dataset.keras_sequence(4096, flatten=net == "dnn")
+        )
+
     print(results)
 
     plot_prediction(y_test, y_pred, inputs=X_test, info="(MSE: {})".format(mse))
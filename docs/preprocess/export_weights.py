@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Export weights of a trained Keras model to a plain array file.
+
+The exported file can be evaluated by NumpyModel in numpy_model.py, which does
+not depend on TensorFlow. Conv1D, Flatten, Dense and Dropout layers are
+supported, which covers the cnn() architecture. The weights are also saved
+packed (model.npy and model.json), for memory-mapped loading, together with
+packed float16 and int8 versions (model-float16.npy, model-int8.npy).
+
+"""
+import json
+import os
+import sys
+
+import numpy as np
+from tensorflow.keras import layers as keras_layers
+from tensorflow.keras import models
+
+from config import (
+    MODELS_FILE_PATH,
+    MODELS_PACKED_WEIGHTS_FILE_PATH,
+    MODELS_WEIGHTS_FILE_PATH,
+)
+from numpy_model import PRECISIONS, NumpyModel, packed_filepath
+
+
+def export_weights(model_filepath, weights_filepath,
+        packed_weights_filepath=None):
+    """Export weights of a Keras model.
+
+    Args:
+        model_filepath (str): Path to Keras model.
+        weights_filepath (str): Path to output file.
+        packed_weights_filepath (str): Path to output file of packed weights.
+            The reduced precisions are saved next to it. If None, the packed
+            weights are not saved.
+
+    """
+
+    model = models.load_model(model_filepath)
+
+    layers = []
+    weights = {}
+
+    for i, layer in enumerate(model.layers):
+
+        if isinstance(layer, keras_layers.Dropout):
+            continue
+        elif isinstance(layer, keras_layers.Flatten):
+            layers.append({"type": "flatten"})
+            continue
+        elif isinstance(layer, keras_layers.Conv1D):
+            if (layer.padding != "valid" or layer.strides != (1,)
+                    or layer.dilation_rate != (1,)):
+                raise NotImplementedError(
+                    "Only Conv1D with padding='valid', stride 1 and no "
+                    "dilation is implemented."
+                )
+            layer_type = "conv1d"
+        elif isinstance(layer, keras_layers.Dense):
+            layer_type = "dense"
+        else:
+            raise NotImplementedError(
+                f"{type(layer).__name__} not implemented."
+            )
+
+        kernel, bias = layer.get_weights()
+
+        weights[f"layer{i}_kernel"] = kernel.astype(np.float32)
+        weights[f"layer{i}_bias"] = bias.astype(np.float32)
+
+        layers.append({
+            "type": layer_type,
+            "activation": layer.activation.__name__,
+            "kernel": f"layer{i}_kernel",
+            "bias": f"layer{i}_bias",
+        })
+
+    architecture = {
+        "input_shape": list(model.input_shape[1:]),
+        "layers": layers,
+    }
+
+    np.savez(weights_filepath, architecture=json.dumps(architecture), **weights)
+
+    if packed_weights_filepath is not None:
+        model = NumpyModel.load(weights_filepath)
+
+        for precision in PRECISIONS:
+            model.quantize(precision).save_packed(
+                packed_filepath(packed_weights_filepath, precision)
+            )
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3:
+        export_weights(MODELS_FILE_PATH, MODELS_WEIGHTS_FILE_PATH,
+                MODELS_PACKED_WEIGHTS_FILE_PATH)
+    else:
+        packed_weights_filepath = os.path.splitext(sys.argv[2])[0] + ".npy"
+        export_weights(sys.argv[1], sys.argv[2], packed_weights_filepath)
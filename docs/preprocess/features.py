@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Vectorized ribcage features, shared by the featurize stage and app.py.
+
+All features are computed with NumPy directly on arrays, driven by the
+'featurize' section of params.yaml. StreamingFeatures in streaming_features.py
+computes the same features incrementally, with bit-for-bit equal results.
+
+Example:
+
+    >>> params = yaml.safe_load(open("params.yaml"))["featurize"]
+    >>> X, columns = compute_features(ribcage, **engine_params(params))
+
+"""
+import numpy as np
+
+
+ENGINE_PARAMS = [
+    "range_window",
+    "range_smoothing",
+    "slope_shift",
+    "peak_distance",
+    "frequency_smoothing",
+    "scale",
+    "breathing_min",
+    "breathing_max",
+]
+"""Parameters from the featurize section that are used by the engines."""
+
+
+def engine_params(params):
+    """Select feature engine arguments from the featurize section.
+
+    Args:
+        params (dict): The 'featurize' section of params.yaml.
+
+    Returns:
+        kwargs (dict): Arguments for compute_features and StreamingFeatures.
+
+    """
+
+    kwargs = {key: params[key] for key in ENGINE_PARAMS if key in params}
+    kwargs["features"] = params["features"]
+
+    return kwargs
+
+
+def scale_range(x, minimum, maximum):
+    """Scale raw values by a fixed range."""
+
+    return (x - minimum) / (maximum - minimum)
+
+
+def _pad(values, n):
+    """Prepend n NaN values, to align a rolling result with its input."""
+
+    return np.concatenate([np.full(n, np.nan), values])
+
+
+def rolling_min_max(x, window):
+    """Rolling minimum and maximum, NaN until the first window is full.
+
+    Both are computed in the same loop by doubling: after k steps, each value
+    is the minimum (maximum) of the 2**k samples starting there, and the
+    window is covered by two such overlapping spans. This takes log2(window)
+    element-wise passes over the data, instead of one comparison per sample
+    in each window, and the results are exact.
+
+    Args:
+        x (array): Data.
+        window (int): Number of samples in window.
+
+    Returns:
+        minimum (array): Rolling minimum, of same length as x.
+        maximum (array): Rolling maximum, of same length as x.
+
+    """
+
+    if len(x) < window:
+        return np.full(len(x), np.nan), np.full(len(x), np.nan)
+
+    minimum = maximum = x
+    width = 1
+
+    while 2 * width <= window:
+        minimum = np.minimum(minimum[:-width], minimum[width:])
+        maximum = np.maximum(maximum[:-width], maximum[width:])
+        width *= 2
+
+    # Spans of 'width' samples at the start and the end of each window
+    shift = window - width
+
+    if shift > 0:
+        minimum = np.minimum(minimum[:-shift], minimum[shift:])
+        maximum = np.maximum(maximum[:-shift], maximum[shift:])
+
+    return _pad(minimum, window - 1), _pad(maximum, window - 1)
+
+
+def rolling_mean(x, window):
+    """Rolling mean, NaN until the first window is full.
+
+    The window sums are differences of the cumulative sum. Leading NaN values
+    (e.g. from another rolling feature) are skipped.
+
+    Args:
+        x (array): Data.
+        window (int): Number of samples in window.
+
+    Returns:
+        mean (array): Rolling mean, of same length as x.
+
+    """
+
+    defined = ~np.isnan(x)
+    n_nan = np.argmax(defined) if defined.any() else len(x)
+    valid = x[n_nan:]
+
+    if len(valid) < window:
+        return np.full(len(x), np.nan)
+
+    total = np.concatenate([[0.0], np.cumsum(valid)])
+    mean = (total[window:] - total[:-window]) / window
+
+    return _pad(mean, n_nan + window - 1)
+
+
+def gradient(x):
+    """Central difference gradient, one-sided at the end points."""
+
+    if len(x) < 2:
+        return np.full(len(x), np.nan)
+
+    return np.gradient(x)
+
+
+def slope_cyclic(x, shift=2):
+    """Calculate sine and cosine of slope angle.
+
+    The angle is arctan(t) of the slope t, so the sine and cosine are
+    t / sqrt(1 + t**2) and 1 / sqrt(1 + t**2), which are computed without
+    trigonometric functions.
+
+    Args:
+        x (array): Data for slope calculation.
+        shift (int): How many steps backwards to go when calculating the slope.
+            For example: If shift=2, the slope is calculated from the data
+            point two time steps ago to the data point at the current time
+            step.
+
+    Returns:
+        sin (array): Sine of slope angle, NaN for the first 'shift' steps.
+        cos (array): Cosine of slope angle, NaN for the first 'shift' steps.
+
+    """
+
+    if len(x) <= shift:
+        return np.full(len(x), np.nan), np.full(len(x), np.nan)
+
+    tangent = (x[shift:] - x[:-shift]) / (0.1 * shift)
+    hypotenuse = np.hypot(1.0, tangent)
+
+    return _pad(tangent / hypotenuse, shift), _pad(1.0 / hypotenuse, shift)
+
+
+def breath_peaks(x, distance):
+    """Find the breaths as peaks of the ribcage values.
+
+    A sample is a peak if it is larger than the 'distance' samples before it
+    and not smaller than the 'distance' samples after it. Peaks are therefore
+    more than 'distance' samples apart, and a flat top gives one peak, at its
+    first sample. A peak is known 'distance' samples after it occurs.
+
+    Args:
+        x (array): Data.
+        distance (int): Number of samples on each side of a peak, at least 1.
+
+    Returns:
+        peaks (array): Indices of the peaks.
+
+    """
+
+    candidates = np.arange(distance, len(x) - distance)
+
+    if len(candidates) == 0:
+        return candidates
+
+    _, maximum = rolling_min_max(x, distance)
+
+    is_peak = ((x[candidates] > maximum[candidates - 1])
+            & (x[candidates] >= maximum[candidates + distance]))
+
+    return candidates[is_peak]
+
+
+def breath_frequency(peaks, distance, start, stop, last_peak=None,
+        rate=np.nan):
+    """Breathing frequency from the interval between the last known peaks.
+
+    The frequency of a sample only uses the peaks known at that sample, so
+    it does not depend on later samples. The rate of each interval is
+    broadcast to the samples until the next peak is known, by searchsorted.
+    A series can be computed in parts, by passing on last_peak and rate.
+
+    Args:
+        peaks (array): Indices of the peaks that become known in the samples
+            from start to stop.
+        distance (int): Number of samples before a peak is known.
+        start (int): Index of the first sample.
+        stop (int): Index after the last sample.
+        last_peak (int): Index of the last peak before these, if any.
+        rate (float): Frequency at the sample before start.
+
+    Returns:
+        frequency (array): Breaths per minute of the samples from start to
+            stop, NaN until two peaks are known.
+        last_peak (int): Index of the last peak, or None.
+        rate (float): Frequency at the last sample.
+
+    """
+
+    if last_peak is not None:
+        peaks = np.concatenate([[last_peak], peaks])
+
+    # The sampling period is 0.1 seconds
+    rates = np.concatenate([[rate], 60 / (0.1 * np.diff(peaks))])
+    n_known = np.searchsorted(peaks[1:] + distance, np.arange(start, stop),
+            side="right")
+
+    last_peak = peaks[-1] if len(peaks) > 0 else None
+
+    return rates[n_known], last_peak, rates[-1]
+
+
+def ewm_mean(x, span, state=None):
+    """Exponentially weighted mean, as pandas' ewm(span=span).mean().
+
+    The weighted sum and the sum of weights are recursive filters, computed
+    by lfilter, so a series can be continued from the returned state with the
+    same results. Leading NaN values are skipped.
+
+    Args:
+        x (array): Data.
+        span (float): Span of the weights, at least 1.
+        state (tuple): Weighted sum and sum of weights at the end of the
+            preceding values, or None at the start of a series.
+
+    Returns:
+        mean (array): Weighted mean, of same length as x.
+        state (tuple): Weighted sum and sum of weights at the end of x.
+
+    """
+
+    # Only needed by this feature, so app.py does not import scipy otherwise
+    from scipy.signal import lfilter
+
+    defined = ~np.isnan(x)
+    n_nan = np.argmax(defined) if defined.any() else len(x)
+    valid = x[n_nan:]
+    mean = np.full(len(x), np.nan)
+
+    if len(valid) == 0:
+        return mean, state
+
+    decay = 1 - 2 / (span + 1)
+    weighted, weights = (0.0, 0.0) if state is None else state
+
+    weighted = lfilter([1.0], [1.0, -decay], valid, zi=[decay * weighted])[0]
+    weights = lfilter([1.0], [1.0, -decay], np.ones(len(valid)),
+            zi=[decay * weights])[0]
+    mean[n_nan:] = weighted / weights
+
+    return mean, (weighted[-1], weights[-1])
+
+
+def add_features(ribcage, features,
+        range_window=100,
+        range_smoothing=1,
+        slope_shift=2,
+        peak_distance=8,
+        frequency_smoothing=100,
+    ):
+    """Compute the features given in the features-list.
+
+    Args:
+        ribcage (array): Ribcage values.
+        features (list): A list containing keywords specifying which features
+            to add.
+        range_window (int): How many time steps to use when calculating range.
+        range_smoothing (int): Rolling mean window for smoothing range.
+        slope_shift (int): How many time steps to use when calculating slope.
+        peak_distance (int): How many time steps on each side of a breath
+            peak must be lower.
+        frequency_smoothing (float): Span of exponentially weighted mean for
+            smoothing breathing frequency.
+
+    Returns:
+        columns (dict): Feature name mapped to array of feature values, in the
+            column order used by the data set.
+
+    """
+
+    ribcage = np.asarray(ribcage, dtype=np.float64)
+    columns = {}
+
+    if "ribcage_range" in features:
+        ribcage_min, ribcage_max = rolling_min_max(ribcage, range_window)
+        ribcage_range = ribcage_max - ribcage_min
+        columns["ribcage_range"] = rolling_mean(ribcage_range, range_smoothing)
+
+    if "ribcage_gradient" in features:
+        columns["ribcage_gradient"] = gradient(ribcage)
+
+    if "ribcage_slope_cyclic" in features:
+        sin, cos = slope_cyclic(ribcage, slope_shift)
+        columns["ribcage_slope_sin"] = sin
+        columns["ribcage_slope_cos"] = cos
+
+    if "ribcage_frequency" in features:
+        peaks = breath_peaks(ribcage, peak_distance)
+        frequency, _, _ = breath_frequency(peaks, peak_distance, 0,
+                len(ribcage))
+        columns["ribcage_frequency"], _ = ewm_mean(frequency,
+                frequency_smoothing)
+
+    return columns
+
+
+class ChunkedFeatures:
+    """Compute the features of add_features() over a series in chunks.
+
+    Each chunk is computed with the vectorized functions above, over the
+    chunk and the end of the preceding samples, which is just enough for the
+    windows of the range, the slope and the breath peaks. The rolling mean of
+    the range carries on the cumulative sum of the preceding chunks, and the
+    breathing frequency carries on the last peak, rate and weighted mean. The results are therefore
+    bit-for-bit equal to add_features() over the whole series, while the state
+    between chunks has a constant size.
+
+    The newest sample is held back until the next chunk or flush(), since its
+    gradient depends on the next sample.
+
+    Args:
+        features (list): A list containing keywords specifying which features
+            to add.
+        range_window (int): How many time steps to use when calculating range.
+        range_smoothing (int): Rolling mean window for smoothing range.
+        slope_shift (int): How many time steps to use when calculating slope.
+        peak_distance (int): How many time steps on each side of a breath
+            peak must be lower.
+        frequency_smoothing (float): Span of exponentially weighted mean for
+            smoothing breathing frequency.
+
+    """
+
+    def __init__(self, features,
+            range_window=100,
+            range_smoothing=1,
+            slope_shift=2,
+            peak_distance=8,
+            frequency_smoothing=100,
+        ):
+
+        self.features = features
+        self.range_window = range_window
+        self.range_smoothing = range_smoothing
+        self.slope_shift = slope_shift
+        self.peak_distance = peak_distance
+        self.frequency_smoothing = frequency_smoothing
+
+        # Samples before the held sample needed by the windows. A peak that
+        # becomes known at the held sample needs two peak distances.
+        self._context = max(range_window - 1, slope_shift, 1)
+
+        if "ribcage_frequency" in features:
+            self._context = max(self._context, 2 * peak_distance)
+
+        self._tail = np.empty(0)
+        self._n = 0
+
+        # The last cumulative sums of the defined range values, and the
+        # number of these values
+        self._totals = np.zeros(1)
+        self._n_range = 0
+
+        # State of the breathing frequency
+        self._last_peak = None
+        self._rate = np.nan
+        self._ewm = None
+
+    def update(self, ribcage):
+        """Add a chunk of samples.
+
+        Args:
+            ribcage (array): Ribcage values of the chunk.
+
+        Returns:
+            columns (dict): Feature name mapped to array of feature values, for
+                all samples up to, but not including, the newest sample.
+
+        """
+
+        ribcage = np.asarray(ribcage, dtype=np.float64)
+        buffer = np.concatenate([self._tail, ribcage])
+
+        # The held sample from the previous chunk is the first to emit
+        first = len(self._tail) - 1 if self._n > 0 else 0
+        last = max(len(buffer) - 1, first)
+
+        columns = self._compute(buffer, first, last,
+                self._n - len(self._tail))
+
+        self._tail = buffer[-(self._context + 1):]
+        self._n += len(ribcage)
+
+        return columns
+
+    def flush(self):
+        """Compute the features of the held sample, at the end of the series.
+
+        Returns:
+            columns (dict): Feature name mapped to an array with the feature
+                value of the last sample, or empty arrays if there are no
+                samples.
+
+        """
+
+        if self._n == 0:
+            return self._compute(self._tail, 0, 0, 0)
+
+        columns = self._compute(self._tail, len(self._tail) - 1,
+                len(self._tail), self._n - len(self._tail))
+        self._tail = np.empty(0)
+        self._n = 0
+
+        return columns
+
+    def _compute(self, x, first, last, offset):
+        """Compute the features of x[first:last], in the order of
+        add_features(), where offset is the index of x[0] in the series."""
+
+        columns = {}
+
+        if "ribcage_range" in self.features:
+            ribcage_min, ribcage_max = rolling_min_max(x, self.range_window)
+            ribcage_range = ribcage_max - ribcage_min
+            columns["ribcage_range"] = self._range_mean(
+                ribcage_range[first:last]
+            )
+
+        if "ribcage_gradient" in self.features:
+            columns["ribcage_gradient"] = gradient(x)[first:last]
+
+        if "ribcage_slope_cyclic" in self.features:
+            sin, cos = slope_cyclic(x, self.slope_shift)
+            columns["ribcage_slope_sin"] = sin[first:last]
+            columns["ribcage_slope_cos"] = cos[first:last]
+
+        if "ribcage_frequency" in self.features:
+            columns["ribcage_frequency"] = self._frequency(x, first + offset,
+                    last + offset, offset)
+
+        return columns
+
+    def _frequency(self, x, start, stop, offset):
+        """Smoothed breathing frequency of the samples from start to stop,
+        as in add_features() over the whole series."""
+
+        distance = self.peak_distance
+
+        # Only the peaks that become known in these samples are new
+        peaks = breath_peaks(x, distance) + offset
+        peaks = peaks[(peaks + distance >= start) & (peaks + distance < stop)]
+
+        frequency, self._last_peak, self._rate = breath_frequency(peaks,
+                distance, start, stop, self._last_peak, self._rate)
+        mean, self._ewm = ewm_mean(frequency, self.frequency_smoothing,
+                self._ewm)
+
+        return mean
+
+    def _range_mean(self, values):
+        """Rolling mean of new range values, as rolling_mean() over the whole
+        series."""
+
+        window = self.range_smoothing
+        mean = np.full(len(values), np.nan)
+
+        # Only the first values of the series are undefined
+        defined = ~np.isnan(values)
+        new = values[defined]
+
+        totals = np.concatenate([
+            self._totals, np.cumsum(np.concatenate([self._totals[-1:], new]))[1:]
+        ])
+
+        # Index of the new values in the defined values of the series, and
+        # of the first stored total
+        index = np.arange(self._n_range, self._n_range + len(new))
+        base = self._n_range + 1 - len(self._totals)
+        full = index + 1 >= window
+
+        new_mean = np.full(len(new), np.nan)
+        new_mean[full] = (
+            totals[index[full] + 1 - base]
+            - totals[index[full] + 1 - window - base]
+        ) / window
+        mean[defined] = new_mean
+
+        self._totals = totals[-window:]
+        self._n_range += len(new)
+
+        return mean
+
+
+def compute_features(ribcage, features,
+        scale=True,
+        breathing_min=0,
+        breathing_max=4096,
+        **kwargs
+    ):
+    """Compute the ribcage features used as input to the model.
+
+    Args:
+        ribcage (array): Raw ribcage values.
+        features (list): Features to compute, as in params.yaml.
+        scale (bool): Whether to scale the raw values before computing
+            features.
+        breathing_min (float): Minimum raw value, used for scaling.
+        breathing_max (float): Maximum raw value, used for scaling.
+        **kwargs: Arguments passed on to add_features.
+
+    Returns:
+        X (array): Feature matrix of shape (len(ribcage), n_features). Rows
+            where a feature is undefined contain NaN.
+        columns (list): Names of the columns of X.
+
+    """
+
+    ribcage = np.asarray(ribcage).reshape(-1)
+
+    if scale:
+        ribcage = scale_range(ribcage, breathing_min, breathing_max)
+
+    columns = add_features(ribcage, features, **kwargs)
+
+    X = np.empty((len(ribcage), len(columns)))
+
+    for i, values in enumerate(columns.values()):
+        X[:, i] = values
+
+    return X, list(columns)
+
+
+def complete_rows(X):
+    """Remove rows where any feature is undefined."""
+
+    return X[~np.isnan(X).any(axis=1)]
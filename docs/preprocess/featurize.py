@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 """Clean up inputs and add features to data set.
 
+If the parameter 'chunk_size' is set, each workout is read and featurized in
+blocks of that many samples, with the same results as for the whole workout,
+such that the memory use does not depend on the length of the recordings.
+
 Author:
     Erik Johannes Husom
 
@@ -17,6 +21,12 @@ import pandas as pd
 from scipy.signal import find_peaks
 import yaml
 
+from cache import StageCache
+from columnar import COLUMNAR_SUFFIX
+from config import DATA_FEATURIZED_PATH, DATA_PATH
+from features import ChunkedFeatures, add_features
+from preprocess_utils import DataWriter, move_column, write_data
+
 
 def featurize(filepaths):
     """Clean up inputs and add features to data set.
@@ -35,6 +45,179 @@ def featurize(filepaths):
     # Load parameters
     params = yaml.safe_load(open("params.yaml"))["featurize"]
 
+    file_format = params.get("file_format", "csv")
+    """Format of the featurized data, 'csv' or 'columnar'."""
+
+    if file_format == "csv":
+        suffix = ".csv"
+    elif file_format == "columnar":
+        suffix = COLUMNAR_SUFFIX
+    else:
+        raise NotImplementedError(f"{file_format} not implemented.")
+
+    output_filepaths = [
+        DATA_FEATURIZED_PATH
+        / (os.path.splitext(os.path.basename(filepath))[0] + "-featurized"
+            + suffix)
+        for filepath in filepaths
+    ]
+
+    cache = StageCache("featurize", params, [
+        "featurize.py", "features.py", "preprocess_utils.py", "columnar.py"
+    ])
+    columns = cache.map(featurize_workout, filepaths, output_filepaths,
+            [params] * len(filepaths))
+    cache.save()
+
+    # Save list of features used
+    pd.DataFrame(columns[-1]).to_csv(DATA_PATH / "input_columns.csv")
+
+
+def featurize_workout(filepath, output_filepath, params):
+    """Clean up inputs and add features to one workout, and save it.
+
+    Args:
+        filepath (str): Path to file to process.
+        output_filepath (str): Path to save the featurized data to.
+        params (dict): Parameters of the featurize stage.
+
+    Returns:
+        columns (list of str): Columns of the featurized data.
+
+    """
+
+    if params.get("chunk_size"):
+        return featurize_chunked(filepath, output_filepath, params)
+
+    df = featurize_dataframe(filepath, params)
+
+    # Save data
+    write_data(df, output_filepath)
+
+    return list(df.columns)
+
+
+def featurize_chunked(filepath, output_filepath, params):
+    """Featurize one workout block by block, and save it.
+
+    The blocks from featurize_blocks() are appended to the output file.
+
+    Args:
+        filepath (str): Path to file to process.
+        output_filepath (str): Path to save the featurized data to.
+        params (dict): Parameters of the featurize stage.
+
+    Returns:
+        columns (list of str): Columns of the featurized data.
+
+    """
+
+    writer = DataWriter(output_filepath)
+
+    for rows in featurize_blocks(filepath, params):
+        writer.append(rows)
+
+    writer.close()
+
+    return list(rows.columns)
+
+
+def featurize_blocks(filepath, params):
+    """Clean up inputs and add features to one workout, block by block.
+
+    The workout is read in blocks of 'chunk_size' samples, and the features
+    are computed by ChunkedFeatures, which carries the end of each block over
+    to the next. Together, the blocks are equal to featurize_dataframe() over
+    the whole workout, with all values read as floats.
+
+    Args:
+        filepath (str): Path to file to process.
+        params (dict): Parameters of the featurize stage.
+
+    Yields:
+        rows (DataFrame): Featurized rows, with the target in the first
+            column and indices following those of the previous block. The
+            last block is yielded also if it is empty.
+
+    """
+
+    target = params["target"]
+    remove_features = params["remove"]
+    diff_targets = params["diff_targets"]
+
+    engine = ChunkedFeatures(params["features"],
+            range_window=params["range_window"],
+            range_smoothing=params["range_smoothing"],
+            slope_shift=params["slope_shift"],
+            peak_distance=params.get("peak_distance", 8),
+            frequency_smoothing=params.get("frequency_smoothing", 100),
+    )
+
+    # Rows waiting for their features, and the last targets before them
+    pending = None
+    previous_targets = None
+    n_rows = 0
+
+    chunks = pd.read_csv(filepath, index_col=0, names=[
+        "time", "airflow", "ribcage", "heartrate"
+    ], dtype=np.float64, chunksize=params["chunk_size"])
+
+    def emit(rows, new_columns):
+        nonlocal previous_targets, n_rows
+
+        rows = rows.copy()
+        rows.index = pd.RangeIndex(n_rows, n_rows + len(rows))
+
+        for name, values in new_columns.items():
+            rows[name] = values
+
+        if isinstance(remove_features, list):
+            for col in remove_features:
+                del rows[col]
+
+        if diff_targets > 0:
+            targets = pd.concat([previous_targets, rows[target]])
+            previous_targets = targets.iloc[-diff_targets:]
+            differences = targets.diff(diff_targets).to_numpy()
+            rows[target] = differences[len(targets) - len(rows):]
+            rows[target] = rows[target].fillna(0)
+
+        n_rows += len(rows)
+
+        return rows
+
+    for chunk in chunks:
+        chunk = chunk.dropna()
+
+        # Move target column to the beginning of dataframe
+        chunk = move_column(chunk, column_name="airflow", new_idx=0)
+
+        if params["scale"]:
+            chunk = scale_inputs(chunk, params)
+
+        new_columns = engine.update(chunk["ribcage"].to_numpy())
+
+        rows = chunk if pending is None else pd.concat([pending, chunk])
+        n_ready = max(len(rows) - 1, 0)
+        pending = rows.iloc[n_ready:]
+
+        yield emit(rows.iloc[:n_ready], new_columns)
+
+    yield emit(pending, engine.flush())
+
+
+def featurize_dataframe(filepath, params):
+    """Clean up inputs and add features to one workout.
+
+    Args:
+        filepath (str): Path to file to process.
+        params (dict): Parameters of the featurize stage.
+
+    Returns:
+        df (DataFrame): Featurized data, with the target in the first column.
+
+    """
+
     target = params["target"]
     """Name of target variable."""
 
@@ -54,60 +237,55 @@ def featurize(filepaths):
     value itself.
     """
 
-    for filepath in filepaths:
+    df = pd.read_csv(filepath, index_col=0, names=[
+        "time", "airflow", "ribcage", "heartrate"
+    ])
 
-        df = pd.read_csv(filepath, index_col=0, names=[
-            "time", "airflow", "ribcage", "heartrate"
-        ])
+    df.dropna(inplace=True)
+    df.reset_index(inplace=True, drop=True)
 
-        df.dropna(inplace=True)
-        df.reset_index(inplace=True, drop=True)
+    # Move target column to the beginning of dataframe
+    df = move_column(df, column_name="airflow", new_idx=0)
 
-        # Move target column to the beginning of dataframe
-        df = move_column(df, column_name="airflow", new_idx=0)
+    if scale:
+        df = scale_inputs(df, params)
 
-        if scale:
-            df = scale_inputs(df)
+    new_columns = add_features(df["ribcage"].to_numpy(), features,
+            range_window=params["range_window"],
+            range_smoothing=params["range_smoothing"],
+            slope_shift=params["slope_shift"],
+            peak_distance=params.get("peak_distance", 8),
+            frequency_smoothing=params.get("frequency_smoothing", 100),
+    )
 
-        add_features(df, features, 
-                range_window=params["range_window"],
-                range_smoothing=params["range_smoothing"],
-                slope_shift=params["slope_shift"],
-                slope_smoothing=params["slope_smoothing"],
-        )
+    for name, values in new_columns.items():
+        df[name] = values
 
-        # Remove columns from input. Check first if it is a list, to avoid
-        # error if empty.
-        if isinstance(remove_features, list):
-            for col in remove_features:
-                del df[col]
-
-        if diff_targets > 0:
-            df[target] = df[target].diff(diff_targets)
-            df[target].fillna(0, inplace=True)
+    # Remove columns from input. Check first if it is a list, to avoid
+    # error if empty.
+    if isinstance(remove_features, list):
+        for col in remove_features:
+            del df[col]
 
-        # Save data
-        df.to_csv(
-            DATA_FEATURIZED_PATH
-            / (os.path.splitext(os.path.basename(filepath))[0] + "-featurized.csv")
-        )
+    if diff_targets > 0:
+        df[target] = df[target].diff(diff_targets)
+        df[target] = df[target].fillna(0)
 
-    # Save list of features used
-    pd.DataFrame(df.columns).to_csv(DATA_PATH / "input_columns.csv")
+    return df
 
-def scale_inputs(df):
+def scale_inputs(df, params):
     """Scale input features.
 
     Args:
         df (DataFrame): Data frame containing data.
+        params (dict): Parameters of the featurize stage, with the ranges of
+            the inputs.
 
     Returns:
         scaled_df (DataFrame): Data frame containing scaled data.
 
     """
 
-    # Load scaling parameters
-    params = yaml.safe_load(open("params.yaml"))["featurize"]
     heartrate_min = params["heartrate_min"]
     heartrate_max = params["heartrate_max"]
     breathing_min = params["breathing_min"]
@@ -127,79 +305,6 @@ def scale_inputs(df):
 
     return df
 
-def add_features(df, features, 
-        range_window=100,
-        range_smoothing=1,
-        slope_shift=2,
-        slope_smoothing=1,
-    ):
-    """
-    This function adds features to the input data, based on the arguments
-    given in the features-list.
-
-    Args:
-    df (pandas DataFrame): Data frame to add features to.
-    features (list): A list containing keywords specifying which features to
-        add.
-    range_window (int): How many time steps to use when calculating range.
-    range_smoothing (int): Rolling mean window for smoothing range.
-    slope_shift (int): How many time steps to use when calculating slope.
-    slope_smoothing (int): Rolling mean window for smoothing slope.
-
-    Returns:
-        df (pandas DataFrame): Data frame with added features.
-
-    """
-
-    if "ribcage_range" in features:
-
-        ribcage_min = df["ribcage"].rolling(range_window).min()
-        ribcage_max = df["ribcage"].rolling(range_window).max()
-        ribcage_range = ribcage_max - ribcage_min
-
-        df["ribcage_range"] = ribcage_range.rolling(range_smoothing).mean()
-
-    if "ribcage_gradient" in features:
-        df["ribcage_gradient"] = np.gradient(df["ribcage"])
-
-    if "ribcage_slope_cyclic" in features:
-        df["ribcage_slope_sin"] = np.sin(
-                calculate_slope(df["ribcage"], slope_shift,
-                    rolling_mean_window=1, absvalue=False)
-        )
-        df["ribcage_slope_cos"] = np.cos(
-                calculate_slope(df["ribcage"], slope_shift,
-                    rolling_mean_window=1, absvalue=False)
-        )
-
-def calculate_slope(data, shift=2, rolling_mean_window=1, absvalue=False):
-    """Calculate slope.
-
-    Args:
-        data (array): Data for slope calculation.
-        shift (int): How many steps backwards to go when calculating the slope.
-            For example: If shift=2, the slope is calculated from the data
-            point two time steps ago to the data point at the current time
-            step.
-        rolling_mean_window (int): Window for calculating rolling mean.
-
-    Returns:
-        slope (array): Array of slope angle.
-
-    """
-
-    v_dist = data - data.shift(shift)
-    h_dist = 0.1 * shift
-
-    slope = np.arctan(v_dist / h_dist)
-
-    if absvalue:
-        slope = np.abs(slope)
-
-    slope = slope.rolling(rolling_mean_window).mean()
-
-    return slope
-
 if __name__ == "__main__":
 
     np.random.seed(2020)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Combined datasets stored as memory-mapped arrays.
+
+A dataset is a folder with one .npy file per array, for example:
+
+    train/
+        X.npy
+        y.npy
+
+The arrays are combined from the .npz files of the workouts without holding
+more than one array of one workout in memory: the shapes are first read from
+the headers in the .npz files, the output arrays are preallocated on disk,
+and each workout is copied into place. The arrays are opened memory-mapped,
+so datasets larger than the memory can be used for training and evaluation.
+
+"""
+import os
+import zipfile
+
+import numpy as np
+
+
+def is_memmap_dataset(path):
+    """Whether a path is a dataset of memory-mapped arrays."""
+
+    return os.path.isdir(path)
+
+
+def npz_headers(filepath):
+    """Read the shape and dtype of the arrays in a .npz file.
+
+    Only the headers of the arrays are read.
+
+    Args:
+        filepath (str): Path to .npz file.
+
+    Returns:
+        headers (dict): Shape and dtype of each array, by name.
+
+    """
+
+    headers = {}
+
+    with zipfile.ZipFile(filepath) as archive:
+        for member in archive.namelist():
+            with archive.open(member) as f:
+                version = np.lib.format.read_magic(f)
+
+                if version == (1, 0):
+                    header = np.lib.format.read_array_header_1_0(f)
+                else:
+                    header = np.lib.format.read_array_header_2_0(f)
+
+                shape, _, dtype = header
+
+            headers[member[:-len(".npy")]] = (shape, dtype)
+
+    return headers
+
+
+def combine_arrays(filepaths, path, offsets=None):
+    """Combine the arrays of several .npz files into memory-mapped arrays.
+
+    Arrays are concatenated along the first axis. Arrays with zero
+    dimensions, such as parameters, are taken from the first file.
+
+    Args:
+        filepaths (list of str): Paths to .npz files with the same arrays.
+        path (str): Path to the folder of the combined dataset.
+        offsets (dict): Arrays of indices into another array, which are
+            offset by the number of rows of that array in the preceding
+            files, e.g. {"starts": "X"}.
+
+    """
+
+    offsets = offsets or {}
+    headers = [npz_headers(filepath) for filepath in filepaths]
+
+    os.makedirs(path, exist_ok=True)
+
+    arrays = {}
+
+    for name, (shape, dtype) in headers[0].items():
+        if len(shape) > 0:
+            shape = (sum([h[name][0][0] for h in headers]),) + shape[1:]
+
+        arrays[name] = np.lib.format.open_memmap(
+            os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype,
+            shape=shape
+        )
+
+    positions = dict.fromkeys(arrays, 0)
+
+    for i, filepath in enumerate(filepaths):
+        # Positions of the arrays before this file
+        start = dict(positions)
+
+        with np.load(filepath) as infile:
+            for name, array in arrays.items():
+                if array.ndim == 0:
+                    if i == 0:
+                        array[...] = infile[name]
+                    continue
+
+                values = infile[name]
+
+                if name in offsets:
+                    values = values + start[offsets[name]]
+
+                position = positions[name]
+                array[position:position + len(values)] = values
+                positions[name] = position + len(values)
+
+    for array in arrays.values():
+        array.flush()
+
+
+def save_arrays(path, **arrays):
+    """Save arrays that are in memory as a dataset.
+
+    Args:
+        path (str): Path to the folder of the dataset.
+        arrays: The arrays, by name.
+
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+
+
+def load_arrays(path, mmap_mode="r"):
+    """Load the arrays of a dataset.
+
+    Args:
+        path (str): Path to the folder of the dataset.
+        mmap_mode (str): Memory-map mode of np.load. None reads the arrays
+            into memory.
+
+    Returns:
+        arrays (dict): The arrays, by name.
+
+    """
+
+    arrays = {}
+
+    for filename in sorted(os.listdir(path)):
+        name, extension = os.path.splitext(filename)
+
+        if extension == ".npy":
+            # Plain arrays viewing the memory map, since operations on
+            # np.memmap would return np.memmap objects
+            arrays[name] = np.asarray(
+                np.load(os.path.join(path, filename), mmap_mode=mmap_mode)
+            )
+
+    return arrays
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""NumPy forward pass for the cnn() architecture.
+
+Evaluates a model exported by export_weights.py without TensorFlow. Conv1D
+layers run as im2col matrix multiplications, and all layers support batched
+input.
+
+The weights can be stored with reduced precision, either as float16 or as
+int8 with one scale per output channel, while the evaluation is done in
+float32. This reduces the stored weights by a factor of 2 or 4. The kernels
+are converted to float32 once, on their first use, and the converted copies
+are kept by the model, so each process evaluating a quantized model holds
+float32 working copies of its kernels.
+
+The weights can also be saved packed in one flat array file, which is loaded
+memory-mapped and read-only. Processes that load the same packed file then
+share one copy of the weights in the page cache. Quantized models are packed
+in their own precision, to a file per precision (model-int8.npy), so they
+are shared in the same way.
+
+Example:
+
+    >>> model = NumpyModel.load("assets/models/model.npz")
+    >>> y = model.predict(X)
+    >>> model_int8 = model.quantize("int8")
+    >>> model.save_packed("assets/models/model.npy")
+    >>> model_int8.save_packed(packed_filepath("assets/models/model.npy",
+    ...     "int8"))
+    >>> model = NumpyModel.load_packed("assets/models/model.npy")
+
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def relu(x):
+    """Rectified linear unit, in place."""
+
+    return np.maximum(x, 0, out=x)
+
+
+def elu(x, alpha=1.0):
+    """Exponential linear unit, in place."""
+
+    negative = x < 0
+    x[negative] = alpha * np.expm1(x[negative])
+
+    return x
+
+
+def linear(x):
+    """Linear activation."""
+
+    return x
+
+
+ACTIVATIONS = {"relu": relu, "elu": elu, "linear": linear}
+
+WEIGHT_NAMES = ("kernel", "bias")
+
+PACKED_NAMES = WEIGHT_NAMES + ("scale",)
+"""Arrays of a layer that are stored in a packed file."""
+
+PRECISIONS = ["float32", "float16", "int8"]
+
+PACKED_ALIGNMENT = 64
+"""Number of bytes each packed array is aligned to."""
+
+
+def architecture_filepath(weights_filepath):
+    """Path to the architecture file belonging to a packed weights file."""
+
+    return os.path.splitext(weights_filepath)[0] + ".json"
+
+
+def packed_filepath(filepath, precision="float32"):
+    """Path to the packed weights of a precision.
+
+    Args:
+        filepath (str): Path to the packed float32 weights, e.g. model.npy.
+        precision (str): Precision of the weights.
+
+    Returns:
+        filepath (str): The same path for float32, otherwise with the
+            precision added to the name, e.g. model-int8.npy.
+
+    """
+
+    if precision == "float32":
+        return filepath
+
+    root, extension = os.path.splitext(filepath)
+
+    return f"{root}-{precision}{extension}"
+
+
+def quantize_int8(kernel):
+    """Quantize a kernel to int8 with one scale per output channel.
+
+    The scales are symmetric, such that the largest absolute weight of each
+    output channel (the last axis) is mapped to 127.
+
+    Args:
+        kernel (array): Kernel in float32.
+
+    Returns:
+        q (array): Kernel in int8.
+        scale (array): Scale of each output channel, such that kernel is
+            approximately q * scale.
+
+    """
+
+    max_abs = np.abs(kernel).reshape(-1, kernel.shape[-1]).max(axis=0)
+    scale = np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+    q = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+
+    return q, scale
+
+
+def matmul(X, kernel, scale=None):
+    """Multiply inputs with a kernel stored in any precision.
+
+    Args:
+        X (array): Input of shape (N, in_features), in float32.
+        kernel (array): Kernel of shape (in_features, out_features).
+        scale (array): Scale of each output feature of an int8 kernel.
+
+    Returns:
+        out (array): Output of shape (N, out_features), in float32.
+
+    """
+
+    if kernel.dtype != X.dtype:
+        kernel = kernel.astype(X.dtype)
+
+    out = X @ kernel
+
+    if scale is not None:
+        out *= scale
+
+    return out
+
+
+def conv1d(X, kernel, bias, scale=None):
+    """One-dimensional convolution with 'valid' padding and stride 1.
+
+    The input windows are unfolded into a matrix (im2col), such that the
+    convolution is one matrix multiplication.
+
+    Args:
+        X (array): Input of shape (N, steps, in_channels).
+        kernel (array): Kernel of shape (kernel_size, in_channels, filters).
+        bias (array): Bias of shape (filters,).
+        scale (array): Scale of each filter, if the kernel is int8.
+
+    Returns:
+        out (array): Output of shape (N, steps - kernel_size + 1, filters).
+
+    """
+
+    kernel_size, in_channels, filters = kernel.shape
+    n, steps, _ = X.shape
+    out_steps = steps - kernel_size + 1
+
+    # Shape (N, out_steps, in_channels, kernel_size), reordered so that each
+    # row has the same layout as the flattened kernel.
+    cols = sliding_window_view(X, kernel_size, axis=1).transpose(0, 1, 3, 2)
+    cols = cols.reshape(n * out_steps, kernel_size * in_channels)
+
+    out = matmul(
+        cols, kernel.reshape(kernel_size * in_channels, filters), scale
+    )
+    out += bias
+
+    return out.reshape(n, out_steps, filters)
+
+
+def dense(X, kernel, bias, scale=None):
+    """Fully connected layer."""
+
+    out = matmul(X, kernel, scale)
+    out += bias
+
+    return out
+
+
+class NumpyModel:
+    """Model evaluated with NumPy.
+
+    Args:
+        layers (list of dict): Layer descriptions, each with a 'type' (conv1d,
+            flatten or dense), and for layers with weights an 'activation'
+            and the arrays 'kernel' and 'bias'. Layers with an int8 kernel
+            also have the array 'scale'.
+        input_shape (tuple): Shape (steps, features) of one input window.
+        dtype: Data type used for evaluation.
+
+    """
+
+    def __init__(self, layers, input_shape=None, dtype=np.float32):
+
+        self.layers = layers
+        self.input_shape = input_shape
+        self.dtype = dtype
+
+        # Kernels converted to dtype, by layer index
+        self._kernels = {}
+
+    @classmethod
+    def load(cls, filepath):
+        """Load a model exported by export_weights.py.
+
+        Args:
+            filepath (str): Path to weights file.
+
+        Returns:
+            model (NumpyModel): The loaded model.
+
+        """
+
+        weights = np.load(filepath)
+        architecture = json.loads(str(weights["architecture"]))
+        layers = architecture["layers"]
+
+        for layer in layers:
+            for name in WEIGHT_NAMES:
+                if name in layer:
+                    layer[name] = weights[layer[name]]
+
+        return cls(layers, tuple(architecture["input_shape"]))
+
+    @classmethod
+    def load_packed(cls, filepath, mmap_mode="r"):
+        """Load a model saved by save_packed().
+
+        Args:
+            filepath (str): Path to packed weights file (.npy). The
+                architecture is read from the .json file next to it.
+            mmap_mode (str): Memory-map mode of np.load. With the default
+                "r", the weights are read-only views of the file, and are
+                shared by all processes loading it. None reads the weights
+                into memory.
+
+        Returns:
+            model (NumpyModel): The loaded model.
+
+        """
+
+        with open(architecture_filepath(filepath)) as f:
+            architecture = json.load(f)
+
+        # Plain arrays viewing the memory map, since operations on np.memmap
+        # would return np.memmap objects
+        packed = np.asarray(np.load(filepath, mmap_mode=mmap_mode))
+        data = packed.view(np.uint8)
+        layers = architecture["layers"]
+
+        for layer in layers:
+            for name in PACKED_NAMES:
+                if name in layer:
+                    entry = layer[name]
+                    shape = tuple(entry["shape"])
+                    dtype = np.dtype(entry.get("dtype", packed.dtype))
+
+                    # Files without dtypes hold float32 values, with offsets
+                    # counted in values
+                    offset = entry["offset"]
+
+                    if "dtype" not in entry:
+                        offset *= packed.itemsize
+
+                    size = int(np.prod(shape)) * dtype.itemsize
+                    layer[name] = data[offset:offset + size].view(
+                        dtype
+                    ).reshape(shape)
+
+        return cls(layers, tuple(architecture["input_shape"]))
+
+    def quantize(self, precision):
+        """Return a copy of the model with weights in reduced precision.
+
+        Biases are kept in float32, since they are small.
+
+        Args:
+            precision (str): "float32", "float16", or "int8" for int8 kernels
+                with one float32 scale per output channel.
+
+        Returns:
+            model (NumpyModel): The quantized model.
+
+        """
+
+        if precision not in PRECISIONS:
+            raise NotImplementedError(f"{precision} not implemented.")
+
+        layers = []
+
+        for layer in self.layers:
+            layer = dict(layer)
+
+            if "kernel" in layer:
+                kernel = np.asarray(layer["kernel"], dtype=np.float32)
+
+                if precision == "int8":
+                    layer["kernel"], layer["scale"] = quantize_int8(kernel)
+                else:
+                    layer["kernel"] = kernel.astype(precision)
+
+            layers.append(layer)
+
+        return NumpyModel(layers, self.input_shape, self.dtype)
+
+    @property
+    def nbytes(self):
+        """Memory of the stored weights in bytes."""
+
+        return sum([
+            layer[name].nbytes for layer in self.layers
+            for name in PACKED_NAMES if name in layer
+        ])
+
+    @property
+    def working_nbytes(self):
+        """Memory in bytes of the kernels converted for evaluation, which are
+        held by each process in addition to the stored weights."""
+
+        return sum([
+            layer["kernel"].size * np.dtype(self.dtype).itemsize
+            for layer in self.layers
+            if "kernel" in layer and layer["kernel"].dtype != self.dtype
+        ])
+
+    def kernel(self, index):
+        """Kernel of a layer in the evaluation dtype.
+
+        Kernels in reduced precision are converted on the first call, and
+        the converted kernel is kept for the following calls.
+
+        Args:
+            index (int): Index of layer.
+
+        Returns:
+            kernel (array): Kernel in dtype.
+
+        """
+
+        kernel = self._kernels.get(index)
+
+        if kernel is None:
+            kernel = self.layers[index]["kernel"]
+
+            if kernel.dtype != self.dtype:
+                kernel = kernel.astype(self.dtype)
+
+            self._kernels[index] = kernel
+
+        return kernel
+
+    def save_packed(self, filepath):
+        """Save the weights packed in one flat byte array.
+
+        Each array is kept in its own precision, so quantized models are
+        saved quantized.
+
+        Args:
+            filepath (str): Path to packed weights file (.npy). The
+                architecture, with the byte offset, shape and dtype of each
+                array, is saved to the .json file next to it.
+
+        """
+
+        arrays = []
+        layers = []
+        offset = 0
+
+        for layer in self.layers:
+            layer = dict(layer)
+
+            for name in PACKED_NAMES:
+                if name in layer:
+                    array = np.ascontiguousarray(layer[name])
+                    data = array.reshape(-1).view(np.uint8)
+                    padding = -data.size % PACKED_ALIGNMENT
+
+                    arrays.append(data)
+                    arrays.append(np.zeros(padding, dtype=np.uint8))
+                    layer[name] = {
+                        "offset": offset,
+                        "shape": list(array.shape),
+                        "dtype": array.dtype.str,
+                    }
+                    offset += data.size + padding
+
+            layers.append(layer)
+
+        np.save(filepath, np.concatenate(arrays))
+
+        with open(architecture_filepath(filepath), "w") as f:
+            json.dump({
+                "input_shape": list(self.input_shape),
+                "layers": layers,
+            }, f)
+
+    def predict(self, X):
+        """Estimate outputs.
+
+        Args:
+            X (array): Input of shape (steps, features) or (N, steps,
+                features).
+
+        Returns:
+            y (array): Output of shape (N, n_steps_out).
+
+        """
+
+        X = np.asarray(X, dtype=self.dtype)
+
+        if X.ndim == 2:
+            X = X[np.newaxis]
+
+        for i, layer in enumerate(self.layers):
+            if layer["type"] == "conv1d":
+                X = conv1d(X, self.kernel(i), layer["bias"],
+                        layer.get("scale"))
+            elif layer["type"] == "flatten":
+                X = X.reshape(len(X), -1)
+            elif layer["type"] == "dense":
+                X = dense(X, self.kernel(i), layer["bias"],
+                        layer.get("scale"))
+            else:
+                raise NotImplementedError(f"{layer['type']} not implemented.")
+
+            if "activation" in layer:
+                X = ACTIVATIONS[layer["activation"]](X)
+
+        return X
+
+    predict_on_batch = predict
+
+    def summary(self):
+        """Print a summary of the layers."""
+
+        n_params = 0
+
+        for layer in self.layers:
+            shapes = [layer[n].shape for n in WEIGHT_NAMES if n in layer]
+            n_params += sum([int(np.prod(shape)) for shape in shapes])
+            print("{:<10}{:<12}{}".format(
+                layer["type"], layer.get("activation", ""), shapes
+            ))
+
+        print(f"Total params: {n_params}")
+
+
+if __name__ == "__main__":
+
+    # Measure latency, and compare with the Keras model if given:
+    # python numpy_model.py model.npz [model.h5]
+    if sys.argv[1].endswith(".npy"):
+        model = NumpyModel.load_packed(sys.argv[1])
+    else:
+        model = NumpyModel.load(sys.argv[1])
+
+    model.summary()
+
+    for batch_size in (1, 32, 1024):
+        X = np.random.rand(batch_size, *model.input_shape)
+        model.predict(X)
+
+        n_runs = max(10, 10000 // batch_size)
+        t = time.perf_counter()
+
+        for _ in range(n_runs):
+            model.predict(X)
+
+        t = (time.perf_counter() - t) / n_runs
+
+        print("Batch size {}: {:.3f} ms per batch, {:.2f} us per window".format(
+            batch_size, t * 1e3, t * 1e6 / batch_size
+        ))
+
+    if len(sys.argv) > 2:
+        from tensorflow.keras import models
+
+        keras_model = models.load_model(sys.argv[2])
+        X = np.random.rand(256, *model.input_shape)
+
+        print("Max abs difference from Keras: {}".format(
+            np.abs(model.predict(X) - keras_model.predict(X)).max()
+        ))
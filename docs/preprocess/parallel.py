@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Run a preprocessing stage on several workouts in parallel.
+
+The workouts are independent, so each stage applies one function per
+workout in a pool of worker processes. Each worker reads, processes and
+writes its own workouts, so the file writes of one workout overlap with the
+computation of the others. The results are returned in the order of the
+input files, and each output file only depends on its own workout, so the
+outputs do not depend on the order the workers finish in.
+
+The number of workers is set by the parameter 'workers' in the 'parallel'
+section of params.yaml. With 1 worker, the workouts are processed serially
+in the main process, and with null, one worker is used per core.
+
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import yaml
+
+
+def read_workers():
+    """Read the number of workers from params.yaml.
+
+    Returns:
+        workers (int): Number of worker processes, at least 1.
+
+    """
+
+    params = yaml.safe_load(open("params.yaml")).get("parallel") or {}
+    workers = params.get("workers", 1)
+
+    if workers is None:
+        workers = len(os.sched_getaffinity(0))
+
+    return max(1, int(workers))
+
+
+def map_workouts(function, *iterables, workers=None):
+    """Apply a function to each workout, in parallel processes.
+
+    The function must be defined at the top level of a module, and its
+    arguments and results must be picklable.
+
+    Args:
+        function (callable): Function processing one workout.
+        iterables (list): Arguments of the function, one list per argument,
+            with one element per workout.
+        workers (int): Number of worker processes. If None, the number is
+            read from params.yaml.
+
+    Returns:
+        results (list): Result of each workout, in the order of the input.
+
+    """
+
+    arguments = list(zip(*iterables))
+
+    if workers is None:
+        workers = read_workers()
+
+    workers = min(workers, len(arguments))
+
+    if workers <= 1:
+        return [function(*args) for args in arguments]
+
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(function, *zip(*arguments)))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Run the preprocessing stages in memory, without intermediate files.
+
+The stages featurize, split, scale, sequentialize and combine are run in one
+process, with the same code and parameters as the separate stages, but the
+data is passed in memory from one stage to the next. The workouts are
+featurized in parallel (see parallel.py). Only the final artifacts are saved:
+
+- assets/data/combined/train.npz and test.npz (or the folders train and
+  test, if the combine parameter 'memmap' is True),
+- assets/data/scaled/scaler.sav,
+- assets/data/input_columns.csv.
+
+The arrays are identical to those of the separate stages with the columnar
+file format. With csv files, the separate stages can differ in the last bit
+of some values, from parsing the csv text.
+
+Example:
+
+    $ python preprocess/pipeline.py assets/data/raw/*.csv
+    $ python preprocess/pipeline.py --intermediate assets/data/raw/*.csv
+
+"""
+import argparse
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import yaml
+
+from columnar import COLUMNAR_SUFFIX
+from config import DATA_COMBINED_PATH, DATA_FEATURIZED_PATH, DATA_PATH
+from config import DATA_SCALED_PATH, DATA_SEQUENTIALIZED_PATH
+from config import DATA_SPLIT_PATH
+from featurize import featurize_blocks, featurize_dataframe
+from memmap import save_arrays
+from parallel import map_workouts
+from preprocess_utils import DataWriter
+from scale import create_scaler, merge_statistics, workout_arrays
+from sequentialize import sequentialize_arrays
+from streaming_scaler import ScalerStatistics
+from windows import WindowDataset
+
+
+def prepare_workout(filepath, params, output_filepaths=None):
+    """Featurize one workout and split it into inputs and targets.
+
+    Args:
+        filepath (str): Path to raw workout file.
+        params (dict): Parameters of the featurize stage.
+        output_filepaths (tuple of str): Paths to save the featurized, split
+            and scaled data to, or None to save nothing.
+
+    Returns:
+        X (array): Inputs, as saved by the scale stage.
+        y (array): Targets, as saved by the scale stage.
+        columns (list of str): Columns of the featurized data.
+
+    """
+
+    # As in the featurize stage, the workout is featurized block by block if
+    # the parameter 'chunk_size' is set
+    if params.get("chunk_size"):
+        blocks = featurize_blocks(filepath, params)
+    else:
+        blocks = [featurize_dataframe(filepath, params)]
+
+    writers = None
+
+    if output_filepaths is not None:
+        writers = [DataWriter(output_filepaths[0]),
+                DataWriter(output_filepaths[1])]
+
+    inputs, targets = [], []
+    n_rows = 0
+
+    for df in blocks:
+        if writers is not None:
+            writers[0].append(df)
+
+        # Rows with missing values are removed when the featurized data is
+        # read
+        df = df.dropna()
+        df.index = pd.RangeIndex(n_rows, n_rows + len(df))
+        n_rows += len(df)
+
+        X, y = workout_arrays(df)
+        inputs.append(X)
+        targets.append(y)
+
+        if writers is not None:
+            writers[1].append(df)
+
+    X, y = np.concatenate(inputs), np.concatenate(targets)
+
+    if writers is not None:
+        for writer in writers:
+            writer.close()
+
+        np.savez(output_filepaths[2], X=X, y=y)
+
+    return X, y, list(df.columns)
+
+
+def pipeline(filepaths, intermediate=False):
+    """Preprocess raw workouts into the combined train and test sets.
+
+    Args:
+        filepaths (list of str): Paths to raw workout files. The first
+            workouts are used for training, as in the split stage.
+        intermediate (bool): Whether to also save the data of each stage,
+            as the separate stages do.
+
+    """
+
+    # Handle special case where there is only one workout file.
+    if isinstance(filepaths, str) or len(filepaths) == 1:
+        raise NotImplementedError("Cannot handle only one workout file.")
+
+    params = yaml.safe_load(open("params.yaml"))
+    featurize_params = params["featurize"]
+    scale_params = params["scale"]
+    sequentialize_params = params["sequentialize"]
+    combine_params = params.get("combine") or {}
+    net = params["train"]["net"]
+
+    file_format = featurize_params.get("file_format", "csv")
+
+    if file_format == "csv":
+        suffix = ".csv"
+    elif file_format == "columnar":
+        suffix = COLUMNAR_SUFFIX
+    else:
+        raise NotImplementedError(f"{file_format} not implemented.")
+
+    # Parameter 'train_split' is used to find out no. of files in training set
+    file_split = int(len(filepaths) * params["split"]["train_split"])
+    categories = [
+        "train" if i < file_split else "test" for i in range(len(filepaths))
+    ]
+
+    output_filepaths = [None] * len(filepaths)
+
+    if intermediate:
+        for path in (DATA_FEATURIZED_PATH, DATA_SPLIT_PATH, DATA_SCALED_PATH,
+                DATA_SEQUENTIALIZED_PATH):
+            path.mkdir(parents=True, exist_ok=True)
+
+        for i, (filepath, category) in enumerate(zip(filepaths, categories)):
+            name = os.path.splitext(os.path.basename(filepath))[0]
+            output_filepaths[i] = (
+                DATA_FEATURIZED_PATH / f"{name}-featurized{suffix}",
+                DATA_SPLIT_PATH / f"{name}-{category}{suffix}",
+                DATA_SCALED_PATH / f"{name}-{category}-scaled.npz",
+            )
+
+    workouts = map_workouts(prepare_workout, filepaths,
+            [featurize_params] * len(filepaths), output_filepaths)
+
+    DATA_PATH.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(workouts[-1][2]).to_csv(DATA_PATH / "input_columns.csv")
+
+    # Fit the scaler as the scale stage does. The inputs are saved unscaled,
+    # so the scaler is only stored.
+    method = scale_params["method"]
+    scaler = create_scaler(method)
+    train_inputs = [
+        X for (X, y, columns), category in zip(workouts, categories)
+        if category == "train"
+    ]
+
+    if scale_params.get("streaming", False):
+        statistics = [ScalerStatistics(method).update(X) for X in train_inputs]
+        scaler = merge_statistics(method, statistics).fit(scaler)
+    else:
+        scaler = scaler.fit(np.concatenate(train_inputs))
+
+    DATA_SCALED_PATH.mkdir(parents=True, exist_ok=True)
+    joblib.dump(scaler, DATA_SCALED_PATH / "scaler.sav")
+
+    datasets = {"train": [], "test": []}
+
+    for i, (X, y, columns) in enumerate(workouts):
+        dataset = sequentialize_arrays(X, y, sequentialize_params, net)
+        datasets[categories[i]].append(dataset)
+
+        if intermediate:
+            dataset.save(
+                DATA_SEQUENTIALIZED_PATH / os.path.basename(
+                    output_filepaths[i][2]
+                )
+            )
+
+    DATA_COMBINED_PATH.mkdir(parents=True, exist_ok=True)
+
+    for category, parts in datasets.items():
+        combined = type(parts[0]).concatenate(parts)
+
+        if not combine_params.get("memmap", False):
+            combined.save(DATA_COMBINED_PATH / f"{category}.npz")
+            continue
+
+        arrays = {"X": combined.X, "y": combined.y}
+
+        if isinstance(combined, WindowDataset):
+            arrays["starts"] = combined.starts
+            arrays["hist_size"] = np.asarray(combined.hist_size)
+
+        save_arrays(DATA_COMBINED_PATH / category, **arrays)
+
+
+if __name__ == "__main__":
+
+    np.random.seed(2020)
+
+    parser = argparse.ArgumentParser(
+        description="Preprocess raw workouts in memory"
+    )
+    parser.add_argument("workouts", nargs="+",
+            help="raw workout files")
+    parser.add_argument("--intermediate", action="store_true",
+            help="also save the data of each stage")
+    args = parser.parse_args()
+
+    pipeline(args.workouts, args.intermediate)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare accuracy, latency and memory of the inference precisions.
+
+The test set is estimated by the NumPy model with float32, float16 and int8
+weights. For each precision the MSE and R2, their change from float32, the
+latency per batch and the memory of the weights are reported, and saved to
+assets/metrics/precision.json.
+
+The memory is reported in two parts: the stored weights, which are shared by
+all processes loading the same packed file, and the float32 working copies of
+the kernels in reduced precision, which each process converts once and keeps.
+
+Example:
+
+    $ python preprocess/precision_report.py assets/models/model.npz \\
+        assets/data/combined/test.npz
+
+"""
+import json
+import sys
+import time
+
+import numpy as np
+from sklearn.metrics import mean_squared_error, r2_score
+
+from config import (
+    DATA_COMBINED_PATH,
+    MODELS_WEIGHTS_FILE_PATH,
+    PRECISION_METRICS_FILE_PATH,
+)
+from numpy_model import PRECISIONS, NumpyModel
+from memmap import is_memmap_dataset
+from windows import is_window_dataset, load_dataset
+
+
+def predict(model, X, batch_size=1024):
+    """Estimate outputs in batches, to limit memory use."""
+
+    return np.concatenate([
+        model.predict(X[i:i + batch_size])
+        for i in range(0, len(X), batch_size)
+    ])
+
+
+def latency(model, X, batch_size, n_runs=200):
+    """Median time in seconds of a forward pass of one batch."""
+
+    X = X[:batch_size]
+    model.predict(X)
+    times = []
+
+    for _ in range(n_runs):
+        t = time.perf_counter()
+        model.predict(X)
+        times.append(time.perf_counter() - t)
+
+    return float(np.median(times))
+
+
+def precision_report(weights_filepath, test_filepath,
+        precisions=PRECISIONS, batch_sizes=(1, 32)):
+    """Compare the inference precisions on the test set.
+
+    Args:
+        weights_filepath (str): Path to weights exported by export_weights.py.
+        test_filepath (str): Path to test set.
+        precisions (list of str): Precisions to compare.
+        batch_sizes (list of int): Batch sizes to measure latency for.
+
+    Returns:
+        report (dict): Metrics of each precision.
+
+    """
+
+    PRECISION_METRICS_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+    # The windows of a WindowDataset or a memory-mapped dataset are generated
+    # or read batch by batch when it is indexed.
+    if is_window_dataset(test_filepath) or is_memmap_dataset(test_filepath):
+        X_test = load_dataset(test_filepath)
+        y_test = X_test.y
+    else:
+        test = np.load(test_filepath)
+
+        X_test = test["X"].astype(np.float32)
+        y_test = test["y"]
+
+    model = NumpyModel.load(weights_filepath)
+    y_reference = predict(model, X_test)
+
+    mse_reference = mean_squared_error(y_test, y_reference)
+    r2_reference = r2_score(y_test, y_reference)
+
+    report = {}
+
+    for precision in precisions:
+        quantized = model.quantize(precision)
+        y_pred = predict(quantized, X_test)
+
+        mse = mean_squared_error(y_test, y_pred)
+        r2 = r2_score(y_test, y_pred)
+
+        report[precision] = {
+            "mse": float(mse),
+            "r2": float(r2),
+            "mse_delta": float(mse - mse_reference),
+            "r2_delta": float(r2 - r2_reference),
+            "max_abs_deviation": float(np.abs(y_pred - y_reference).max()),
+            "weights_bytes": quantized.nbytes,
+            "working_bytes": quantized.working_nbytes,
+            "latency": {
+                batch_size: latency(quantized, X_test, batch_size)
+                for batch_size in batch_sizes
+            },
+        }
+
+    print("{:<10}{:>12}{:>12}{:>10}{:>12}{:>12}{:>12}{}".format(
+        "precision", "MSE", "MSE delta", "R2", "R2 delta", "weights kB",
+        "working kB",
+        "".join(["{:>14}".format(f"ms (batch {b})") for b in batch_sizes])
+    ))
+
+    for precision, metrics in report.items():
+        print(("{:<10}{:>12.4f}{:>12.2e}{:>10.4f}{:>12.2e}{:>12.1f}{:>12.1f}"
+                "{}").format(
+            precision, metrics["mse"], metrics["mse_delta"], metrics["r2"],
+            metrics["r2_delta"], metrics["weights_bytes"] / 1024,
+            metrics["working_bytes"] / 1024,
+            "".join([
+                "{:>14.3f}".format(metrics["latency"][b] * 1e3)
+                for b in batch_sizes
+            ])
+        ))
+
+    with open(PRECISION_METRICS_FILE_PATH, "w") as f:
+        json.dump(report, f, indent=4)
+
+    return report
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3:
+        precision_report(MODELS_WEIGHTS_FILE_PATH,
+                DATA_COMBINED_PATH / "test.npz")
+    else:
+        precision_report(sys.argv[1], sys.argv[2])
@@ -14,6 +14,7 @@ import matplotlib.pyplot as plt
 
 import datetime
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import os
 import pandas as pd
 import pickle
@@ -24,6 +25,7 @@ from scipy.fftpack import fft, ifft
 
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
 
+from columnar import TableWriter, is_columnar, read_table, write_table
 from utils import *
 
 
@@ -41,15 +43,13 @@ def read_csv(filename, delete_columns=[], verbose=False):
 
     """
 
-    # Get input matrix from file
-    df = pd.read_csv(filename, index_col=0)
+    # Get input matrix from file, skipping the deleted columns while parsing
+    df = pd.read_csv(filename, index_col=0,
+            usecols=lambda col: col not in delete_columns)
 
     if verbose:
         print_dataframe(df, "DATAFRAME FROM CSV")
 
-    for col in delete_columns:
-        del df[col]
-
     df.dropna(inplace=True)
     df.reset_index(inplace=True, drop=True)
     index = df.index
@@ -61,6 +61,98 @@ def read_csv(filename, delete_columns=[], verbose=False):
     return df, index
 
 
+def read_data(filename, columns=None, dtypes=None, verbose=False):
+    """Read a csv file or a columnar table of intermediate data.
+
+    Rows with missing values are removed, as in read_csv().
+
+    Args:
+        filename (str): Path to csv file, or to folder of columnar table.
+        columns (list of str): Columns to read. All columns by default. Only
+            these columns are read from a columnar table.
+        dtypes (dict): Dtype of some of the columns.
+        verbose (bool): Whether to print info about the file.
+
+    Returns:
+        df (DataFrame): Data frame read from file.
+        index (Index): Index of data frame read from file.
+
+    """
+
+    if not is_columnar(filename):
+        df, index = read_csv(filename, verbose=verbose)
+
+        if columns is not None:
+            df = df[columns]
+
+        return df.astype(dtypes or {}), index
+
+    df = read_table(filename, columns, dtypes)
+
+    df = df.dropna()
+    df.reset_index(inplace=True, drop=True)
+    index = df.index
+
+    if verbose:
+        print("Data file loaded: {}".format(filename))
+        print("Length of data set: {}".format(len(df)))
+
+    return df, index
+
+
+def write_data(df, filename):
+    """Write intermediate data to a csv file or a columnar table.
+
+    Args:
+        df (DataFrame): Data to write.
+        filename (str): Path to csv file, or to folder of columnar table
+            (ending with '.cols').
+
+    """
+
+    if is_columnar(filename):
+        write_table(df, filename)
+    else:
+        df.to_csv(filename)
+
+
+class DataWriter:
+    """Write intermediate data block by block, to a csv file or a columnar
+    table.
+
+    For csv files the index of each block is written, so the blocks should
+    have consecutive indices.
+
+    Args:
+        filename (str): Path to csv file, or to folder of columnar table
+            (ending with '.cols').
+
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self._table = TableWriter(filename) if is_columnar(filename) else None
+        self._first = True
+
+    def append(self, df):
+        """Append the rows of a data frame."""
+
+        if self._table is not None:
+            self._table.append(df)
+        else:
+            df.to_csv(self.filename, mode="w" if self._first else "a",
+                    header=self._first)
+
+        self._first = False
+
+    def close(self):
+        """Finish writing the file."""
+
+        if self._table is not None:
+            self._table.close()
+
+
 def print_dataframe(df, message=""):
     """Print dataframe to terminal, with boundary and message.
 
@@ -97,9 +189,13 @@ def move_column(df, column_name, new_idx):
     return df[reordered_columns]
 
 
-def split_sequences(sequences, hist_size, target_mean_window=1, n_steps_out=1):
+def split_sequences(sequences, hist_size, target_mean_window=1, n_steps_out=1,
+        stride=1):
     """Split data sequence into samples with matching input and targets.
 
+    The input samples are a strided view of the sequences, without copying,
+    and the mean targets are computed from the cumulative sum.
+
     Args:
         sequences (array): The matrix containing the sequences, with the
             targets in the first column.
@@ -110,42 +206,46 @@ def split_sequences(sequences, hist_size, target_mean_window=1, n_steps_out=1):
             with this parameter. Default=1, i.e. only one value is used as
             target.
         n_steps_out (int): Number of output steps.
+        stride (int): Number of time steps between the start of consecutive
+            samples. Default=1, i.e. a sample starts at every time step.
 
     Returns:
-        X (array): The input samples.
+        X (array): The input samples, as a read-only view of sequences.
         y (array): The targets.
 
     """
-    X, y = list(), list()
 
-    for i in range(len(sequences)):
+    sequences = np.asarray(sequences)
+    n_samples = len(sequences) - hist_size - n_steps_out + 1
 
-        # find the end of this pattern
-        end_ix = i + hist_size
-        out_end_ix = end_ix + n_steps_out
+    if n_samples <= 0:
+        return np.array([]), np.array([])
 
-        # find start of target window
-        target_start_ix = out_end_ix - target_mean_window
+    # Shape (n_samples, hist_size, n_features), viewing the input columns
+    X = sliding_window_view(sequences[:, 1:], hist_size, axis=0)
+    X = X[:n_samples:stride].transpose(0, 2, 1)
 
-        # check if we are beyond the dataset
-        if out_end_ix > len(sequences):
-            break
-       
-        # Select all cols from sequences except target col, which leaves inputs
-        seq_x = sequences[i:end_ix, 1:]
+    if target_mean_window > 1:
+        out_end = np.arange(0, n_samples, stride) + hist_size + n_steps_out
+        start = out_end - target_mean_window
 
-        # Extract targets from sequences
-        if target_mean_window > 1:
-            seq_y = [np.mean(sequences[target_start_ix: out_end_ix, 0])]
-        else:
-            seq_y = sequences[end_ix:out_end_ix, 0]
+        total = np.concatenate([[0], np.cumsum(sequences[:, 0],
+            dtype=np.float64)])
+        y = (total[out_end] - total[np.maximum(start, 0)]) / target_mean_window
 
-        X.append(seq_x)
-        y.append(seq_y)
+        # Windows starting before the first time step, where the mean is
+        # taken over a slice with a negative start index
+        for i in np.flatnonzero(start < 0):
+            y[i] = np.mean(sequences[start[i]:out_end[i], 0])
+
+        if np.issubdtype(sequences.dtype, np.floating):
+            y = y.astype(sequences.dtype)
+
+        y = y[:, np.newaxis]
+    else:
+        y = sliding_window_view(sequences[hist_size:, 0], n_steps_out)
+        y = y[:n_samples:stride]
 
-    X = np.array(X)
-    y = np.array(y)
-    
     return X, y
 
 def flatten_sequentialized(X):
@@ -21,8 +21,12 @@ import numpy as np
 from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
 import yaml
 
+from cache import StageCache
 from config import DATA_SCALED_PATH
-from preprocess_utils import read_csv, scale_data
+from columnar import COLUMNAR_SUFFIX, is_columnar
+from parallel import map_workouts
+from preprocess_utils import read_data, scale_data
+from streaming_scaler import ScalerStatistics
 
 def scale(filepaths):
     """Scale training and test data.
@@ -41,63 +45,146 @@ def scale(filepaths):
 
     params = yaml.safe_load(open("params.yaml"))["scale"]
     method = params["method"]
-    
+    scaler = create_scaler(method)
+
+    train_filepaths = []
+    output_filepaths = []
+
+    for filepath in filepaths:
+        if "train" in filepath:
+            train_filepaths.append(filepath)
+            category = "train"
+        elif "test" in filepath:
+            category = "test"
+        else:
+            raise ValueError(f"{filepath} is neither train nor test data.")
+
+        suffix = COLUMNAR_SUFFIX if is_columnar(filepath) else ".csv"
+
+        output_filepaths.append(
+            DATA_SCALED_PATH
+            / (
+                os.path.basename(filepath).replace(
+                    category + suffix, category + "-scaled.npz"
+                )
+            )
+        )
+
+    cache = StageCache("scale", params, [
+        "scale.py", "preprocess_utils.py", "columnar.py",
+        "streaming_scaler.py", "parallel.py"
+    ])
+
+    scaler_filepath = DATA_SCALED_PATH / "scaler.sav"
+    key = cache.key(train_filepaths, scaler_filepath)
+    hit, _ = cache.lookup(key, scaler_filepath)
+
+    if not hit:
+        if params.get("streaming", False):
+            # Fit from statistics collected from each workout
+            statistics = map_workouts(workout_statistics, train_filepaths,
+                    [method] * len(train_filepaths))
+            scaler = merge_statistics(method, statistics).fit(scaler)
+        else:
+            X_train = np.concatenate(
+                map_workouts(read_inputs, train_filepaths)
+            )
+
+            # Fit a scaler to the training data
+            scaler = scaler.fit(X_train)
+
+        joblib.dump(scaler, scaler_filepath)
+        cache.store(key, scaler_filepath)
+
+    cache.map(save_workout, filepaths, output_filepaths)
+    cache.save()
+
+
+def create_scaler(method):
+    """Create an unfitted scaler.
+
+    Args:
+        method (str): Scaling method, 'standard', 'minmax' or 'robust'.
+
+    Returns:
+        scaler: The scaler.
+
+    """
+
     if method == "standard":
-        scaler = StandardScaler()
+        return StandardScaler()
     elif method == "minmax":
-        scaler = MinMaxScaler()
+        return MinMaxScaler()
     elif method == "robust":
-        scaler = RobustScaler()
+        return RobustScaler()
     else:
-        raise NotImplementedError(f"{scaler_type} not implemented.")
+        raise NotImplementedError(f"{method} not implemented.")
 
-    train_inputs = []
 
-    data_overview = {}
+def merge_statistics(method, statistics):
+    """Merge the scaler statistics of the workouts, in their order."""
 
-    for filepath in filepaths:
+    merged = ScalerStatistics(method)
 
-        df, index = read_csv(filepath)
-        
-        # Convert to numpy
-        data = df.to_numpy()
+    for workout in statistics:
+        merged.merge(workout)
 
-        # Split into input (X) and output/target (y)
-        X = data[:, 1:].copy()
-        y = data[:, 0].copy().reshape(-1, 1)
+    return merged
 
 
-        if "train" in filepath:
-            train_inputs.append(X)
-            category = "train"
-        elif "test" in filepath:
-            category = "test"
-            
-        data_overview[filepath] = {"X": X, "y": y, "category": category}
+def workout_arrays(df):
+    """Split the data of one workout into inputs (X) and targets (y).
 
-    X_train = np.concatenate(train_inputs)
+    Args:
+        df (DataFrame): Data with the target in the first column.
 
-    # Fit a scaler to the training data
-    scaler = scaler.fit(X_train)
-    joblib.dump(scaler, DATA_SCALED_PATH / "scaler.sav")
+    Returns:
+        X (array): Inputs.
+        y (array): Targets, of shape (n_samples, 1).
 
-    for filepath in data_overview:
+    """
 
-        # Scale inputs
-        X = scaler.transform(data_overview[filepath]["X"])
+    # Convert to numpy
+    data = df.to_numpy()
 
-        # Save X and y into a binary file
-        np.savez(
-            DATA_SCALED_PATH
-            / (
-                os.path.basename(filepath).replace(
-                    data_overview[filepath]["category"] + ".csv", 
-                    data_overview[filepath]["category"] + "-scaled.npz"
-                )
-            ),
-            X=data_overview[filepath]["X"],
-            y=data_overview[filepath]["y"]
-        )
+    # Split into input (X) and output/target (y)
+    X = data[:, 1:].copy()
+    y = data[:, 0].copy().reshape(-1, 1)
+
+    return X, y
+
+
+def read_inputs(filepath):
+    """Read the inputs (X) of one workout."""
+
+    df, index = read_data(filepath)
+
+    return workout_arrays(df)[0]
+
+
+def workout_statistics(filepath, method):
+    """Collect the statistics for fitting a scaler from one workout."""
+
+    return ScalerStatistics(method).update(read_inputs(filepath))
+
+
+def save_workout(filepath, output_filepath):
+    """Save the inputs and targets of one workout.
+
+    Args:
+        filepath (str): Path to file to scale.
+        output_filepath (str): Path to save the inputs and targets to.
+
+    """
+
+    df, index = read_data(filepath)
+    X, y = workout_arrays(df)
+
+    # The inputs are saved unscaled, as the app does not scale its inputs
+    # (see scale() in app.py). The scaler is only stored.
+
+    # Save X and y into a binary file
+    np.savez(output_filepath, X=X, y=y)
 
 
 if __name__ == "__main__":
@@ -5,6 +5,11 @@ Prepare the data for input to a neural network. A sequence with a given history
 size is extracted from the input data, and matched with the appropriate target
 value(s).
 
+If the parameter 'lazy' is True, the sequences are not stored. Only the input
+data, the targets and the start of each sequence are saved, as a
+WindowDataset, and the sequences are generated during training and
+evaluation.
+
 Author:
     Erik Johannes Husom
 
@@ -18,9 +23,11 @@ import sys
 import numpy as np
 import yaml
 
+from cache import StageCache
 from config import DATA_SEQUENTIALIZED_PATH
 from preprocess_utils import flatten_sequentialized, read_csv
 from preprocess_utils import split_sequences
+from windows import ArrayDataset, WindowDataset
 
 
 def sequentialize(filepaths):
@@ -34,41 +41,78 @@ def sequentialize(filepaths):
     params = yaml.safe_load(open("params.yaml"))["sequentialize"]
     net = yaml.safe_load(open("params.yaml"))["train"]["net"]
 
+    output_filepaths = [
+        DATA_SEQUENTIALIZED_PATH / (
+            os.path.basename(filepath).replace(
+                "scaled.csv", "sequentialized.npz"
+            )
+        )
+        for filepath in filepaths
+    ]
+
+    cache = StageCache("sequentialize", dict(params, net=net), [
+        "sequentialize.py", "preprocess_utils.py", "windows.py"
+    ])
+    cache.map(sequentialize_workout, filepaths, output_filepaths,
+            [params] * len(filepaths), [net] * len(filepaths))
+    cache.save()
+
+
+def sequentialize_workout(filepath, output_filepath, params, net):
+    """Split the data of one workout into sequences and save them.
+
+    Args:
+        filepath (str): Path to file with scaled data.
+        output_filepath (str): Path to save the sequences to.
+        params (dict): Parameters of the sequentialize stage.
+        net (str): Type of network the sequences are input to.
+
+    """
+
+    infile = np.load(filepath)
+
+    sequentialize_arrays(infile["X"], infile["y"], params,
+            net).save(output_filepath)
+
+
+def sequentialize_arrays(X, y, params, net):
+    """Split the inputs and targets of one workout into sequences.
+
+    Args:
+        X (array): Inputs of shape (n_samples, n_features).
+        y (array): Targets of shape (n_samples, 1).
+        params (dict): Parameters of the sequentialize stage.
+        net (str): Type of network the sequences are input to.
+
+    Returns:
+        dataset (WindowDataset or ArrayDataset): The sequences, as a
+            WindowDataset if the parameter 'lazy' is True.
+
+    """
+
     hist_size = params["hist_size"]
     use_elements = params["use_elements"]
     target_mean_window = params["target_mean_window"]
+    lazy = params.get("lazy", False)
 
-    for filepath in filepaths:
-
-        infile = np.load(filepath)
+    if use_elements > 1:
+        X = X[::use_elements]
+        y = y[::use_elements]
 
-        X = infile["X"]
-        y = infile["y"]
+    # Combine y and X to get correct format for sequentializing
+    data = np.hstack((y, X))
 
-        if use_elements > 1:
-            X = X[::use_elements]
-            y = y[::use_elements]
+    # Split into sequences
+    X, y = split_sequences(data, hist_size, target_mean_window)
 
-        # Combine y and X to get correct format for sequentializing
-        data = np.hstack((y, X))
+    if lazy:
+        # The sequences are flattened for the dnn when generated
+        return WindowDataset(data[:, 1:], y, np.arange(len(y)), hist_size)
 
-        # Split into sequences
-        X, y = split_sequences(data, hist_size, target_mean_window)
+    if net == "dnn":
+        X = flatten_sequentialized(X)
 
-        if net == "dnn":
-            X = flatten_sequentialized(X)
-
-        # Save X and y into a binary file
-        np.savez(
-            DATA_SEQUENTIALIZED_PATH
-            / (
-                os.path.basename(filepath).replace(
-                    "scaled.csv", "sequentialized.npz"
-                )
-            ),
-            X=X,
-            y=y,
-        )
+    return ArrayDataset(X, y)
 
 
 if __name__ == "__main__":
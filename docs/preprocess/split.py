@@ -14,9 +14,10 @@ import sys
 import numpy as np
 import yaml
 
+from cache import StageCache
 from config import DATA_SPLIT_PATH
 # from config import DATA_SPLIT_TRAIN_PATH, DATA_SPLIT_TEST_PATH
-from preprocess_utils import read_csv
+from preprocess_utils import read_data, write_data
 
 def split(filepaths):
     """Split data into train and test set.
@@ -42,23 +43,33 @@ def split(filepaths):
     # Parameter 'train_split' is used to find out no. of files in training set
     file_split = int(len(filepaths) * params["train_split"])
 
-    training_files = filepaths[:file_split]
-    test_files = filepaths[file_split:]
+    output_filepaths = []
 
-    for filepath in filepaths:
+    for i, filepath in enumerate(filepaths):
+        category = "train" if i < file_split else "test"
+        output_filepaths.append(
+            DATA_SPLIT_PATH
+            / (os.path.basename(filepath).replace("featurized", category))
+        )
 
-        df, index = read_csv(filepath)
+    cache = StageCache("split", params, [
+        "split.py", "preprocess_utils.py", "columnar.py"
+    ])
+    cache.map(split_workout, filepaths, output_filepaths)
+    cache.save()
 
-        if filepath in training_files:
-            df.to_csv(
-                DATA_SPLIT_PATH
-                / (os.path.basename(filepath).replace("featurized", "train"))
-            )
-        elif filepath in test_files:
-            df.to_csv(
-                DATA_SPLIT_PATH
-                / (os.path.basename(filepath).replace("featurized", "test"))
-            )
+
+def split_workout(filepath, output_filepath):
+    """Copy the data of one workout to the train or test set.
+
+    Args:
+        filepath (str): Path to file containing featurized data.
+        output_filepath (str): Path to save the data to.
+
+    """
+
+    df, index = read_data(filepath)
+    write_data(df, output_filepath)
 
 if __name__ == "__main__":
 
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Incremental feature engine for streaming ribcage data.
+
+Computes the same features as features.add_features, but one sample at a time
+with constant cost per sample:
+
+- ribcage_range: Rolling min/max with monotonic deques, smoothed by a rolling
+  mean computed from a running sum.
+- ribcage_gradient: Central difference, which needs one sample of lookahead.
+- ribcage_slope_sin/cos: Sine and cosine of the slope angle over
+  'slope_shift' samples, computed algebraically from the slope.
+- ribcage_frequency: Breathing frequency from the breath peaks, smoothed by
+  an exponentially weighted mean. It is computed for each update at once by
+  features.ChunkedFeatures, without a loop over the samples.
+
+The outputs are bit-for-bit equal to the batch versions in features.py.
+
+Example:
+
+    >>> engine = StreamingFeatures(["ribcage_gradient",
+    ...     "ribcage_slope_cyclic"], slope_shift=1)
+    >>> rows = engine.update(new_values)
+
+"""
+from collections import deque
+
+import numpy as np
+
+from features import ChunkedFeatures
+
+
+class RollingMin:
+    """Rolling minimum over a fixed window, using a monotonic deque.
+
+    Args:
+        window (int): Number of samples in window.
+
+    """
+
+    def __init__(self, window):
+
+        self.window = window
+        self.n = 0
+        self._deque = deque()
+
+    def _keep(self, old, new):
+        return old < new
+
+    def update(self, x):
+        """Add one sample.
+
+        Returns:
+            value (float): Rolling value, or NaN if the window is not full.
+
+        """
+
+        while self._deque and not self._keep(self._deque[-1][1], x):
+            self._deque.pop()
+
+        self._deque.append((self.n, x))
+
+        if self._deque[0][0] <= self.n - self.window:
+            self._deque.popleft()
+
+        self.n += 1
+
+        if self.n < self.window:
+            return np.nan
+
+        return self._deque[0][1]
+
+
+class RollingMax(RollingMin):
+    """Rolling maximum over a fixed window, using a monotonic deque.
+
+    Args:
+        window (int): Number of samples in window.
+
+    """
+
+    def _keep(self, old, new):
+        return old > new
+
+
+class RollingMean:
+    """Rolling mean over a fixed window, using a running sum.
+
+    The window sum is the difference between two values of the cumulative
+    sum, which gives the same result as features.rolling_mean.
+
+    Args:
+        window (int): Number of samples in window.
+
+    """
+
+    def __init__(self, window):
+
+        self.window = window
+        self.n = 0
+        self.total = 0.0
+        self._totals = deque([0.0], maxlen=window + 1)
+
+    def update(self, x):
+        """Add one sample.
+
+        Returns:
+            value (float): Rolling mean, or NaN if the window is not full.
+
+        """
+
+        self.total = self.total + x
+        self._totals.append(self.total)
+        self.n += 1
+
+        if self.n < self.window:
+            return np.nan
+
+        return (self._totals[-1] - self._totals[0]) / self.window
+
+
+class StreamingFeatures:
+    """Incremental version of the ribcage features in features.add_features.
+
+    Feature rows are emitted in the column order of add_features, once every
+    feature of a sample is defined. Since the gradient is a central
+    difference, the row of a sample is emitted when the next sample arrives.
+
+    Args:
+        features (list): Features to compute, as in params.yaml.
+        range_window (int): How many time steps to use when calculating range.
+        range_smoothing (int): Rolling mean window for smoothing range.
+        slope_shift (int): How many time steps to use when calculating slope.
+        peak_distance (int): How many time steps on each side of a breath
+            peak must be lower.
+        frequency_smoothing (float): Span of exponentially weighted mean for
+            smoothing breathing frequency.
+        scale (bool): Whether to scale the raw values before computing
+            features.
+        breathing_min (float): Minimum raw value, used for scaling.
+        breathing_max (float): Maximum raw value, used for scaling.
+
+    """
+
+    def __init__(self, features,
+            range_window=100,
+            range_smoothing=1,
+            slope_shift=2,
+            peak_distance=8,
+            frequency_smoothing=100,
+            scale=True,
+            breathing_min=0,
+            breathing_max=4096,
+        ):
+
+        self.use_range = "ribcage_range" in features
+        self.use_gradient = "ribcage_gradient" in features
+        self.use_slope = "ribcage_slope_cyclic" in features
+        self.use_frequency = "ribcage_frequency" in features
+
+        self.columns = []
+
+        if self.use_range:
+            self.columns.append("ribcage_range")
+        if self.use_gradient:
+            self.columns.append("ribcage_gradient")
+        if self.use_slope:
+            self.columns += ["ribcage_slope_sin", "ribcage_slope_cos"]
+        if self.use_frequency:
+            self.columns.append("ribcage_frequency")
+
+        self.slope_shift = slope_shift
+        self.scale = scale
+        self.breathing_min = breathing_min
+        self.breathing_range = breathing_max - breathing_min
+
+        self._min = RollingMin(range_window)
+        self._max = RollingMax(range_window)
+        self._range_mean = RollingMean(range_smoothing)
+        self._history = deque(maxlen=slope_shift + 1)
+
+        # Emits the frequency of the same samples as the rows, since it also
+        # holds back the newest sample
+        self._frequency = ChunkedFeatures(["ribcage_frequency"],
+                peak_distance=peak_distance,
+                frequency_smoothing=frequency_smoothing,
+        )
+
+        # Features of the newest sample, waiting for its successor
+        self._pending = None
+
+    @property
+    def n_features(self):
+        """Number of columns in the emitted rows."""
+
+        return len(self.columns)
+
+    def update(self, values):
+        """Add new raw samples.
+
+        Args:
+            values (array): New raw ribcage samples.
+
+        Returns:
+            rows (array): Feature rows finalized by the new samples, of shape
+                (n, n_features).
+
+        """
+
+        values = np.asarray(values).reshape(-1)
+
+        if self.scale:
+            values = (values - self.breathing_min) / self.breathing_range
+
+        values = values.astype(np.float64, copy=False)
+
+        rows = []
+
+        for x in values:
+            x = float(x)
+            row = self._pending
+
+            if row is not None:
+                if self.use_gradient:
+                    row[1] = x - row[1] if row[2] is None \
+                        else (x - row[2]) / 2.0
+                rows.append(row)
+
+            self._pending = self._step(x)
+
+        frequency = None
+
+        if self.use_frequency:
+            frequency = self._frequency.update(values)["ribcage_frequency"]
+
+        return self._emit(rows, frequency)
+
+    def flush(self):
+        """Finalize the newest sample at the end of a series.
+
+        The gradient of the last sample is a one-sided difference, as with
+        np.gradient.
+
+        Returns:
+            rows (array): The last feature row, if it is defined.
+
+        """
+
+        row = self._pending
+        self._pending = None
+
+        frequency = None
+
+        if self.use_frequency:
+            frequency = self._frequency.flush()["ribcage_frequency"]
+
+        if row is None:
+            return self._emit([])
+
+        if self.use_gradient:
+            row[1] = np.nan if row[2] is None else row[1] - row[2]
+
+        return self._emit([row], frequency)
+
+    def _step(self, x):
+        """Update the rolling state with one scaled sample.
+
+        Returns:
+            row (list): [range, x, previous x, slope] of the sample, where the
+                gradient is computed from x and previous x once the next
+                sample arrives.
+
+        """
+
+        previous = self._history[-1] if self._history else None
+        self._history.append(x)
+
+        ribcage_range = np.nan
+        slope = np.nan
+
+        if self.use_range:
+            ribcage_min = self._min.update(x)
+            ribcage_max = self._max.update(x)
+
+            if ribcage_min == ribcage_min:
+                ribcage_range = self._range_mean.update(
+                    ribcage_max - ribcage_min
+                )
+
+        if self.use_slope and len(self._history) > self.slope_shift:
+            slope = (x - self._history[0]) / (0.1 * self.slope_shift)
+
+        return [ribcage_range, x, previous, slope]
+
+    def _emit(self, rows, frequency=None):
+        """Convert internal rows to feature rows, dropping undefined rows.
+
+        Args:
+            rows (list): Internal rows, as returned by _step().
+            frequency (array): Breathing frequency of each row, if used.
+
+        """
+
+        out = np.empty((len(rows), self.n_features))
+
+        for i, (ribcage_range, gradient, _, slope) in enumerate(rows):
+            values = []
+
+            if self.use_range:
+                values.append(ribcage_range)
+            if self.use_gradient:
+                values.append(gradient)
+            if self.use_slope:
+                # Sine and cosine of arctan(slope), as features.slope_cyclic
+                hypotenuse = np.hypot(1.0, slope)
+                values += [slope / hypotenuse, 1.0 / hypotenuse]
+            if self.use_frequency:
+                values.append(frequency[i])
+
+            out[i] = values
+
+        return out[~np.isnan(out).any(axis=1)]
+
+
+def replay(filepath, features, chunk_size=7, **params):
+    """Replay a recording through the streaming feature engine.
+
+    Args:
+        filepath (str): Path to recording, with the columns time, airflow,
+            ribcage and heartrate.
+        features (list): Features to compute, as in params.yaml.
+        chunk_size (int): Number of samples pushed at a time. The FLOW sensor
+            sends 7 samples per notification.
+        **params: Arguments passed on to StreamingFeatures.
+
+    Returns:
+        rows (array): All feature rows of the recording.
+
+    """
+
+    ribcage = np.loadtxt(filepath, delimiter=",", usecols=2)
+
+    engine = StreamingFeatures(features, **params)
+    rows = [
+        engine.update(ribcage[i:i + chunk_size])
+        for i in range(0, len(ribcage), chunk_size)
+    ]
+    rows.append(engine.flush())
+
+    return np.concatenate(rows)
+
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Fit scalers in one pass over the workouts, with bounded memory.
+
+Instead of concatenating all training data to fit a scaler, the statistics
+the scaler needs are collected from one workout at a time:
+
+- StandardScaler and MinMaxScaler need the count, mean, variance, minimum and
+  maximum of each feature, which are kept as running moments.
+- RobustScaler needs the median and quartiles of each feature, which are
+  estimated by a quantile sketch (KLL). The sketch keeps a bounded number of
+  values, with a rank error of roughly 1 / sketch_size, and is exact until it
+  holds more than sketch_size values.
+
+The statistics of different workouts can be merged, so they can be collected
+in parallel. The result is an ordinary fitted scikit-learn scaler.
+
+Example:
+
+    >>> statistics = ScalerStatistics("robust")
+    >>> for X in workouts:
+    ...     statistics.update(X)
+    >>> scaler = statistics.fit(RobustScaler())
+
+"""
+import math
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler, MinMaxScaler, RobustScaler
+
+
+DEFAULT_SKETCH_SIZE = 2000
+"""Number of values kept at the top level of a quantile sketch."""
+
+SKETCH_DECAY = 2 / 3
+"""Factor the capacity decreases by for each lower level of a sketch."""
+
+
+def handle_zeros_in_scale(scale):
+    """Replace scales of constant features by 1, as scikit-learn does."""
+
+    return np.where(scale < 10 * np.finfo(scale.dtype).eps, 1.0, scale)
+
+
+class QuantileSketch:
+    """Mergeable sketch of the quantiles of each feature (KLL).
+
+    The sketch has levels of values, where each value at level h represents
+    2**h values of the input. When a level exceeds its capacity, it is sorted
+    and every other value is promoted to the next level, so the total weight
+    is kept while the number of values is halved.
+
+    Args:
+        n_features (int): Number of features.
+        sketch_size (int): Capacity of the top level. Lower levels have
+            smaller capacities, and the sketch holds at most about 3 times
+            this number of values per feature.
+        seed (int): Seed of the random choice of values to promote.
+
+    """
+
+    def __init__(self, n_features, sketch_size=DEFAULT_SKETCH_SIZE,
+            seed=2020):
+
+        self.n_features = n_features
+        self.sketch_size = sketch_size
+        self.levels = [np.empty((0, n_features))]
+        self.n = 0
+        self._rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        """Number of values a level can hold."""
+
+        depth = len(self.levels) - 1 - level
+
+        return max(2, math.ceil(self.sketch_size * SKETCH_DECAY**depth))
+
+    def update(self, X):
+        """Add values of shape (n_samples, n_features)."""
+
+        X = np.asarray(X, dtype=np.float64)
+
+        self.levels[0] = np.concatenate([self.levels[0], X])
+        self.n += len(X)
+        self.compress()
+
+    def merge(self, other):
+        """Add the values of another sketch."""
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty((0, self.n_features)))
+
+        for level, values in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], values])
+
+        self.n += other.n
+        self.compress()
+
+    def compress(self):
+        """Compact the levels that exceed their capacity."""
+
+        level = 0
+
+        while level < len(self.levels):
+            values = self.levels[level]
+
+            if len(values) <= self.capacity(level):
+                level += 1
+                continue
+
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty((0, self.n_features)))
+
+            # Each feature is sorted separately. With an odd number of
+            # values, the largest stays at this level.
+            values = np.sort(values, axis=0)
+            n_promoted = len(values) // 2
+            offset = self._rng.integers(2)
+            promoted = values[offset:2 * n_promoted:2]
+
+            self.levels[level] = values[2 * n_promoted:]
+            self.levels[level + 1] = np.concatenate(
+                [self.levels[level + 1], promoted]
+            )
+
+            # The capacities shrink when a level is added, so start over
+            level = 0
+
+    def quantile(self, q):
+        """Estimate quantiles, with linear interpolation as np.percentile.
+
+        Args:
+            q (float): Quantile between 0 and 1.
+
+        Returns:
+            quantiles (array): Estimated quantile of each feature.
+
+        """
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(v), 2**level) for level, v in enumerate(self.levels)
+        ])
+
+        quantiles = np.empty(self.n_features)
+
+        for feature in range(self.n_features):
+            order = np.argsort(values[:, feature], kind="stable")
+            w = weights[order]
+
+            # Rank in the input of each value, which is its index in the
+            # sorted input if all weights are 1
+            ranks = np.cumsum(w) - (w + 1) / 2
+
+            quantiles[feature] = np.interp(
+                q * (self.n - 1), ranks, values[order, feature]
+            )
+
+        return quantiles
+
+
+class RunningMoments:
+    """Mergeable count, mean, variance, minimum and maximum of each feature.
+
+    Args:
+        n_features (int): Number of features.
+
+    """
+
+    def __init__(self, n_features):
+
+        self.n = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.min = np.full(n_features, np.inf)
+        self.max = np.full(n_features, -np.inf)
+
+    @property
+    def var(self):
+        """Variance of each feature."""
+
+        return self.m2 / max(self.n, 1)
+
+    def update(self, X):
+        """Add values of shape (n_samples, n_features)."""
+
+        X = np.asarray(X, dtype=np.float64)
+
+        if len(X) == 0:
+            return
+
+        batch = RunningMoments(X.shape[1])
+        batch.n = len(X)
+        batch.mean = X.mean(axis=0)
+        batch.m2 = ((X - batch.mean)**2).sum(axis=0)
+        batch.min = X.min(axis=0)
+        batch.max = X.max(axis=0)
+
+        self.merge(batch)
+
+    def merge(self, other):
+        """Add the moments of another set of values."""
+
+        n = self.n + other.n
+
+        if n == 0:
+            return
+
+        delta = other.mean - self.mean
+
+        self.mean = self.mean + delta * other.n / n
+        self.m2 = self.m2 + other.m2 + delta**2 * self.n * other.n / n
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n = n
+
+
+class ScalerStatistics:
+    """Statistics needed to fit a scaler, collected batch by batch.
+
+    Args:
+        method (str): Scaling method, 'standard', 'minmax' or 'robust'.
+        sketch_size (int): Size of the quantile sketches, for 'robust'.
+        seed (int): Seed of the quantile sketches.
+
+    """
+
+    def __init__(self, method, sketch_size=DEFAULT_SKETCH_SIZE, seed=2020):
+
+        if method not in ("standard", "minmax", "robust"):
+            raise NotImplementedError(f"{method} not implemented.")
+
+        self.method = method
+        self.sketch_size = sketch_size
+        self.seed = seed
+        self.moments = None
+        self.sketch = None
+
+    def update(self, X):
+        """Add inputs of shape (n_samples, n_features).
+
+        Rows with missing values are skipped.
+
+        """
+
+        X = np.asarray(X, dtype=np.float64)
+        X = X[~np.isnan(X).any(axis=1)]
+
+        if self.moments is None:
+            self.moments = RunningMoments(X.shape[1])
+
+            if self.method == "robust":
+                self.sketch = QuantileSketch(X.shape[1], self.sketch_size,
+                        self.seed)
+
+        self.moments.update(X)
+
+        if self.sketch is not None:
+            self.sketch.update(X)
+
+        return self
+
+    def merge(self, other):
+        """Add the statistics of other inputs."""
+
+        if other.moments is None:
+            return self
+
+        if self.moments is None:
+            self.moments = RunningMoments(other.moments.mean.shape[0])
+
+            if other.sketch is not None:
+                self.sketch = QuantileSketch(other.sketch.n_features,
+                        self.sketch_size, self.seed)
+
+        self.moments.merge(other.moments)
+
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+
+        return self
+
+    def fit(self, scaler):
+        """Set the fitted attributes of a scikit-learn scaler.
+
+        Args:
+            scaler (StandardScaler, MinMaxScaler or RobustScaler): Scaler
+                with the parameters to use, e.g. quantile_range.
+
+        Returns:
+            scaler: The fitted scaler.
+
+        """
+
+        moments = self.moments
+        n_features = len(moments.mean)
+
+        if isinstance(scaler, StandardScaler):
+            scaler.mean_ = moments.mean if scaler.with_mean else None
+            scaler.var_ = moments.var if scaler.with_std else None
+            scaler.scale_ = (
+                handle_zeros_in_scale(np.sqrt(moments.var))
+                if scaler.with_std else None
+            )
+            scaler.n_samples_seen_ = moments.n
+        elif isinstance(scaler, MinMaxScaler):
+            feature_min, feature_max = scaler.feature_range
+            data_range = moments.max - moments.min
+
+            scaler.data_min_ = moments.min
+            scaler.data_max_ = moments.max
+            scaler.data_range_ = data_range
+            scaler.scale_ = (
+                (feature_max - feature_min) / handle_zeros_in_scale(data_range)
+            )
+            scaler.min_ = feature_min - moments.min * scaler.scale_
+            scaler.n_samples_seen_ = moments.n
+        elif isinstance(scaler, RobustScaler):
+            if self.sketch is None:
+                raise ValueError("Statistics were not collected for robust.")
+
+            q_min, q_max = scaler.quantile_range
+
+            scaler.center_ = (
+                self.sketch.quantile(0.5) if scaler.with_centering else None
+            )
+
+            if scaler.with_scaling:
+                scale = (self.sketch.quantile(q_max / 100)
+                        - self.sketch.quantile(q_min / 100))
+                scale = handle_zeros_in_scale(scale)
+
+                if getattr(scaler, "unit_variance", False):
+                    from scipy.stats import norm
+                    scale = scale / (
+                        norm.ppf(q_max / 100) - norm.ppf(q_min / 100)
+                    )
+
+                scaler.scale_ = scale
+            else:
+                scaler.scale_ = None
+        else:
+            raise NotImplementedError(f"{type(scaler)} not implemented.")
+
+        scaler.n_features_in_ = n_features
+
+        return scaler
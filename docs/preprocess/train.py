@@ -23,6 +23,8 @@ import yaml
 from config import MODELS_PATH, MODELS_FILE_PATH, TRAININGLOSS_PLOT_PATH
 from config import PLOTS_PATH
 from model import DeepPowerHyperModel, cnn, dnn, lstm, cnndnn
+from memmap import is_memmap_dataset
+from windows import WindowDataset, is_window_dataset, load_dataset
 
 def train(filepath):
     """Train model to estimate power.
@@ -38,13 +40,26 @@ def train(filepath):
     params = yaml.safe_load(open("params.yaml"))["train"]
     net = params["net"]
 
-    # Load training set
-    train = np.load(filepath)
+    # Load training set. The windows of a WindowDataset are generated while
+    # training, and memory-mapped windows are read from disk while training.
+    if is_window_dataset(filepath) or is_memmap_dataset(filepath):
+        dataset = load_dataset(filepath)
 
-    X_train = train["X"]
-    y_train = train["y"]
+        y_train = dataset.y
+        hist_size = dataset.hist_size
+        n_features = dataset.n_features
 
-    n_features = X_train.shape[-1]
+        if net == "dnn" and isinstance(dataset, WindowDataset):
+            n_features *= hist_size
+    else:
+        dataset = None
+        train = np.load(filepath)
+
+        X_train = train["X"]
+        y_train = train["y"]
+
+        n_features = X_train.shape[-1]
+        hist_size = X_train.shape[-2]
 
     # Create sample weights
     sample_weights = np.ones_like(y_train)
@@ -52,8 +67,6 @@ def train(filepath):
     if params["weigh_samples"]:
         sample_weights[y_train > params["weight_thresh"]] = params["weight"]
 
-    hist_size = X_train.shape[-2]
-
     # hypermodel = DeepPowerHyperModel(hist_size, n_features)
 
     # # hp = HyperParameters()
@@ -108,7 +121,6 @@ def train(filepath):
 
     # Build model
     if net == "cnn":
-        hist_size = X_train.shape[-2]
         model = cnn(hist_size, n_features,
                 kernel_size=params["kernel_size"]
         )
@@ -133,13 +145,26 @@ def train(filepath):
         dpi=96
     )
 
-    history = model.fit(
-        X_train, y_train, 
-        epochs=params["n_epochs"], 
-        batch_size=params["batch_size"],
-        validation_split=0.2,
-        sample_weight=sample_weights
-    )
+    if dataset is None:
+        history = model.fit(
+            X_train, y_train, 
+            epochs=params["n_epochs"], 
+            batch_size=params["batch_size"],
+            validation_split=0.2,
+            sample_weight=sample_weights
+        )
+    else:
+        # Hold out the last 20 % of the windows, as validation_split does
+        split = int(np.ceil(len(dataset) * 0.8))
+
+        history = model.fit(
+            dataset.keras_sequence(params["batch_size"], np.arange(split),
+                sample_weights, flatten=net == "dnn", shuffle=True),
+            validation_data=dataset.keras_sequence(params["batch_size"],
+                np.arange(split, len(dataset)), sample_weights,
+                flatten=net == "dnn"),
+            epochs=params["n_epochs"],
+        )
 
     model.save(MODELS_FILE_PATH)
 
@@ -16,6 +16,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from columnar import is_columnar, read_table
 from preprocess_utils import read_csv, move_column
 
 def visualize(stage="restructured"):
@@ -37,7 +38,10 @@ def visualize(stage="restructured"):
         filepath = data_dir + filepath
 
         # Read csv, and delete specified columns
-        df = pd.read_csv(filepath, index_col=0)
+        if is_columnar(filepath):
+            df = read_table(filepath)
+        else:
+            df = pd.read_csv(filepath, index_col=0)
 
         df.plot()
         plt.title(filepath)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Lazy history windows for training and evaluation.
+
+Instead of storing every window, which repeats each time step hist_size times,
+a WindowDataset stores the flat feature matrix of the workouts, the target of
+each window and the row where each window starts. Windows are generated when
+they are indexed, one batch at a time.
+
+Combined datasets can also be stored as memory-mapped arrays (see memmap.py).
+A WindowDataset is then generated from the memory-mapped feature matrix, and
+an ArrayDataset reads stored windows from disk batch by batch.
+
+Example:
+
+    >>> dataset = WindowDataset.load("assets/data/combined/train.npz")
+    >>> X = dataset[:128]
+    >>> for X, y in dataset.batches(128):
+    ...     y_pred = model.predict(X)
+
+"""
+import math
+import os
+
+import numpy as np
+
+from memmap import is_memmap_dataset, load_arrays
+
+
+def is_window_dataset(filepath):
+    """Whether a data file or memory-mapped dataset has a WindowDataset."""
+
+    if is_memmap_dataset(filepath):
+        return os.path.exists(os.path.join(filepath, "starts.npy"))
+
+    with np.load(filepath) as f:
+        return "starts" in f.files
+
+
+def load_dataset(filepath):
+    """Load a WindowDataset, or a memory-mapped ArrayDataset.
+
+    Args:
+        filepath (str): Path to a .npz file with a WindowDataset, or to the
+            folder of a memory-mapped dataset.
+
+    Returns:
+        dataset (WindowDataset or ArrayDataset): The dataset.
+
+    """
+
+    if is_window_dataset(filepath):
+        return WindowDataset.load(filepath)
+
+    arrays = load_arrays(filepath)
+
+    return ArrayDataset(arrays["X"], arrays["y"])
+
+
+class BatchDataset:
+    """Windows and targets which are read or generated batch by batch.
+
+    Subclasses define the targets y, __len__() and __getitem__().
+
+    """
+
+    def batches(self, batch_size, indices=None, flatten=False):
+        """Generate windows one batch at a time.
+
+        Args:
+            batch_size (int): Number of windows in each batch.
+            indices (array): Index of the windows to generate, in order. All
+                windows are generated by default.
+            flatten (bool): Whether to flatten each window to one row, as the
+                input of the dnn.
+
+        Yields:
+            X (array): Windows of one batch.
+            y (array): Targets of one batch.
+
+        """
+
+        if indices is None:
+            indices = np.arange(len(self))
+
+        for i in range(0, len(indices), batch_size):
+            batch = indices[i:i + batch_size]
+            X = self[batch]
+
+            if flatten:
+                X = X.reshape(len(X), -1)
+
+            yield X, self.y[batch]
+
+    def keras_sequence(self, batch_size, indices=None, sample_weights=None,
+            flatten=False, shuffle=False):
+        """Wrap windows as a Keras Sequence, for model.fit().
+
+        Args:
+            batch_size (int): Number of windows in each batch.
+            indices (array): Index of the windows to use. All windows are used
+                by default.
+            sample_weights (array): Weight of each window, indexed like y.
+            flatten (bool): Whether to flatten each window to one row.
+            shuffle (bool): Whether to shuffle the windows after each epoch.
+
+        Returns:
+            sequence (keras.utils.Sequence): Batches of windows and targets.
+
+        """
+
+        from tensorflow.keras.utils import Sequence
+
+        dataset = self
+
+        if indices is None:
+            indices = np.arange(len(self))
+
+        class WindowSequence(Sequence):
+
+            def __init__(self):
+
+                super().__init__()
+                self.indices = np.array(indices)
+
+                if shuffle:
+                    np.random.shuffle(self.indices)
+
+            def __len__(self):
+
+                return math.ceil(len(self.indices) / batch_size)
+
+            def __getitem__(self, i):
+
+                batch = self.indices[i * batch_size:(i + 1) * batch_size]
+                X = dataset[batch]
+
+                if flatten:
+                    X = X.reshape(len(X), -1)
+
+                if sample_weights is None:
+                    return X, dataset.y[batch]
+
+                return X, dataset.y[batch], sample_weights[batch]
+
+            def on_epoch_end(self):
+
+                if shuffle:
+                    np.random.shuffle(self.indices)
+
+        return WindowSequence()
+
+
+class WindowDataset(BatchDataset):
+    """History windows of a flat feature matrix, generated on demand.
+
+    Args:
+        X (array): Feature matrix of shape (n_rows, n_features), with one or
+            more workouts after each other.
+        y (array): Targets of shape (n_windows, n_steps_out).
+        starts (array): Row of X where each window starts. Windows never
+            cross from one workout into the next.
+        hist_size (int): Number of time steps in each window.
+
+    """
+
+    def __init__(self, X, y, starts, hist_size):
+
+        self.X = X
+        self.y = y
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.hist_size = int(hist_size)
+        self._offsets = np.arange(self.hist_size)
+
+    @classmethod
+    def concatenate(cls, datasets):
+        """Combine the windows of several workouts into one dataset."""
+
+        offsets = np.cumsum([0] + [len(d.X) for d in datasets[:-1]])
+
+        return cls(
+            np.concatenate([d.X for d in datasets]),
+            np.concatenate([d.y for d in datasets]),
+            np.concatenate([d.starts + o for d, o in zip(datasets, offsets)]),
+            datasets[0].hist_size,
+        )
+
+    @classmethod
+    def load(cls, filepath):
+        """Load a dataset saved by save(), or combined as memory-mapped
+        arrays."""
+
+        if is_memmap_dataset(filepath):
+            arrays = load_arrays(filepath)
+            return cls(arrays["X"], arrays["y"], arrays["starts"],
+                    arrays["hist_size"])
+
+        with np.load(filepath) as f:
+            return cls(f["X"], f["y"], f["starts"], f["hist_size"])
+
+    def save(self, filepath):
+        """Save the dataset to a .npz file."""
+
+        np.savez(filepath, X=self.X, y=self.y, starts=self.starts,
+                hist_size=self.hist_size)
+
+    @property
+    def n_features(self):
+        """Number of features at each time step."""
+
+        return self.X.shape[1]
+
+    def __len__(self):
+
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        """Generate windows.
+
+        Args:
+            index (int, slice or array): Index of windows.
+
+        Returns:
+            X (array): Windows of shape (..., hist_size, n_features).
+
+        """
+
+        return self.X[self.starts[index][..., np.newaxis] + self._offsets]
+
+    def last_rows(self):
+        """The last time step of each window, of shape (n_windows, n_features).
+        """
+
+        return self.X[self.starts + self.hist_size - 1]
+
+
+class ArrayDataset(BatchDataset):
+    """Stored windows, such as memory-mapped arrays, read batch by batch.
+
+    Args:
+        X (array): Windows of shape (n_windows, hist_size, n_features), or
+            (n_windows, hist_size * n_features) if flattened for the dnn.
+        y (array): Targets of shape (n_windows, n_steps_out).
+
+    """
+
+    def __init__(self, X, y):
+
+        self.X = X
+        self.y = y
+
+    @classmethod
+    def concatenate(cls, datasets):
+        """Combine the windows of several workouts into one dataset."""
+
+        return cls(
+            np.concatenate([d.X for d in datasets]),
+            np.concatenate([d.y for d in datasets]),
+        )
+
+    def save(self, filepath):
+        """Save the dataset to a .npz file."""
+
+        np.savez(filepath, X=self.X, y=self.y)
+
+    @property
+    def hist_size(self):
+        """Number of time steps in each window, or None if flattened."""
+
+        return self.X.shape[1] if self.X.ndim == 3 else None
+
+    @property
+    def n_features(self):
+        """Number of inputs at each time step, or of a flattened window."""
+
+        return self.X.shape[-1]
+
+    def __len__(self):
+
+        return len(self.X)
+
+    def __getitem__(self, index):
+
+        return np.asarray(self.X[index])
+
+    def last_rows(self):
+        """The last time step of each window."""
+
+        return self.X[:, -1] if self.X.ndim == 3 else self.X
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Registry of versioned models for the estimation server.
+
+Each model version is a folder holding the model file and the params.yaml it
+was trained with, from which the feature configuration and history size are
+read. Files placed directly in the model folder form the version "default".
+
+    model/
+        model.h5            <- version "default"
+        params.yaml
+        2021-03-01/
+            model.h5        <- version "2021-03-01"
+            params.yaml
+
+New versions are loaded and warmed up in a background thread, and then swapped
+in as the active version by replacing a single reference, so requests are
+never blocked by a load. Requests hold a version while they use it, and
+streaming sessions for as long as they are open. A version that is replaced
+or unloaded is only stopped when the last request or session holding it is
+done. Older versions stay loaded for pinned requests until unloaded.
+
+Example:
+
+    >>> registry = ModelRegistry("model/", load_model, feature_params,
+    ...     warm_up=warm_up)
+    >>> registry.load("default")
+    >>> registry.load_async("2021-03-01")
+    >>> with registry.hold() as version:
+    ...     y = version.batcher.predict(X)
+
+"""
+from concurrent.futures import Future
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+import yaml
+
+from batching import MicroBatcher
+
+
+DEFAULT_VERSION = "default"
+
+
+def read_params(path, default_feature_params, default_hist_size):
+    """Read the feature parameters and history size of a model version.
+
+    Args:
+        path (str): Folder of the version.
+        default_feature_params (dict): Feature parameters used if the folder
+            has no params.yaml.
+        default_hist_size (int): History size used if the folder has no
+            params.yaml.
+
+    Returns:
+        feature_params (dict): The 'featurize' parameters of the model.
+        hist_size (int): Number of feature rows in each estimation window.
+
+    """
+
+    params_filepath = os.path.join(path, "params.yaml")
+
+    if not os.path.exists(params_filepath):
+        return default_feature_params, default_hist_size
+
+    with open(params_filepath) as f:
+        params = yaml.safe_load(f)
+
+    hist_size = params.get("sequentialize", {}).get(
+        "hist_size", default_hist_size
+    )
+
+    return params["featurize"], hist_size
+
+
+class ModelVersion:
+    """A loaded model with its feature configuration.
+
+    Args:
+        name (str): Name of version.
+        path (str): Folder of the version.
+        model: Object with the method predict_on_batch.
+        feature_params (dict): The 'featurize' parameters of the model.
+        hist_size (int): Number of feature rows in each estimation window.
+        **batcher_kwargs: Arguments passed on to MicroBatcher.
+
+    """
+
+    def __init__(self, name, path, model, feature_params, hist_size,
+            **batcher_kwargs):
+
+        self.name = name
+        self.path = path
+        self.model = model
+        self.feature_params = feature_params
+        self.hist_size = hist_size
+        self.batcher = MicroBatcher(model.predict_on_batch, **batcher_kwargs)
+        self.loaded_at = time.time()
+        self.load_times = {}
+
+        self._holders = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Hold the version, so it is not stopped while it is in use."""
+
+        with self._lock:
+            self._holders += 1
+
+    def release(self):
+        """Release the version, and stop it if it is retired and no longer
+        held."""
+
+        with self._lock:
+            self._holders -= 1
+            stop = self._retired and self._holders == 0
+
+        if stop:
+            self.batcher.stop()
+
+    def retire(self):
+        """Stop the version when the requests and sessions holding it are
+        done."""
+
+        with self._lock:
+            self._retired = True
+            stop = self._holders == 0
+
+        if stop:
+            self.batcher.stop()
+
+    def info(self):
+        """Description of the version, for listing."""
+
+        return {
+            "version": self.name,
+            "features": list(self.feature_params["features"]),
+            "hist_size": self.hist_size,
+            "loaded_at": self.loaded_at,
+            "load_times": self.load_times,
+        }
+
+
+class ModelRegistry:
+    """Thread-safe collection of loaded model versions.
+
+    Args:
+        path (str): Folder holding the model versions.
+        load_model (callable): Function taking the folder of a version and
+            returning the loaded model.
+        default_feature_params (dict): Feature parameters used if a version
+            has no params.yaml.
+        default_hist_size (int): History size used if a version has no
+            params.yaml.
+        warm_up (callable): Optional function taking a ModelVersion, called
+            before the version can be used.
+        **batcher_kwargs: Arguments passed on to MicroBatcher.
+
+    """
+
+    def __init__(self, path, load_model, default_feature_params,
+            default_hist_size=50, warm_up=None, **batcher_kwargs):
+
+        self.path = path
+        self.load_model = load_model
+        self.default_feature_params = default_feature_params
+        self.default_hist_size = default_hist_size
+        self.warm_up = warm_up
+        self.batcher_kwargs = batcher_kwargs
+
+        self._versions = {}
+        self._active = None
+        self._loading = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def version_path(self, version):
+        """Folder of a model version."""
+
+        if version == DEFAULT_VERSION:
+            return self.path
+
+        if os.path.basename(version) != version or version in ("", ".", ".."):
+            raise ValueError(f"Invalid model version: {version}")
+
+        return os.path.join(self.path, version)
+
+    def load(self, version, activate=True):
+        """Load and warm up a model version, blocking until it is ready.
+
+        Args:
+            version (str): Name of version.
+            activate (bool): Whether to make the version the active one.
+
+        Returns:
+            model_version (ModelVersion): The loaded version.
+
+        """
+
+        path = self.version_path(version)
+        feature_params, hist_size = read_params(
+            path, self.default_feature_params, self.default_hist_size
+        )
+
+        t = time.perf_counter()
+        model = self.load_model(path)
+        load_time = time.perf_counter() - t
+
+        model_version = ModelVersion(version, path, model, feature_params,
+                hist_size, **self.batcher_kwargs)
+        model_version.load_times["load_model"] = load_time
+
+        t = time.perf_counter()
+
+        if self.warm_up is not None:
+            self.warm_up(model_version)
+
+        model_version.load_times["warm_up"] = time.perf_counter() - t
+
+        with self._lock:
+            old = self._versions.get(version)
+            self._versions[version] = model_version
+
+            if activate or self._active is None:
+                self._active = version
+
+        if old is not None:
+            old.retire()
+
+        return model_version
+
+    def load_async(self, version, activate=True):
+        """Load a model version in a background thread.
+
+        Args:
+            version (str): Name of version.
+            activate (bool): Whether to make the version the active one when
+                it is ready.
+
+        Returns:
+            future (Future): Resolves to the loaded ModelVersion. If the
+                version is already being loaded, the pending future is
+                returned.
+
+        """
+
+        self.version_path(version)
+
+        with self._lock:
+            if version in self._loading:
+                return self._loading[version]
+
+            future = Future()
+            self._loading[version] = future
+
+        def run():
+            try:
+                model_version = self.load(version, activate)
+            except Exception as e:
+                with self._lock:
+                    self._errors[version] = repr(e)
+
+                future.set_exception(e)
+            else:
+                with self._lock:
+                    self._errors.pop(version, None)
+
+                future.set_result(model_version)
+            finally:
+                with self._lock:
+                    del self._loading[version]
+
+        threading.Thread(target=run, daemon=True).start()
+
+        return future
+
+    def activate(self, version):
+        """Make a loaded version the active one.
+
+        Raises:
+            KeyError: If the version is not loaded.
+
+        """
+
+        with self._lock:
+            if version not in self._versions:
+                raise KeyError(version)
+
+            self._active = version
+
+    def unload(self, version):
+        """Unload a version that is not active.
+
+        Raises:
+            KeyError: If the version is not loaded.
+            ValueError: If the version is active.
+
+        """
+
+        with self._lock:
+            if version not in self._versions:
+                raise KeyError(version)
+
+            if version == self._active:
+                raise ValueError("The active version cannot be unloaded.")
+
+            model_version = self._versions.pop(version)
+
+        model_version.retire()
+
+    def get(self, version=None):
+        """Look up a loaded version.
+
+        Args:
+            version (str): Name of version, or None for the active version.
+
+        Returns:
+            model_version (ModelVersion): The version.
+
+        Raises:
+            KeyError: If the version is not loaded.
+
+        """
+
+        with self._lock:
+            return self._versions[self._active if version is None else version]
+
+    def acquire(self, version=None):
+        """Look up a loaded version and hold it until it is released.
+
+        Args:
+            version (str): Name of version, or None for the active version.
+
+        Returns:
+            model_version (ModelVersion): The version, which must be released
+                with its release() method.
+
+        Raises:
+            KeyError: If the version is not loaded.
+
+        """
+
+        with self._lock:
+            model_version = self._versions[
+                self._active if version is None else version
+            ]
+            model_version.acquire()
+
+        return model_version
+
+    @contextmanager
+    def hold(self, version=None):
+        """Hold a loaded version while the block runs.
+
+        Args:
+            version (str): Name of version, or None for the active version.
+
+        Yields:
+            model_version (ModelVersion): The version.
+
+        Raises:
+            KeyError: If the version is not loaded.
+
+        """
+
+        model_version = self.acquire(version)
+
+        try:
+            yield model_version
+        finally:
+            model_version.release()
+
+    @property
+    def active(self):
+        """Name of the active version, or None if no version is loaded."""
+
+        return self._active
+
+    @property
+    def loading(self):
+        """Names of the versions that are being loaded."""
+
+        with self._lock:
+            return list(self._loading)
+
+    @property
+    def queue_depth(self):
+        """Number of requests waiting to be batched, over all versions."""
+
+        with self._lock:
+            versions = list(self._versions.values())
+
+        return sum([v.batcher.queue_depth for v in versions])
+
+    def info(self):
+        """Description of the loaded versions."""
+
+        with self._lock:
+            versions = list(self._versions.values())
+
+        return {
+            "active": self._active,
+            "loading": self.loading,
+            "errors": dict(self._errors),
+            "versions": [v.info() for v in versions],
+        }
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Estimate airflow for whole recordings offline.
+
+The features of each recording are computed once over the full series, by the
+same code and parameters as the server uses. All estimation windows are then
+strided views of the feature matrix, which are estimated in large batches.
+Several recordings are scored in parallel processes.
+
+The estimate at a sample is the one the live server gives when the window
+ends at that sample. Because the gradient looks one sample ahead, the server
+gives it one sample later. Missing samples are skipped, as by the server, and
+samples without a full window get NaN. The output is one csv file per
+recording, with the columns time and airflow.
+
+The feature ribcage_frequency is an exception. It is smoothed by an
+exponentially weighted mean over all earlier samples of the recording, while
+/getEstimation only has the samples of the request. Its estimates then only
+match those of a streaming session opened at the start of the recording.
+
+The model is loaded by model_loader.py, without importing the server.
+
+Example:
+
+    $ python score.py 5.csv recordings/*.csv --output-dir estimates
+
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import model_loader
+from preprocess.features import compute_features, engine_params
+from registry import read_params
+
+
+# Set in each worker process by init_worker()
+model = None
+feature_params = None
+hist_size = None
+
+
+def init_worker(model_path, backend):
+    """Load the model and its parameters in a worker process."""
+
+    global model, feature_params, hist_size
+
+    if backend is not None:
+        model_loader.backend = backend
+
+    model = model_loader.load_model(model_path)
+    feature_params, hist_size = read_params(
+        model_path, model_loader.feature_params, model_loader.hist_size
+    )
+
+
+def windows(ribcage):
+    """Compute the estimation windows of a recording.
+
+    Args:
+        ribcage (array): Raw ribcage values.
+
+    Returns:
+        X (array): Strided view of shape (n_windows, hist_size, n_features),
+            with the same windows as the server computes.
+        ends (array): Sample index of the last row of each window.
+
+    """
+
+    # Missing samples are removed before the features are computed, as by
+    # preprocess() in app.py
+    samples = np.flatnonzero(~np.isnan(ribcage))
+
+    X, _ = compute_features(ribcage[samples], **engine_params(feature_params))
+
+    complete = ~np.isnan(X).any(axis=1)
+    warmup = np.argmax(complete) if complete.any() else len(X)
+
+    # The last sample has no successor for the gradient, and is only used as
+    # lookahead by the server.
+    if "ribcage_gradient" in feature_params["features"]:
+        X = X[:-1]
+
+    X = X[warmup:]
+
+    if len(X) < hist_size:
+        return np.empty((0, hist_size, X.shape[1])), np.empty(0, dtype=int)
+
+    view = sliding_window_view(X, hist_size, axis=0).transpose(0, 2, 1)
+    ends = samples[warmup + hist_size - 1:warmup + len(X)]
+
+    return view, ends
+
+
+def score(filepath, output_dir, batch_size=4096):
+    """Estimate airflow for one recording and save it.
+
+    Args:
+        filepath (str): Path to recording, with the columns time, airflow,
+            ribcage and heartrate.
+        output_dir (str): Folder to save the estimated airflow in.
+        batch_size (int): Number of windows in each forward pass.
+
+    Returns:
+        output_filepath (str): Path to the saved estimates.
+        n_windows (int): Number of estimated windows.
+
+    """
+
+    data = np.loadtxt(filepath, delimiter=",", usecols=(0, 2), ndmin=2)
+    time, ribcage = data[:, 0], data[:, 1]
+
+    X, ends = windows(ribcage)
+
+    airflow = np.full(len(ribcage), np.nan)
+
+    for start in range(0, len(X), batch_size):
+        y = model.predict_on_batch(X[start:start + batch_size])
+        airflow[ends[start:start + batch_size]] = np.asarray(y)[:, 0]
+
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    output_filepath = os.path.join(output_dir, name + "_airflow.csv")
+
+    np.savetxt(output_filepath, np.column_stack([time, airflow]),
+            delimiter=",", fmt="%.6g", header="time,airflow", comments="")
+
+    return output_filepath, len(X)
+
+
+def score_all(filepaths, output_dir, model_path=model_loader.PATH,
+        backend=None, n_workers=None, batch_size=4096):
+    """Estimate airflow for several recordings in parallel.
+
+    Args:
+        filepaths (list of str): Paths to recordings.
+        output_dir (str): Folder to save the estimated airflow in.
+        model_path (str): Folder of the model version to use.
+        backend (str): Inference backend, or None for the one set in
+            model_loader.py.
+        n_workers (int): Number of worker processes. If None, one per core,
+            but not more than the number of recordings.
+        batch_size (int): Number of windows in each forward pass.
+
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if n_workers is None:
+        n_workers = min(len(filepaths), os.cpu_count() or 1)
+
+    with ProcessPoolExecutor(n_workers, initializer=init_worker,
+            initargs=(model_path, backend)) as executor:
+        results = executor.map(score, filepaths,
+                [output_dir] * len(filepaths), [batch_size] * len(filepaths))
+
+        for filepath, (output_filepath, n_windows) in zip(filepaths, results):
+            print("{}: {} windows -> {}".format(
+                filepath, n_windows, output_filepath
+            ))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Estimate airflow for whole recordings"
+    )
+    parser.add_argument("recordings", nargs="+",
+            help="csv files with recorded workouts, e.g. 5.csv")
+    parser.add_argument("--output-dir", default="estimates",
+            help="folder to save the estimated airflow in")
+    parser.add_argument("--model", default=model_loader.PATH,
+            help="folder of the model version to use")
+    parser.add_argument("--backend", choices=["keras", "numpy"], default=None,
+            help="inference backend, default as set in model_loader.py")
+    parser.add_argument("--workers", type=int, default=None,
+            help="number of worker processes")
+    parser.add_argument("--batch-size", type=int, default=4096,
+            help="number of windows in each forward pass")
+    args = parser.parse_args()
+
+    score_all(args.recordings, args.output_dir, args.model, args.backend,
+            args.workers, args.batch_size)
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Pre-fork multi-process server for the estimation app.
+
+The master process opens the listening socket and forks the workers, which
+all accept connections on it. Each worker loads the model on its own. With the
+numpy backend the packed weights (model.npy, or model-int8.npy etc. for a
+reduced precision) are memory-mapped read-only, so all workers share one copy
+of the weights instead of holding one each.
+
+The number of threads used by the numerical libraries (BLAS, OpenMP,
+TensorFlow) is limited in each worker before they are imported, and each
+worker can be pinned to its own cores, so that the workers do not compete for
+the same cores. Dead workers are restarted by the master, after a delay that
+doubles each time the worker dies soon after it was started. If a worker keeps
+dying at startup, e.g. because the model cannot be loaded, the master stops
+all workers and exits with an error.
+
+Each worker has its own model registry. A change of the model versions
+through the /models endpoints is sent by the worker that receives it to the
+master, which passes it on to all workers, so that they serve the same
+versions. The change is therefore applied shortly after the response. A
+restarted worker is brought up to date by the master, which replays the
+versions loaded since startup and the active version to it.
+
+Streaming state is held by the worker that created it. The WebSocket endpoint
+/stream, which flow-ribcage.js uses, keeps one connection, and therefore one
+worker, per sensor. HTTP sessions (/session) do not work with more than one
+worker, since the next request of a session may reach another worker.
+
+Example, with one worker per core and one thread per worker:
+
+    $ python serve.py --workers 4 --threads 1 --pin-cores
+
+"""
+import argparse
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "TF_NUM_INTRAOP_THREADS",
+    "TF_NUM_INTEROP_THREADS",
+]
+"""Environment variables limiting the threads of the numerical libraries."""
+
+MIN_UPTIME = 10
+"""Seconds a worker must run to count as started, and not as a failure."""
+
+MAX_FAILURES = 5
+"""Number of failures in a row of one worker before the master gives up."""
+
+RESTART_DELAY = 0.5
+"""Seconds before a worker is restarted after its first failure. The delay
+is doubled for each further failure in a row, up to MAX_RESTART_DELAY."""
+
+MAX_RESTART_DELAY = 30
+"""Longest delay in seconds before a worker is restarted."""
+
+POLL_INTERVAL = 0.1
+"""Seconds between checks of the master for dead workers, while it waits for
+changes of the model versions."""
+
+
+def limit_threads(n_threads):
+    """Limit the threads of the numerical libraries.
+
+    This only has effect for libraries that are not yet imported, and must
+    therefore be called before NumPy or TensorFlow is imported.
+
+    Args:
+        n_threads (int): Number of threads.
+
+    """
+
+    if "numpy" in sys.modules:
+        raise RuntimeError("Thread limits must be set before importing NumPy.")
+
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+
+
+def worker_cores(worker, n_threads):
+    """Cores of a worker, when each worker is pinned to its own cores.
+
+    Args:
+        worker (int): Index of worker.
+        n_threads (int): Number of threads of each worker.
+
+    Returns:
+        cores (set of int): Cores the worker is pinned to. If there are more
+            threads than cores, the cores are shared in turn.
+
+    """
+
+    available = sorted(os.sched_getaffinity(0))
+
+    return {
+        available[(worker * n_threads + i) % len(available)]
+        for i in range(n_threads)
+    }
+
+
+def encode_change(change):
+    """Encode a change of the model versions as one line, for a pipe."""
+
+    return (json.dumps(change) + "\n").encode()
+
+
+class VersionLog:
+    """Model versions loaded and activated through the /models endpoints.
+
+    The master keeps the log to bring restarted workers up to date.
+
+    """
+
+    def __init__(self):
+
+        self.loaded = {}
+        self.active = None
+
+    def record(self, change):
+        """Record a change of the model versions (see app.py)."""
+
+        action = change["action"]
+        version = change["version"]
+
+        if action == "load":
+            # Moved to the end, so versions are replayed in order of loading
+            self.loaded.pop(version, None)
+            self.loaded[version] = True
+
+            if change.get("activate", True):
+                self.active = version
+        elif action == "activate":
+            self.active = version
+        elif action == "unload":
+            self.loaded.pop(version, None)
+
+    def replay(self):
+        """Changes bringing a newly started worker up to date.
+
+        Returns:
+            changes (list of dict): A load of each loaded version, of which
+                only the active one is activated, and an activation of the
+                active version if it was loaded at startup.
+
+        """
+
+        changes = [
+            {"action": "load", "version": version,
+                "activate": version == self.active}
+            for version in self.loaded
+        ]
+
+        if self.active is not None and self.active not in self.loaded:
+            changes.append({"action": "activate", "version": self.active})
+
+        return changes
+
+
+def follow_changes(app, fd):
+    """Apply the changes of the model versions sent by the master.
+
+    Args:
+        app (module): The app module of the worker.
+        fd (int): Read end of the pipe from the master.
+
+    """
+
+    with os.fdopen(fd) as f:
+        for line in f:
+            try:
+                app.apply_registry_change(json.loads(line))
+            except (KeyError, ValueError) as e:
+                print(f"Worker {os.getpid()} could not change the model "
+                        f"versions: {e!r}")
+
+
+def run_worker(listener, host, port, cores=None, backend=None, pipes=None):
+    """Load the app and serve requests on the shared socket.
+
+    Args:
+        listener (socket): Listening socket, opened by the master.
+        host (str): Host of the server.
+        port (int): Port of the server.
+        cores (set of int): Cores to pin the worker to, or None.
+        backend (str): Inference backend, or None for the one set in
+            model_loader.py.
+        pipes (tuple of int): Read end of the pipe of changes of the model
+            versions from the master, and write end of the pipe to the
+            master, or None to apply the changes in this worker only.
+
+    """
+
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+
+    # Imported after the fork, so that the thread limits apply and each worker
+    # has its own batching threads.
+    from werkzeug.serving import make_server
+
+    import app
+    import model_loader
+
+    if backend is not None:
+        model_loader.backend = backend
+
+    app.create_app()
+
+    if pipes is not None:
+        changes_from_master, changes_to_master = pipes
+        app.share_registry_change = lambda change: os.write(
+            changes_to_master, encode_change(change)
+        )
+        threading.Thread(target=follow_changes,
+                args=(app, changes_from_master), daemon=True).start()
+
+    server = make_server(host, port, app.app, threaded=True,
+            fd=listener.fileno())
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    server.serve_forever()
+
+
+def serve(host="127.0.0.1", port=5000, n_workers=None, n_threads=1,
+        pin_cores=False, backend=None):
+    """Run the app in several worker processes.
+
+    Args:
+        host (str): Host of the server.
+        port (int): Port of the server.
+        n_workers (int): Number of worker processes. If None, one worker per
+            available core is started.
+        n_threads (int): Number of threads of the numerical libraries in each
+            worker.
+        pin_cores (bool): Whether to pin each worker to its own cores.
+        backend (str): Inference backend, or None for the one set in
+            model_loader.py.
+
+    Returns:
+        status (int): Exit status, 1 if a worker failed MAX_FAILURES times in
+            a row, otherwise 0.
+
+    """
+
+    if n_workers is None:
+        n_workers = max(1, len(os.sched_getaffinity(0)) // n_threads)
+
+    limit_threads(n_threads)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+
+    # Changes of the model versions are sent by the workers on one shared
+    # pipe, and passed on by the master on one pipe per worker
+    changes_r, changes_w = os.pipe()
+    pipes = {}
+    buffer = b""
+    log = VersionLog()
+
+    workers = {}
+    started = {}
+    failures = [0] * n_workers
+    restarts = {}
+    stopping = False
+    status = 0
+
+    def spawn(worker):
+        cores = worker_cores(worker, n_threads) if pin_cores else None
+        r, w = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            for fd in [changes_r, w, *pipes.values()]:
+                os.close(fd)
+
+            try:
+                run_worker(listener, host, port, cores, backend,
+                        (r, changes_w))
+            except Exception:
+                traceback.print_exc()
+                os._exit(1)
+            finally:
+                os._exit(0)
+
+        os.close(r)
+
+        # Written before the worker reads it, which the pipe buffers
+        for change in log.replay():
+            os.write(w, encode_change(change))
+
+        workers[pid] = worker
+        pipes[pid] = w
+        started[worker] = time.monotonic()
+
+    def share(change):
+        log.record(change)
+
+        for w in pipes.values():
+            try:
+                os.write(w, encode_change(change))
+            except OSError:
+                # The worker has died, and is restarted with the log
+                pass
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+        for pid in list(workers):
+            os.kill(pid, signal.SIGTERM)
+
+    def restart(pid, worker):
+        nonlocal status
+
+        if time.monotonic() - started[worker] < MIN_UPTIME:
+            failures[worker] += 1
+        else:
+            failures[worker] = 0
+
+        if failures[worker] >= MAX_FAILURES:
+            print(f"Worker {worker} failed {MAX_FAILURES} times in a row, "
+                    "stopping")
+            status = 1
+            stop(None, None)
+            return
+
+        delay = 0
+
+        if failures[worker] > 0:
+            delay = min(RESTART_DELAY * 2 ** (failures[worker] - 1),
+                    MAX_RESTART_DELAY)
+
+        print(f"Worker {worker} (pid {pid}) exited, restarting in "
+                f"{delay:.1f} s")
+        restarts[worker] = time.monotonic() + delay
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker in range(n_workers):
+        spawn(worker)
+
+    print("Serving on http://{}:{} with {} workers of {} thread(s)".format(
+        host, port, n_workers, n_threads
+    ))
+
+    while workers or restarts:
+        readable, _, _ = select.select([changes_r], [], [], POLL_INTERVAL)
+
+        if readable:
+            buffer += os.read(changes_r, 65536)
+            *lines, buffer = buffer.split(b"\n")
+
+            for line in lines:
+                share(json.loads(line))
+
+        while workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                break
+
+            worker = workers.pop(pid, None)
+
+            if pid in pipes:
+                os.close(pipes.pop(pid))
+
+            if worker is not None and not stopping:
+                restart(pid, worker)
+
+        for worker, restart_time in list(restarts.items()):
+            if stopping or restart_time <= time.monotonic():
+                del restarts[worker]
+
+                if not stopping:
+                    spawn(worker)
+
+    listener.close()
+    os.close(changes_r)
+    os.close(changes_w)
+
+    return status
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Pre-fork multi-process airflow estimation server"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=None,
+            help="number of worker processes, default one per core")
+    parser.add_argument("--threads", type=int, default=1,
+            help="threads of the numerical libraries in each worker")
+    parser.add_argument("--pin-cores", action="store_true",
+            help="pin each worker to its own cores")
+    parser.add_argument("--backend", choices=["keras", "numpy"], default=None,
+            help="inference backend, default as set in model_loader.py")
+    args = parser.parse_args()
+
+    sys.exit(serve(args.host, args.port, args.workers, args.threads,
+            args.pin_cores, args.backend))
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Stateful streaming sessions for real-time airflow estimation.
+
+A client opens a session, and then pushes only the new ribcage samples of each
+sensor notification. The server keeps the streaming feature state and a ring
+buffer of the already computed feature rows, so each push only processes the
+delta.
+
+"""
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from preprocess.streaming_features import StreamingFeatures
+
+
+class RingBuffer:
+    """Fixed-capacity buffer holding the most recent rows of a 2D array.
+
+    Args:
+        capacity (int): Maximum number of rows kept.
+        n_columns (int): Number of columns of each row.
+        dtype: Data type of buffer.
+
+    """
+
+    def __init__(self, capacity, n_columns=1, dtype=np.float64):
+
+        self.capacity = capacity
+        self.data = np.zeros((capacity, n_columns), dtype=dtype)
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+
+        return self.size
+
+    def extend(self, rows):
+        """Append rows, overwriting the oldest rows when full.
+
+        Args:
+            rows (array): Rows to append, of shape (n, n_columns).
+
+        """
+
+        rows = np.asarray(rows).reshape(-1, self.data.shape[1])
+
+        if len(rows) > self.capacity:
+            rows = rows[-self.capacity:]
+
+        n = len(rows)
+        end = self.head + n
+
+        if end <= self.capacity:
+            self.data[self.head:end] = rows
+        else:
+            split = self.capacity - self.head
+            self.data[self.head:] = rows[:split]
+            self.data[:n - split] = rows[split:]
+
+        self.head = end % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def latest(self, n=None):
+        """Return the n most recent rows in chronological order.
+
+        Args:
+            n (int): Number of rows to return. Default: all rows in buffer.
+
+        Returns:
+            rows (array): Copy of the most recent rows.
+
+        """
+
+        if n is None or n > self.size:
+            n = self.size
+
+        idx = (self.head - n + np.arange(n)) % self.capacity
+
+        return self.data[idx]
+
+
+class Session:
+    """Streaming state of one sensor.
+
+    Feature rows are computed incrementally by StreamingFeatures. Since the
+    gradient is a central difference, the estimation window ends one sample
+    before the newest one, which gives the same features as the offline
+    pipeline.
+
+    The session holds the model version it is pinned to until it is closed,
+    so the version keeps serving the session if it is replaced or unloaded
+    meanwhile.
+
+    Args:
+        hist_size (int): Number of feature rows in each estimation window.
+        features (list): Features to compute, as in params.yaml.
+        version (ModelVersion): Model version the session is pinned to.
+        **feature_params: Arguments passed on to StreamingFeatures.
+
+    """
+
+    def __init__(self, hist_size,
+            features=("ribcage_gradient", "ribcage_slope_cyclic"),
+            version=None, **feature_params):
+
+        self.hist_size = hist_size
+        self.version = version
+        self.engine = StreamingFeatures(features, **feature_params)
+        self.features = RingBuffer(hist_size, self.engine.n_features)
+
+        self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+
+        if version is not None:
+            version.acquire()
+
+    def close(self):
+        """Release the model version of the session."""
+
+        with self.lock:
+            version, self.version = self.version, None
+
+        if version is not None:
+            version.release()
+
+    def push(self, values):
+        """Add new raw samples and store the feature rows they finalize.
+
+        Args:
+            values (array): New raw ribcage samples.
+
+        """
+
+        self.features.extend(self.engine.update(values))
+
+    def window(self):
+        """Return the current estimation window.
+
+        Returns:
+            X (array): Array of shape (hist_size, n_features), or None if not
+                enough samples have been pushed yet.
+
+        """
+
+        if len(self.features) < self.hist_size:
+            return None
+
+        return self.features.latest()
+
+
+class SessionStore:
+    """Thread-safe collection of open sessions.
+
+    Args:
+        timeout (float): Sessions idle for longer than this many seconds are
+            closed.
+        **session_kwargs: Default arguments passed on to Session.
+
+    """
+
+    def __init__(self, timeout=60, **session_kwargs):
+
+        self.timeout = timeout
+        self.session_kwargs = session_kwargs
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+
+        return len(self._sessions)
+
+    def create(self, **session_kwargs):
+        """Open a new session.
+
+        Args:
+            **session_kwargs: Arguments passed on to Session, overriding the
+                defaults of the store.
+
+        Returns:
+            session_id (str): Identifier of the new session.
+
+        """
+
+        self.expire()
+
+        session_id = uuid.uuid4().hex
+
+        with self._lock:
+            self._sessions[session_id] = Session(
+                **{**self.session_kwargs, **session_kwargs}
+            )
+
+        return session_id
+
+    def get(self, session_id):
+        """Look up an open session.
+
+        Returns:
+            session (Session): The session, or None if it does not exist.
+
+        """
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+
+        if session is not None:
+            session.last_access = time.monotonic()
+
+        return session
+
+    def close(self, session_id):
+        """Close a session.
+
+        Returns:
+            closed (bool): Whether the session existed.
+
+        """
+
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+
+        if session is None:
+            return False
+
+        session.close()
+
+        return True
+
+    def expire(self):
+        """Close all sessions that have been idle for too long."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            expired = [
+                self._sessions.pop(session_id) for session_id in [
+                    s for s, session in self._sessions.items()
+                    if now - session.last_access > self.timeout
+                ]
+            ]
+
+        for session in expired:
+            session.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compact binary wire format for estimation requests and responses.
+
+Requests with the content type 'application/octet-stream' carry the raw
+ribcage samples as little-endian int16, which is the layout of the int16View
+in flow-ribcage.js. Clients that accept 'application/octet-stream' get the
+airflow estimates back as packed little-endian float32, where NaN means that
+no estimate is available yet. JSON is used otherwise.
+
+Running the module benchmarks parsing and serialization in both formats:
+
+    $ python wire.py
+
+"""
+import json
+import timeit
+
+import numpy as np
+
+
+BINARY_MIMETYPE = "application/octet-stream"
+JSON_MIMETYPE = "application/json"
+
+SAMPLE_DTYPE = np.dtype("<i2")
+ESTIMATE_DTYPE = np.dtype("<f4")
+
+
+def decode_samples(buffer):
+    """Decode raw samples without copying.
+
+    Args:
+        buffer (bytes): Little-endian int16 samples.
+
+    Returns:
+        samples (array): Read-only int16 view of the buffer.
+
+    Raises:
+        ValueError: If the buffer length is not a multiple of the sample size.
+
+    """
+
+    if len(buffer) % SAMPLE_DTYPE.itemsize != 0:
+        raise ValueError("Buffer length must be a multiple of 2 bytes.")
+
+    return np.frombuffer(buffer, dtype=SAMPLE_DTYPE)
+
+
+def encode_samples(samples):
+    """Encode samples as little-endian int16."""
+
+    return np.asarray(samples, dtype=SAMPLE_DTYPE).tobytes()
+
+
+def encode_estimates(y):
+    """Encode airflow estimates as packed little-endian float32.
+
+    Args:
+        y (float or array): Estimate(s). None is encoded as NaN.
+
+    Returns:
+        buffer (bytes): Packed estimates.
+
+    """
+
+    if y is None:
+        y = np.nan
+
+    return np.asarray(y, dtype=ESTIMATE_DTYPE).tobytes()
+
+
+def decode_estimates(buffer):
+    """Decode packed float32 airflow estimates."""
+
+    return np.frombuffer(buffer, dtype=ESTIMATE_DTYPE)
+
+
+def accepts_binary(accept_mimetypes):
+    """Whether a client prefers binary responses over JSON.
+
+    Args:
+        accept_mimetypes: The 'accept_mimetypes' of a Flask request.
+
+    """
+
+    return accept_mimetypes.best_match(
+        [JSON_MIMETYPE, BINARY_MIMETYPE]
+    ) == BINARY_MIMETYPE
+
+
+def benchmark(n_values=51, n_windows=100, number=10000):
+    """Compare parse and serialize cost of JSON and the binary format.
+
+    Args:
+        n_values (int): Number of samples in each window.
+        n_windows (int): Number of windows in the batch case.
+        number (int): Number of repetitions of each measurement.
+
+    """
+
+    rng = np.random.default_rng(2020)
+    samples = rng.integers(1000, 3000, size=(n_windows, n_values))
+    y = rng.normal(size=n_windows).astype(np.float32)
+
+    cases = {
+        "single": (samples[0], y[0]),
+        "batch": (samples, y),
+    }
+
+    for case, (values, estimates) in cases.items():
+        json_body = json.dumps({"value": values.tolist()})
+        binary_body = encode_samples(values)
+
+        if case == "single":
+            json_response = lambda: json.dumps({"airflow": str(estimates)})
+        else:
+            json_response = lambda: json.dumps(
+                {"airflow": [str(v) for v in estimates]}
+            )
+
+        timings = {
+            "json parse": lambda: np.array(json.loads(json_body)["value"]),
+            "binary parse": lambda: decode_samples(binary_body),
+            "json serialize": json_response,
+            "binary serialize": lambda: encode_estimates(estimates),
+        }
+
+        print("{} ({} request bytes JSON, {} binary):".format(
+            case, len(json_body), len(binary_body)
+        ))
+
+        for name, function in timings.items():
+            t = timeit.timeit(function, number=number) / number
+            print("    {:<18}{:10.2f} us".format(name, t * 1e6))
+
+
+if __name__ == "__main__":
+
+    benchmark()